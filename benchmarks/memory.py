@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+#
+# Reports the memory used per transaction record by the accounting tool, run it from the checkouts
+#  to be compared, i.e. python benchmarks/memory.py -n 100000
+
+import os
+import sys
+import io
+import csv
+import random
+import argparse
+import tracemalloc
+import contextlib
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# pylint: disable=wrong-import-position
+from bittytax.config import config
+from bittytax.session import Session
+from bittytax.import_records import ImportRecords
+from bittytax.single_pass import SinglePass
+from bittytax.tax import TaxCalculator
+
+ASSETS = ['BTC', 'ETH', 'XRP', 'LTC', 'ADA', 'DOT', 'SOL', 'DOGE']
+WALLETS = ['Binance', 'Kraken', 'Coinbase', 'Ledger']
+
+class FixedValueAsset(object):
+    # Values every asset at a fixed price, so no prices are looked up
+    def __init__(self):
+        self.price_report = {}
+
+    @staticmethod
+    def prefetch(_price_requests):
+        pass
+
+    @staticmethod
+    def get_value(asset, _timestamp, quantity):
+        if asset == config.ccy:
+            return quantity, True
+        return quantity * (ASSETS.index(asset) + 1) * 10, False
+
+def generate_csv(n, seed):
+    rng = random.Random(seed)
+    start = datetime(2017, 1, 1)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Type', 'Buy Quantity', 'Buy Asset', 'Buy Value',
+                     'Sell Quantity', 'Sell Asset', 'Sell Value',
+                     'Fee Quantity', 'Fee Asset', 'Fee Value',
+                     'Wallet', 'Timestamp', 'Note'])
+
+    for _ in range(n):
+        timestamp = start + timedelta(seconds=rng.randint(0, 5 * 365 * 86400))
+        asset = rng.choice(ASSETS)
+        quantity = str(Decimal(rng.randint(1, 10**8)) / 10**6)
+        value = str(Decimal(rng.randint(1, 10**7)) / 100)
+        fee = ['0.0001', asset, ''] if rng.random() < 0.3 else ['', '', '']
+        t_type = rng.random()
+
+        if t_type < 0.4:
+            row = ['Trade', quantity, asset, value, value, 'GBP', value]
+        elif t_type < 0.7:
+            row = ['Trade', value, 'GBP', value, quantity, asset, value]
+        elif t_type < 0.8:
+            row = ['Staking', quantity, asset, '', '', '', '']
+        elif t_type < 0.9:
+            row = ['Deposit', quantity, asset, '', '', '', '']
+            fee = ['', '', '']
+        else:
+            row = ['Withdrawal', '', '', '', quantity, asset, '']
+            fee = ['', '', '']
+
+        writer.writerow(row + fee + [rng.choice(WALLETS), timestamp.isoformat() + 'Z',
+                                     rng.choice(['', 'note'])])
+
+    output.seek(0)
+    output.name = '<benchmark>'
+    return output
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n',
+                        type=int,
+                        default=50000,
+                        help="number of transaction records, default: 50000")
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help="stream the transaction records, as with the --stream option")
+    parser.add_argument('--seed',
+                        type=int,
+                        default=1,
+                        help="random seed for the transaction records, default: 1")
+    args = parser.parse_args()
+
+    csv_file = generate_csv(args.n, args.seed)
+    stages = []
+
+    session = Session(value_asset=FixedValueAsset())
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import_records = ImportRecords(args.stream, session)
+        import_records.import_csv(csv_file)
+        transaction_records = import_records.get_records()
+        stages.append(('import', tracemalloc.get_traced_memory()))
+
+        single_pass = SinglePass(transaction_records, session)
+        stages.append(('transactions', tracemalloc.get_traced_memory()))
+
+        tax = TaxCalculator(single_pass.transactions, session)
+        tax.process_disposals(False)
+        tax.process_income(single_pass.get_income_events())
+        stages.append(('tax', tracemalloc.get_traced_memory()))
+    tracemalloc.stop()
+
+    print("%d transaction records, %d transactions, %d tax events" % (
+        import_records.success_cnt, len(single_pass.transactions),
+        sum(len(tax.tax_events[tax_year]) for tax_year in tax.tax_events)))
+    print("%-14s %14s %14s %20s" % ('Stage', 'Current', 'Peak', 'Bytes/record'))
+    for stage, (current, peak) in stages:
+        print("%-14s %14s %14s %20s" % (stage, '{:,}'.format(current), '{:,}'.format(peak),
+                                         '{:,.0f}'.format(float(current) / args.n)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+#
+# Reports the time taken to parse rows of transaction records, for each transaction type. Run it
+#  from the checkouts to be compared, i.e. python benchmarks/parse.py -n 1000000
+
+import os
+import sys
+import time
+import random
+import argparse
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# pylint: disable=wrong-import-position
+from bittytax.import_records import TransactionRow
+from bittytax.timestamp_parser import TimestampParser
+from bittytax.record import TransactionRecord as TR
+
+ASSETS = ['BTC', 'ETH', 'XRP', 'LTC', 'ADA', 'DOT', 'SOL', 'DOGE']
+WALLETS = ['Binance', 'Kraken', 'Coinbase', 'Ledger']
+BATCH_SIZE = 10000
+
+def generate_row(rng, t_type, timestamp):
+    asset = rng.choice(ASSETS)
+    quantity = str(Decimal(rng.randint(1, 10**8)) / 10**6)
+    value = str(Decimal(rng.randint(1, 10**7)) / 100)
+    buy = sell = ['', '', '']
+    fee = [quantity, asset, ''] if rng.random() < 0.3 and t_type != TR.TYPE_LOST else ['', '', '']
+
+    if t_type == TR.TYPE_TRADE:
+        if rng.random() < 0.5:
+            buy, sell = [quantity, asset, value], [value, 'GBP', value]
+        else:
+            buy, sell = [value, 'GBP', value], [quantity, asset, value]
+    elif TransactionRow.TYPE_VALIDATION[t_type][1]:
+        buy = [quantity, asset, rng.choice(['', value])]
+    else:
+        sell = [quantity, asset, rng.choice(['', value])]
+
+    return [t_type] + buy + sell + fee + [rng.choice(WALLETS), timestamp.isoformat() + 'Z',
+                                          rng.choice(['', 'note'])]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n',
+                        type=int,
+                        default=1000000,
+                        help="number of rows, default: 1000000")
+    parser.add_argument('--seed',
+                        type=int,
+                        default=1,
+                        help="random seed for the rows, default: 1")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime(2017, 1, 1)
+    timestamp_parser = TimestampParser()
+    elapsed = {t_type: 0.0 for t_type in TR.ALL_TYPES}
+    cnts = {t_type: 0 for t_type in TR.ALL_TYPES}
+
+    # Rows are generated in batches, so only the parsing is timed
+    for batch_start in range(0, args.n, BATCH_SIZE):
+        rows = []
+        for i in range(batch_start, min(batch_start + BATCH_SIZE, args.n)):
+            t_type = TR.ALL_TYPES[i % len(TR.ALL_TYPES)]
+            rows.append(generate_row(rng, t_type, start + timedelta(seconds=i * 37)))
+
+        for row in rows:
+            t_row = TransactionRow(row, 0)
+            t_start = time.time()
+            t_row.parse(timestamp_parser)
+            elapsed[row[0]] += time.time() - t_start
+            cnts[row[0]] += 1
+
+    print("%-16s %10s %12s" % ('Type', 'Rows', 'us/row'))
+    for t_type in TR.ALL_TYPES:
+        print("%-16s %10s %12.2f" % (t_type, '{:,}'.format(cnts[t_type]),
+                                      elapsed[t_type] * 1e6 / max(cnts[t_type], 1)))
+    print("%-16s %10s %12.2f" % ('Total', '{:,}'.format(args.n),
+                                  sum(elapsed.values()) * 1e6 / max(args.n, 1)))
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 # (c) Nano Nano Ltd 2019
 
 import sys
+from bisect import bisect_right
 from decimal import Decimal
 
 import csv
@@ -10,34 +11,60 @@ from colorama import Fore, Back, Style
 from tqdm import tqdm
 
 from .config import config
+from .tracing import tracer
 
 
 class AuditRecords(object):
-    def __init__(self, transaction_records):
+    def __init__(self, transaction_records=None):
         self.wallets = {}
         self.totals = {}
         self.failures = []
 
+        # Every change to the balance of each wallet and asset, the records are audited in
+        #  timestamp order, so each timeline is too
+        self.timelines = {}
+
+        if transaction_records is not None:
+            if config.debug:
+                print("%saudit transaction records" % Fore.CYAN)
+
+            for tr in tqdm(transaction_records,
+                           unit='tr',
+                           desc="%saudit transaction records%s" % (
+                               Fore.CYAN, Fore.GREEN),
+                           disable=bool(config.debug or not sys.stdout.isatty())):
+                self.audit_record(tr)
+
+            self.audit_complete()
+
+    def stream(self, transaction_records):
+        # Each record is audited as it passes through, the audit is complete after the last
         if config.debug:
             print("%saudit transaction records" % Fore.CYAN)
 
-        for tr in tqdm(transaction_records,
-                       unit='tr',
-                       desc="%saudit transaction records%s" % (
-                           Fore.CYAN, Fore.GREEN),
-                       disable=bool(config.debug or not sys.stdout.isatty())):
-            if config.debug:
-                print("%saudit: TR %s" % (Fore.MAGENTA, tr))
-            if tr.buy:
-                self._add_tokens(tr.wallet, tr.buy.asset, tr.buy.quantity)
+        for tr in transaction_records:
+            self.audit_record(tr)
+            yield tr
+
+        self.audit_complete()
+
+    def audit_record(self, tr):
+        if config.debug:
+            print("%saudit: TR %s" % (Fore.MAGENTA, tr))
+        if tracer.audit:
+            tracer.event('audit', 'record', tid=tr.tid, type=tr.t_type, wallet=tr.wallet,
+                         timestamp=tr.timestamp)
+        if tr.buy:
+            self._add_tokens(tr.wallet, tr.buy.asset, tr.buy.quantity, tr.timestamp)
 
-            if tr.sell:
-                self._subtract_tokens(
-                    tr.wallet, tr.sell.asset, tr.sell.quantity)
+        if tr.sell:
+            self._subtract_tokens(
+                tr.wallet, tr.sell.asset, tr.sell.quantity, tr.timestamp)
 
-            if tr.fee:
-                self._subtract_tokens(tr.wallet, tr.fee.asset, tr.fee.quantity)
+        if tr.fee:
+            self._subtract_tokens(tr.wallet, tr.fee.asset, tr.fee.quantity, tr.timestamp)
 
+    def audit_complete(self):
         if config.debug:
             print("%saudit: final balances by wallet" % Fore.CYAN)
             for wallet in sorted(self.wallets, key=str.lower):
@@ -60,10 +87,19 @@ class AuditRecords(object):
                     '{:0,f}'.format(self.totals[asset].normalize()),
                     Style.NORMAL))
 
+            print("%saudit: negative balances" % Fore.CYAN)
+            for wallet, asset, start, end in self.negative_balances():
+                print("%saudit: %s:%s from %s to %s" % (
+                    Fore.YELLOW,
+                    wallet,
+                    asset,
+                    start.isoformat(),
+                    end.isoformat() if end else '<end>'))
+
         if config.audit_hide_empty:
             self._prune_empty(self.wallets)
 
-    def _add_tokens(self, wallet, asset, quantity):
+    def _add_tokens(self, wallet, asset, quantity, timestamp):
         if wallet not in self.wallets:
             self.wallets[wallet] = {}
 
@@ -71,6 +107,7 @@ class AuditRecords(object):
             self.wallets[wallet][asset] = Decimal(0)
 
         self.wallets[wallet][asset] += quantity
+        self._get_timeline(wallet, asset).append(timestamp, self.wallets[wallet][asset])
 
         if asset not in self.totals:
             self.totals[asset] = Decimal(0)
@@ -84,8 +121,11 @@ class AuditRecords(object):
                 asset,
                 '{:0,f}'.format(self.wallets[wallet][asset].normalize()),
                 '{:0,f}'.format(quantity.normalize())))
+        if tracer.audit:
+            tracer.event('audit', 'add', wallet=wallet, asset=asset, quantity=quantity,
+                         balance=self.wallets[wallet][asset])
 
-    def _subtract_tokens(self, wallet, asset, quantity):
+    def _subtract_tokens(self, wallet, asset, quantity, timestamp):
         if wallet not in self.wallets:
             self.wallets[wallet] = {}
 
@@ -93,6 +133,7 @@ class AuditRecords(object):
             self.wallets[wallet][asset] = Decimal(0)
 
         self.wallets[wallet][asset] -= quantity
+        self._get_timeline(wallet, asset).append(timestamp, self.wallets[wallet][asset])
 
         if asset not in self.totals:
             self.totals[asset] = Decimal(0)
@@ -106,12 +147,56 @@ class AuditRecords(object):
                 asset,
                 '{:0,f}'.format(self.wallets[wallet][asset].normalize()),
                 '{:0,f}'.format(quantity.normalize())))
+        if tracer.audit:
+            tracer.event('audit', 'subtract', wallet=wallet, asset=asset, quantity=quantity,
+                         balance=self.wallets[wallet][asset])
 
         if self.wallets[wallet][asset] < 0 and asset not in config.fiat_list:
             tqdm.write("%sWARNING%s Balance at %s:%s is negative %s" % (
                 Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW,
                 wallet, asset, '{:0,f}'.format(self.wallets[wallet][asset].normalize())))
 
+    def _get_timeline(self, wallet, asset):
+        if wallet not in self.timelines:
+            self.timelines[wallet] = {}
+
+        if asset not in self.timelines[wallet]:
+            self.timelines[wallet][asset] = BalanceTimeline()
+
+        return self.timelines[wallet][asset]
+
+    def balance_at(self, wallet, asset, timestamp):
+        if wallet not in self.timelines or asset not in self.timelines[wallet]:
+            return None
+        return self.timelines[wallet][asset].balance_at(timestamp)
+
+    def balances_at(self, timestamp):
+        # Balances by wallet at a point in time, i.e. the end of a tax year, only those with
+        #  activity before it are included
+        wallets = {}
+        for wallet in self.timelines:
+            for asset in self.timelines[wallet]:
+                balance = self.timelines[wallet][asset].balance_at(timestamp)
+                if balance is not None:
+                    if wallet not in wallets:
+                        wallets[wallet] = {}
+                    wallets[wallet][asset] = balance
+
+        if config.audit_hide_empty:
+            self._prune_empty(wallets)
+        return wallets
+
+    def negative_balances(self):
+        negative_balances = []
+        for wallet in sorted(self.timelines, key=str.lower):
+            for asset in sorted(self.timelines[wallet]):
+                if asset in config.fiat_list:
+                    continue
+
+                for start, end in self.timelines[wallet][asset].negative_intervals():
+                    negative_balances.append((wallet, asset, start, end))
+        return negative_balances
+
     def _prune_empty(self, wallets):
         for wallet in list(wallets):
             for asset in list(wallets[wallet]):
@@ -120,7 +205,40 @@ class AuditRecords(object):
             if len(wallets[wallet]) == 0:
                 wallets.pop(wallet)
 
+    def integrity_check(self, holdings):
+        int_passed = True
+
+        if config.transfers_include:
+            transfer_mismatch = bool([asset for asset in holdings if holdings[asset].mismatches])
+        else:
+            transfer_mismatch = False
+
+        pools_match = self.compare_pools(holdings)
+
+        if not pools_match or transfer_mismatch:
+            int_passed = False
+
+        print("%sintegrity check: %s%s" % (
+            Fore.CYAN, Fore.YELLOW, 'passed' if int_passed else 'failed'))
+
+        if transfer_mismatch:
+            print("%sWARNING%s Integrity check failed: disposal(s) detected during transfer, "
+                  "turn on logging [-d] to see transactions" % (
+                      Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW))
+        elif not pools_match:
+            if not config.transfers_include:
+                print("%sWARNING%s Integrity check failed: audit does not match section 104 "
+                      "pools, please check Withdrawals and Deposits for missing fees" % (
+                          Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW))
+            else:
+                print("%sERROR%s Integrity check failed: audit does not match section 104 "
+                      "pools" % (Back.RED+Fore.BLACK, Back.RESET+Fore.RED))
+            self.report_failures()
+        return int_passed
+
     def compare_pools(self, holdings):
+        # The audit can be compared against more than one calculation, i.e. for scenarios
+        self.failures = []
         passed = True
         for asset in sorted(self.totals):
             if asset in config.fiat_list:
@@ -197,3 +315,43 @@ class AuditRecords(object):
                         '{:0,f}'.format(failure['audit'].normalize()),
                         '<missing>'
                     ])
+
+class BalanceTimeline(object):
+    # Balance after each change, with the timestamp of the change
+    __slots__ = ('timestamps', 'balances')
+
+    def __init__(self):
+        self.timestamps = []
+        self.balances = []
+
+    def append(self, timestamp, balance):
+        self.timestamps.append(timestamp)
+        self.balances.append(balance)
+
+    def balance_at(self, timestamp):
+        # Balance after all of the changes up to, and including, the timestamp
+        pos = bisect_right(self.timestamps, timestamp)
+        if pos == 0:
+            return None
+        return self.balances[pos - 1]
+
+    def negative_intervals(self):
+        # Each interval ends when the balance is no longer negative, or is still open (None).
+        #  An interval which ends and starts again at the same time, i.e. within a record, is
+        #  carried on.
+        intervals = []
+        start = None
+
+        for timestamp, balance in zip(self.timestamps, self.balances):
+            if balance < 0 and start is None:
+                if intervals and intervals[-1][1] == timestamp:
+                    start = intervals.pop()[0]
+                else:
+                    start = timestamp
+            elif balance >= 0 and start is not None:
+                intervals.append((start, timestamp))
+                start = None
+
+        if start is not None:
+            intervals.append((start, None))
+        return intervals
@@ -4,9 +4,16 @@
 
 import argparse
 import io
+import os
+import re
 import sys
+import csv
+import copy
+import time
 import codecs
+import traceback
 import platform
+import multiprocessing
 
 import colorama
 from colorama import Fore, Back
@@ -17,12 +24,22 @@ from .config import config
 from .import_records import ImportRecords
 from .export_records import ExportRecords
 from .transactions import TransactionHistory
-from .audit import AuditRecords
+from .single_pass import SinglePass
 from .price.valueasset import ValueAsset
 from .price.exceptions import DataSourceError
-from .tax import TaxCalculator, CalculateCapitalGains as CCG
-from .report import ReportLog, ReportPdf
-from .exceptions import ImportFailureError
+from .tax import TaxCalculator, CalculateCapitalGains as CCG, PRECISION, CapturedOutput
+from .checkpoint import Checkpoints
+from .parse_cache import ParseCache
+from .session import Session
+from .tracing import tracer
+from .scenario import Scenario, ScenarioRunner, validate_scenario
+from .report import ReportLog, ReportPdf, ReportScenarios
+from .exceptions import ImportFailureError, BatchFilenameError
+
+BATCH_FILE_EXTENSIONS = ('.csv', '.xls', '.xlsx')
+BATCH_SUMMARY_FILENAME = 'batch_summary.csv'
+
+_batch_price_data = None
 
 if sys.stdout.encoding != 'UTF-8':
     if sys.version_info[:2] >= (3, 7):
@@ -39,7 +56,8 @@ def main():
                         type=str,
                         nargs='?',
                         help="filename of transaction records, "
-                             "or can read CSV data from standard input")
+                             "or can read CSV data from standard input, "
+                             "or directory/manifest of files with the --batch option")
     parser.add_argument('-v',
                         '--version',
                         action='version',
@@ -70,6 +88,11 @@ def main():
     parser.add_argument('--summary',
                         action='store_true',
                         help="only output the capital gains summary in the tax report")
+    parser.add_argument('--walletbalances',
+                        dest='wallet_balances',
+                        action='store_true',
+                        help="include the wallet balances at the end of each tax year in the tax "
+                             "report")
     parser.add_argument('-o',
                         dest='output_filename',
                         type=str,
@@ -80,6 +103,49 @@ def main():
     parser.add_argument('--export',
                         action='store_true',
                         help="export your transaction records populated with price data")
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=1,
+                        help="number of processes used to import and calculate the assets in "
+                             "parallel, default: 1")
+    parser.add_argument('--checkpoint',
+                        action='store_true',
+                        help="resume the tax calculation from the last unchanged tax year")
+    parser.add_argument('--nocache',
+                        dest='no_cache',
+                        action='store_true',
+                        help="don't use the parse cache of transaction record files")
+    parser.add_argument('--fixedcheck',
+                        dest='fixed_point_check',
+                        action='store_true',
+                        help="check the fixed point and decimal calculations are equivalent")
+    parser.add_argument('--trace',
+                        dest='trace_filename',
+                        type=str,
+                        help="write a trace of the calculation to this file (JSON lines), "
+                             "compressed if the filename ends with .gz")
+    parser.add_argument('--tracecat',
+                        type=validate_trace_categories,
+                        dest='trace_categories',
+                        metavar='CATEGORY[,CATEGORY...]',
+                        help="only trace these categories {%s}, default: all" % (
+                            ', '.join(tracer.CATEGORIES)))
+    parser.add_argument('--batch',
+                        action='store_true',
+                        help="process each file of transaction records in a directory, or listed "
+                             "in a manifest file, the -o option specifies the output directory")
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help="stream the transaction records through the import, audit and "
+                             "valuation, so they are not all held in memory")
+    parser.add_argument('--scenario',
+                        type=validate_scenario,
+                        action='append',
+                        dest='scenarios',
+                        metavar='KEY=VALUE[,KEY=VALUE...]',
+                        help="compare the tax calculation with these config options (or "
+                             "tax_rules) changed, can be given more than once")
 
     args = parser.parse_args()
     config.debug = args.debug
@@ -90,33 +156,81 @@ def main():
         print("%ssystem: %s, release: %s" % (Fore.GREEN, platform.system(), platform.release()))
         config.output_config()
 
+    if args.trace_filename:
+        tracer.open(args.trace_filename, args.trace_categories)
+
     if args.tax_rules in config.TAX_RULES_UK_COMPANY:
         config.start_of_year_month = config.TAX_RULES_UK_COMPANY.index(args.tax_rules) + 1
         config.start_of_year_day = 1
 
+    if args.stream and (args.batch or args.scenarios or args.checkpoint or args.export):
+        parser.error("the --stream option cannot be used with --batch, --scenario, "
+                     "--checkpoint or --export")
+
+    if args.batch:
+        if not args.filename:
+            parser.error("a directory or manifest file is required with the --batch option")
+
+        try:
+            do_batch(args, parser.prog)
+        except DataSourceError as e:
+            parser.exit("%sERROR%s %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
+        except IOError:
+            parser.exit("%sERROR%s File could not be read: %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, args.filename))
+        except BatchFilenameError as e:
+            parser.exit("%sERROR%s %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
+        parser.exit()
+
+    session = Session(args.tax_rules)
+
     try:
-        transaction_records = do_import(args.filename)
+        import_records = do_import(args.filename, args.stream, args.jobs, not args.no_cache,
+                                   session)
     except IOError:
         parser.exit("%sERROR%s File could not be read: %s" % (
             Back.RED+Fore.BLACK, Back.RESET+Fore.RED, args.filename))
     except ImportFailureError:
         parser.exit()
 
-    if args.export:
-        do_export(transaction_records)
+    if args.scenarios:
+        try:
+            do_scenarios(import_records, args)
+        except DataSourceError as e:
+            parser.exit("%sERROR%s %s" % (
+                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
         parser.exit()
 
-    audit = AuditRecords(transaction_records)
+    transaction_records = import_records.get_records()
+
+    if args.export:
+        do_export(transaction_records, session)
+        parser.exit()
 
     try:
-        tax, value_asset = do_tax(transaction_records, args.tax_rules, args.skip_integrity)
+        # The records are audited and split in a single pass, so a stream is only read once
+        tax, single_pass, checkpoints = do_tax(transaction_records, session,
+                                               args.skip_integrity, args.jobs,
+                                               args.checkpoint and not args.summary and
+                                               not args.fixed_point_check)
+        audit = single_pass.audit
+        value_asset = session.value_asset
+
         if not args.skip_integrity:
-            int_passed = do_integrity_check(audit, tax.holdings)
+            int_passed = audit.integrity_check(tax.holdings)
             if not int_passed:
                 parser.exit()
 
+        if args.fixed_point_check:
+            do_fixed_point_check(tax, args.skip_integrity)
+
         if not args.summary:
-            tax.process_income()
+            tax.process_income(single_pass.get_income_events())
+
+            if checkpoints:
+                checkpoints.save(tax.checkpoints, tax.tax_events, value_asset.price_report)
 
         do_each_tax_year(tax,
                          args.taxyear,
@@ -152,15 +266,39 @@ def validate_year(value):
 
     return year
 
-def do_import(filename):
-    import_records = ImportRecords()
+def validate_trace_categories(value):
+    categories = [c.strip().lower() for c in value.split(',')]
+    for category in categories:
+        if category not in tracer.CATEGORIES:
+            raise argparse.ArgumentTypeError("trace category \"%s\" is not supported, "
+                                             "must be one of (%s)" % (
+                                                 category, ', '.join(tracer.CATEGORIES)))
+    return categories
+
+def do_import(filename, stream=False, jobs=1, use_cache=True, session=None):
+    import_records = ImportRecords(stream, session)
 
     if filename:
-        try:
-            import_records.import_excel(filename)
-        except xlrd.XLRDError:
-            with io.open(filename, newline='', encoding='utf-8') as csv_file:
-                import_records.import_csv(csv_file)
+        parse_cache = ParseCache(filename) if use_cache else None
+        if not parse_cache or not import_records.import_cache(filename, parse_cache):
+            import_records.parse_cache = parse_cache
+            try:
+                try:
+                    import_records.import_excel(filename)
+                except xlrd.XLRDError:
+                    with io.open(filename, newline='', encoding='utf-8') as csv_file:
+                        import_records.import_csv(csv_file, jobs)
+            except:
+                if parse_cache:
+                    parse_cache.discard()
+                raise
+
+            if parse_cache:
+                # Only a successful import is cached
+                if import_records.failure_cnt > 0:
+                    parse_cache.discard()
+                else:
+                    parse_cache.save()
     else:
         if sys.version_info[0] < 3:
             import_records.import_csv(codecs.getreader('utf-8')(sys.stdin))
@@ -174,57 +312,105 @@ def do_import(filename):
     if import_records.failure_cnt > 0:
         raise ImportFailureError
 
-    return import_records.get_records()
+    return import_records
 
-def do_tax(transaction_records, tax_rules, skip_integrity_check):
-    value_asset = ValueAsset()
-    transaction_history = TransactionHistory(transaction_records, value_asset)
+def do_tax(transaction_records, session, skip_integrity_check, jobs=1, checkpoint=False):
+    value_asset = session.value_asset
+    checkpoints = resume_from = None
 
-    tax = TaxCalculator(transaction_history.transactions, tax_rules)
-    tax.pool_same_day()
-    tax.match_sell(tax.DISPOSAL_SAME_DAY)
+    if checkpoint:
+        checkpoints = Checkpoints(transaction_records, session.tax_rules, skip_integrity_check)
+        resume_from = checkpoints.load()
 
-    if tax_rules == config.TAX_RULES_UK_INDIVIDUAL:
-        tax.match_buyback(tax.DISPOSAL_BED_AND_BREAKFAST)
-    elif tax_rules in config.TAX_RULES_UK_COMPANY:
-        tax.match_sell(tax.DISPOSAL_TEN_DAY)
+    if resume_from:
+        print("%sresuming from checkpoint (tax year %s)" % (
+            Fore.WHITE, config.format_tax_year(resume_from.tax_year)))
 
-    tax.process_section104(skip_integrity_check)
-    return tax, value_asset
+        # Only the transaction records after the checkpoint need to be split again
+        value_asset.price_report.update(resume_from.price_report)
+
+    single_pass = SinglePass(transaction_records, session,
+                             resume_from.end if resume_from else None)
 
-def do_integrity_check(audit, holdings):
-    int_passed = True
+    tax = TaxCalculator(single_pass.transactions, session,
+                        checkpoints.new_checkpoints(resume_from) if checkpoints else None,
+                        resume_from)
 
-    if config.transfers_include:
-        transfer_mismatch = transfer_mismatches(holdings)
+    if jobs > 1 and not config.debug and not tracer.enabled:
+        tax.process_disposals_parallel(skip_integrity_check, jobs)
     else:
-        transfer_mismatch = False
+        # Debug logging and tracing are only in order when run serially
+        tax.process_disposals(skip_integrity_check)
 
-    pools_match = audit.compare_pools(holdings)
+    return tax, single_pass, checkpoints
 
-    if not pools_match or transfer_mismatch:
-        int_passed = False
+def do_scenarios(import_records, args):
+    # The first scenario is always the current config, to compare against
+    scenarios = [Scenario(args.tax_rules)] + \
+                [Scenario(args.tax_rules, overrides) for overrides in args.scenarios]
 
-    print("%sintegrity check: %s%s" % (
-        Fore.CYAN, Fore.YELLOW, 'passed' if int_passed else 'failed'))
+    scenario_runner = ScenarioRunner(import_records, ValueAsset(), scenarios)
+    if not scenario_runner.process(args.skip_integrity, args.jobs):
+        return
 
-    if transfer_mismatch:
-        print("%sWARNING%s Integrity check failed: disposal(s) detected during transfer, "
-              "turn on logging [-d] to see transactions" % (
-                  Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW))
-    elif not pools_match:
-        if not config.transfers_include:
-            print("%sWARNING%s Integrity check failed: audit does not match section 104 pools, "
-                  "please check Withdrawals and Deposits for missing fees" % (
-                      Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW))
-        else:
-            print("%sERROR%s Integrity check failed: audit does not match section 104 pools" % (
-                Back.RED+Fore.BLACK, Back.RESET+Fore.RED))
-        audit.report_failures()
-    return int_passed
+    ReportScenarios(scenarios, scenario_runner.tax_reports, args.taxyear)
 
-def transfer_mismatches(holdings):
-    return bool([asset for asset in holdings if holdings[asset].mismatches])
+def do_fixed_point_check(tax, skip_integrity_check):
+    # Calculate again, using the other arithmetic, then compare to the penny
+    other_tax = TaxCalculator(tax.transactions, tax.session, fixed_point=not tax.fixed_point)
+    other_tax.process_disposals(skip_integrity_check)
+
+    if tax.fixed_point:
+        decimal_tax, fixed_point_tax = other_tax, tax
+    else:
+        decimal_tax, fixed_point_tax = tax, other_tax
+
+    differences = []
+    for tax_year in sorted(set(decimal_tax.tax_events) | set(fixed_point_tax.tax_events)):
+        decimal_tes = decimal_tax.tax_events.get(tax_year, [])
+        fixed_point_tes = fixed_point_tax.tax_events.get(tax_year, [])
+
+        if len(decimal_tes) != len(fixed_point_tes):
+            differences.append("%s disposals: %s != %s" % (
+                config.format_tax_year(tax_year), len(decimal_tes), len(fixed_point_tes)))
+            continue
+
+        for te, fixed_te in zip(decimal_tes, fixed_point_tes):
+            for attr in ('cost', 'fees', 'proceeds', 'gain'):
+                if getattr(te, attr) != getattr(fixed_te, attr):
+                    differences.append("%s %s %s %s: %s != %s" % (
+                        te.asset,
+                        te.date.strftime('%d/%m/%Y'),
+                        te.format_disposal(),
+                        attr,
+                        config.sym() + '{:0,.2f}'.format(getattr(te, attr)),
+                        config.sym() + '{:0,.2f}'.format(getattr(fixed_te, attr))))
+
+    for asset in sorted(decimal_tax.holdings):
+        h = decimal_tax.holdings[asset]
+        fixed_h = fixed_point_tax.holdings[asset]
+
+        if h.quantity != fixed_h.quantity:
+            differences.append("%s holding quantity: %s != %s" % (
+                asset,
+                '{:0,f}'.format(h.quantity.normalize()),
+                '{:0,f}'.format(fixed_h.quantity.normalize())))
+
+        if (h.cost + h.fees).quantize(PRECISION) != \
+                (fixed_h.cost + fixed_h.fees).quantize(PRECISION):
+            differences.append("%s holding cost: %s != %s" % (
+                asset,
+                config.sym() + '{:0,.2f}'.format(h.cost + h.fees),
+                config.sym() + '{:0,.2f}'.format(fixed_h.cost + fixed_h.fees)))
+
+    print("%sfixed point check: %s%s" % (
+        Fore.CYAN, Fore.YELLOW, 'failed' if differences else 'passed'))
+
+    for difference in differences:
+        print("%sWARNING%s Fixed point difference (decimal != fixed point), %s" % (
+            Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, difference))
+
+    return not differences
 
 def do_each_tax_year(tax, tax_year, summary, value_asset):
     if tax_year:
@@ -255,7 +441,155 @@ def do_each_tax_year(tax, tax_year, summary, value_asset):
 
     return tax, value_asset
 
-def do_export(transaction_records):
-    value_asset = ValueAsset()
-    TransactionHistory(transaction_records, value_asset)
+def do_batch(args, progname):
+    filenames = get_batch_filenames(args.filename)
+    names = get_batch_names(args.filename, filenames)
+    output_dir = args.output_filename or os.getcwd()
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Price data is loaded once, and then shared by all of the files
+    price_data = ValueAsset().price_data
+    results = []
+    start = time.time()
+
+    print("%sbatch: %s files" % (Fore.WHITE, len(filenames)))
+
+    if args.jobs > 1 and not config.debug and not tracer.enabled:
+        pool = multiprocessing.Pool(args.jobs, _init_batch_worker, (config.__dict__, price_data))
+        try:
+            for result in pool.imap(_process_batch_file,
+                                    [(filename, name, output_dir, args, progname)
+                                     for filename, name in zip(filenames, names)]):
+                price_data.update_prices(result.pop())
+                print_batch_result(result)
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_batch_worker(config.__dict__, price_data)
+        for filename, name in zip(filenames, names):
+            result = _process_batch_file((filename, name, output_dir, args, progname))
+            result.pop()
+            print_batch_result(result)
+            results.append(result)
+
+    with io.open(os.path.join(output_dir, BATCH_SUMMARY_FILENAME), 'w', newline='',
+                 encoding='utf-8') as summary_file:
+        writer = csv.writer(summary_file, lineterminator='\n')
+        writer.writerow(['Filename', 'Status', 'Records', 'Time'])
+        for filename, status, records, elapsed in results:
+            writer.writerow([filename, status, records, '%.2f' % elapsed])
+
+    failures = len([r for r in results if r[1] != 'OK'])
+    print("%sbatch %s (success=%s, failure=%s) in %.2fs, summary: %s%s" % (
+        Fore.WHITE, 'successful' if failures <= 0 else 'failure',
+        len(results) - failures, failures, time.time() - start,
+        Fore.YELLOW, os.path.join(output_dir, BATCH_SUMMARY_FILENAME)))
+
+def get_batch_filenames(filename):
+    if os.path.isdir(filename):
+        return [os.path.join(filename, f) for f in sorted(os.listdir(filename))
+                if os.path.splitext(f)[1].lower() in BATCH_FILE_EXTENSIONS]
+
+    # Manifest lists one filename per line, relative to the manifest's directory
+    filenames = []
+    with io.open(filename, encoding='utf-8') as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                filenames.append(os.path.join(os.path.dirname(filename), line))
+
+    return filenames
+
+def get_batch_names(filename, filenames):
+    # Reports and logs are named after the path of each file, relative to the directory or
+    #  manifest, and keep its extension, i.e. "client.csv" and "client.xlsx" are kept apart
+    base_dir = filename if os.path.isdir(filename) else os.path.dirname(filename)
+    names = [os.path.relpath(f, base_dir or os.curdir).replace(os.sep, '_') for f in filenames]
+
+    # Names are compared ignoring case, as the output directory might not be case-sensitive
+    seen = {}
+    for batch_filename, name in zip(filenames, names):
+        if name.lower() in seen:
+            raise BatchFilenameError(seen[name.lower()], batch_filename)
+        seen[name.lower()] = batch_filename
+
+    return names
+
+def print_batch_result(result):
+    filename, status, records, elapsed = result
+    print("%s%-60s %s%-30s %s%8d %8.2fs" % (
+        Fore.WHITE, filename,
+        Fore.GREEN if status == 'OK' else Fore.RED, status,
+        Fore.WHITE, records, elapsed))
+
+def _init_batch_worker(config_state, price_data):
+    global _batch_price_data
+
+    # Worker processes might not inherit the config, i.e. if they are spawned
+    config.__dict__.update(config_state)
+    _batch_price_data = price_data
+
+def _process_batch_file(batch_args):
+    filename, name, output_dir, args, progname = batch_args
+    price_data = _batch_price_data
+    records = 0
+    start = time.time()
+
+    # Output is logged for each file, which also hides the progress bars
+    stdout = sys.stdout
+    sys.stdout = CapturedOutput()
+    try:
+        # Each file has its own session, so its TIDs are the same however the batch is run
+        session = Session(args.tax_rules, value_asset=ValueAsset(price_data=price_data))
+        import_records = do_import(filename, use_cache=not args.no_cache, session=session)
+        transaction_records = import_records.get_records()
+        records = len(transaction_records)
+
+        tax, single_pass, _ = do_tax(transaction_records, session, args.skip_integrity)
+        audit = single_pass.audit
+        value_asset = session.value_asset
+        if not args.skip_integrity and not audit.integrity_check(tax.holdings):
+            status = 'Integrity check failed'
+        else:
+            if not args.summary:
+                tax.process_income(single_pass.get_income_events())
+
+            do_each_tax_year(tax, args.taxyear, args.summary, value_asset)
+
+            report_args = copy.copy(args)
+            report_args.output_filename = os.path.join(output_dir, name + '.pdf')
+            if args.nopdf:
+                ReportLog(audit, tax.tax_report, value_asset.price_report,
+                          tax.holdings_report, report_args)
+            else:
+                ReportPdf(progname, audit, tax.tax_report, value_asset.price_report,
+                          tax.holdings_report, report_args)
+            status = 'OK'
+    except IOError:
+        status = 'File could not be read'
+    except ImportFailureError:
+        status = 'Import failed'
+    except DataSourceError as e:
+        status = 'Data source error'
+        print("%sERROR%s %s" % (Back.RED+Fore.BLACK, Back.RESET+Fore.RED, e))
+    except Exception:
+        # Any other error only fails this file, the traceback is kept in its log
+        status = 'Unexpected error'
+        traceback.print_exc(file=sys.stdout)
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout = stdout
+
+    with io.open(os.path.join(output_dir, name + '.log'), 'w', encoding='utf-8') as log_file:
+        # Remove the colours
+        log_file.write(re.sub(u'\x1b\\[[0-9;]*m', u'', output))
+
+    return [filename, status, records, time.time() - start, price_data.get_new_prices()]
+
+def do_export(transaction_records, session):
+    TransactionHistory(transaction_records, session)
     ExportRecords(transaction_records).write_csv()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import os
+import copy
+import json
+import hashlib
+import pickle
+from datetime import timedelta
+
+from colorama import Fore, Back
+
+from .version import __version__
+from .config import config
+
+class Checkpoint(object):
+    def __init__(self, tax_year, digest):
+        self.tax_year = tax_year
+        self.end = config.calendar.get_end(tax_year)
+        self.digest = digest
+        self.holdings = {}
+        self.matches = []
+        self.tax_events = {}
+        self.price_report = {}
+
+    def for_asset(self, asset):
+        checkpoint = Checkpoint(self.tax_year, self.digest)
+        if asset in self.holdings:
+            checkpoint.holdings[asset] = self.holdings[asset]
+
+        checkpoint.matches = [m for m in self.matches if m[1].asset == asset]
+        return checkpoint
+
+    def merge(self, other):
+        self.holdings.update(other.holdings)
+        self.matches.extend(other.matches)
+
+    def get_holdings(self):
+        # Assets without any transactions before the checkpoint are marked as None
+        return {asset: copy.copy(self.holdings[asset])
+                for asset in self.holdings if self.holdings[asset] is not None}
+
+class Checkpoints(object):
+    CHECKPOINT_DIR = os.path.join(config.CACHE_DIR, 'checkpoints')
+    FILE_EXTENSION = 'pickle'
+
+    # Matches (bed & breakfast or ten day) can cross the end of a tax year, so a checkpoint also
+    #  depends upon the transaction records which follow it
+    LOOKAHEAD = timedelta(days=30)
+
+    def __init__(self, transaction_records, tax_rules, skip_integrity_check):
+        self.digests = {}
+
+        if not transaction_records:
+            return
+
+        tax_year = config.calendar.which_tax_year(transaction_records[0].timestamp)
+        tax_years = []
+        while self.get_cutoff(tax_year) < transaction_records[-1].timestamp:
+            tax_years.append(tax_year)
+            tax_year += 1
+
+        config_state = config.get_state()
+        sha = hashlib.sha256()
+        sha.update(json.dumps([__version__,
+                               tax_rules,
+                               skip_integrity_check,
+                               config_state['start_of_year_month'],
+                               config_state['start_of_year_day'],
+                               config_state['config']], sort_keys=True,
+                              default=str).encode('utf-8'))
+
+        for tr in transaction_records:
+            while tax_years and tr.timestamp > self.get_cutoff(tax_years[0]):
+                self.digests[tax_years.pop(0)] = sha.hexdigest()
+
+            sha.update(self._record_key(tr))
+
+    def get_cutoff(self, tax_year):
+        return config.calendar.get_end(tax_year) + self.LOOKAHEAD
+
+    @staticmethod
+    def _record_key(tr):
+        # Timestamp in full, as the timezone name is not always unique
+        row = tr.to_csv()
+        row[11] = tr.timestamp.isoformat()
+        return u'\x1f'.join(row).encode('utf-8') + b'\x1e'
+
+    def _get_filename(self, tax_year):
+        return os.path.join(self.CHECKPOINT_DIR,
+                            '%s.%s' % (self.digests[tax_year], self.FILE_EXTENSION))
+
+    def load(self):
+        for tax_year in sorted(self.digests, reverse=True):
+            if not os.path.exists(self._get_filename(tax_year)):
+                continue
+
+            try:
+                with open(self._get_filename(tax_year), 'rb') as checkpoint_file:
+                    checkpoint = pickle.load(checkpoint_file)
+            except (IOError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                print("%sWARNING%s Checkpoint could not be loaded: %s" % (
+                    Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW,
+                    self._get_filename(tax_year)))
+                continue
+
+            if checkpoint.digest == self.digests[tax_year]:
+                if config.debug:
+                    print("%scheckpoint: loaded \"%s\"" % (Fore.GREEN,
+                                                          self._get_filename(tax_year)))
+                return checkpoint
+
+        return None
+
+    def new_checkpoints(self, resume_from=None):
+        return [Checkpoint(tax_year, self.digests[tax_year])
+                for tax_year in sorted(self.digests)
+                if not resume_from or tax_year > resume_from.tax_year]
+
+    def save(self, checkpoints, tax_events, price_report):
+        if not os.path.exists(self.CHECKPOINT_DIR):
+            os.mkdir(self.CHECKPOINT_DIR)
+
+        for checkpoint in checkpoints:
+            checkpoint.tax_events = {tax_year: tax_events[tax_year]
+                                     for tax_year in tax_events
+                                     if tax_year <= checkpoint.tax_year}
+            checkpoint.price_report = {tax_year: price_report[tax_year]
+                                       for tax_year in price_report
+                                       if tax_year <= checkpoint.tax_year}
+
+            with open(self._get_filename(checkpoint.tax_year), 'wb') as checkpoint_file:
+                pickle.dump(checkpoint, checkpoint_file, pickle.HIGHEST_PROTOCOL)
+
+            if config.debug:
+                print("%scheckpoint: saved \"%s\"" % (Fore.GREEN,
+                                                     self._get_filename(checkpoint.tax_year)))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import itertools
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .record import TransactionRecord
+from .transactions import Buy
+
+class TransactionColumns(object):
+    # Parallel columns of the transactions, so they can be grouped and selected without traversing
+    #  the objects. Amounts are left as decimals on the transactions, a float column isn't exact.
+    TYPE_CODES = {t_type: code for code, t_type in enumerate(TransactionRecord.ALL_TYPES)}
+
+    FLAG_BUY = 1
+    FLAG_CRYPTO = 2
+    FLAG_TAXABLE = 4
+
+    def __init__(self, transactions):
+        # Asset ids are in asset order, so grouping by id keeps the assets sorted
+        self.assets = sorted(set(t.asset for t in transactions))
+        asset_ids = {asset: asset_id for asset_id, asset in enumerate(self.assets)}
+
+        asset_id = array('l')
+        day = array('l')
+        type_code = array('B')
+        flags = array('B')
+
+        for t in transactions:
+            asset_id.append(asset_ids[t.asset])
+            day.append(t.timestamp.toordinal())
+            type_code.append(self.TYPE_CODES[t.t_type])
+
+            if isinstance(t, Buy):
+                t_flags = self.FLAG_BUY | (self.FLAG_TAXABLE if t.acquisition else 0)
+            else:
+                t_flags = self.FLAG_TAXABLE if t.disposal else 0
+
+            if t.is_crypto():
+                t_flags |= self.FLAG_CRYPTO
+            flags.append(t_flags)
+
+        if numpy:
+            self.asset_id = numpy.frombuffer(asset_id, dtype=asset_id.typecode)
+            self.day = numpy.frombuffer(day, dtype=day.typecode)
+            self.type_code = numpy.frombuffer(type_code, dtype=numpy.uint8)
+            self.flags = numpy.frombuffer(flags, dtype=numpy.uint8)
+        else:
+            self.asset_id = asset_id
+            self.day = day
+            self.type_code = type_code
+            self.flags = flags
+
+    def select(self, flags, mask=None, exclude_types=None):
+        # Indices, in transaction order, where the masked flags are set as given and the type isn't
+        #  one of those excluded
+        if mask is None:
+            mask = flags
+
+        exclude = set(self.TYPE_CODES[t_type] for t_type in exclude_types or ())
+
+        if numpy:
+            selected = (self.flags & mask) == flags
+            if exclude:
+                selected &= ~numpy.isin(self.type_code, list(exclude))
+            return numpy.flatnonzero(selected).tolist()
+
+        return [i for i, (t_flags, code) in enumerate(zip(self.flags, self.type_code))
+                if t_flags & mask == flags and code not in exclude]
+
+    def group_by_day(self, indices):
+        # Groups of indices with the same asset and day, ordered by asset then day. The sort is
+        #  stable, so each group keeps the transaction order.
+        if not indices:
+            return []
+
+        if numpy:
+            indices = numpy.asarray(indices)
+            asset_id = self.asset_id[indices]
+            day = self.day[indices]
+            order = numpy.lexsort((day, asset_id))
+            indices, asset_id, day = indices[order], asset_id[order], day[order]
+            splits = numpy.flatnonzero((asset_id[1:] != asset_id[:-1]) | (day[1:] != day[:-1]))
+            return [group.tolist() for group in numpy.split(indices, splits + 1)]
+
+        def key(i):
+            return self.asset_id[i], self.day[i]
+
+        return [list(group) for _, group in itertools.groupby(sorted(indices, key=key), key)]
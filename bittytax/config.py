@@ -2,8 +2,10 @@
 # (c) Nano Nano Ltd 2019
 
 from datetime import datetime, timedelta
+from bisect import bisect_left
 
 import os
+import threading
 import pkg_resources
 
 from colorama import Fore, Back
@@ -12,6 +14,10 @@ import dateutil.tz
 
 from .version import __version__
 
+class SessionLocal(threading.local):
+    # The calculation session active in each thread, if any
+    session = None
+
 class Config(object):
     TZ_LOCAL = dateutil.tz.gettz('Europe/London')
     TZ_UTC = dateutil.tz.UTC
@@ -60,12 +66,23 @@ class Config(object):
         'data_source_fiat': DATA_SOURCE_FIAT,
         'data_source_crypto': DATA_SOURCE_CRYPTO,
         'coinbase_zero_fees_are_gifts': False,
+        'fixed_point': False,
+        'columnar': False,
     }
 
+    # Not part of the config state, so each thread has its own
+    local = SessionLocal()
+
+    # The number of sessions, in any thread, which are entered and override the config. While
+    #  there are none the thread's session isn't looked up, as the config is read very often.
+    overriding = 0
+    overriding_lock = threading.Lock()
+
     def __init__(self):
         self.debug = False
         self.start_of_year_month = 4
         self.start_of_year_day = 6
+        self._calendar = None
 
         if not os.path.exists(Config.BITTYTAX_PATH):
             os.mkdir(Config.BITTYTAX_PATH)
@@ -95,6 +112,11 @@ class Config(object):
         self.asset_priority = self.config['fiat_list'] + self.config['crypto_list']
 
     def __getattr__(self, name):
+        if Config.overriding:
+            session = Config.local.session
+            if session is not None and name in session.overrides:
+                return session.overrides[name]
+
         try:
             return self.config[name]
         except KeyError:
@@ -118,34 +140,107 @@ class Config(object):
 
         raise ValueError("Currency not supported")
 
-    def get_tax_year_start(self, tax_year):
-        if self.start_of_year_month != 1:
-            return datetime(tax_year - 1,
-                            self.start_of_year_month,
-                            self.start_of_year_day,
-                            tzinfo=config.TZ_LOCAL)
-        return datetime(tax_year,
-                        self.start_of_year_month,
-                        self.start_of_year_day,
-                        tzinfo=config.TZ_LOCAL)
-
-    def get_tax_year_end(self, tax_year):
-        if self.start_of_year_month == 1:
-            return datetime(tax_year + 1,
-                            self.start_of_year_month,
-                            self.start_of_year_day,
-                            tzinfo=config.TZ_LOCAL) - timedelta(microseconds=1)
-        return datetime(tax_year,
-                        self.start_of_year_month,
-                        self.start_of_year_day,
-                        tzinfo=config.TZ_LOCAL) - timedelta(microseconds=1)
+    def get_state(self):
+        # The config as seen by this thread, including any session overrides, i.e. to be copied
+        #  to a worker process
+        state = dict(self.__dict__)
+        session = Config.local.session
+        if session is not None:
+            state['config'] = dict(self.config)
+            state['config'].update(session.overrides)
+            state['start_of_year_month'], state['start_of_year_day'] = \
+                session.calendar.start_of_year
+        return state
+
+    @property
+    def calendar(self):
+        if Config.local.session is not None:
+            return Config.local.session.calendar
+
+        # Rebuilt if the start of the tax year is changed, i.e. by the tax rules
+        if (self._calendar is None or
+                self._calendar.start_of_year != (self.start_of_year_month,
+                                                 self.start_of_year_day)):
+            self._calendar = TaxYearCalendar(self.start_of_year_month, self.start_of_year_day)
+        return self._calendar
 
     def format_tax_year(self, tax_year):
-        start = self.get_tax_year_start(tax_year)
-        end = self.get_tax_year_end(tax_year)
+        start = self.calendar.get_start(tax_year)
+        end = self.calendar.get_end(tax_year)
 
         if start.year == end.year:
             return start.strftime('%Y')
         return '{}/{}'.format(start.strftime('%Y'), end.strftime('%y'))
 
+class TaxYearCalendar(object):
+    # Tax year boundaries are calculated once, a timestamp is then looked up by bisection
+    FIRST_TAX_YEAR = 1970
+    LAST_TAX_YEAR = 2100
+
+    def __init__(self, start_of_year_month, start_of_year_day):
+        self.start_of_year = (start_of_year_month, start_of_year_day)
+        self.ends = [self._tax_year_end(tax_year)
+                     for tax_year in range(self.FIRST_TAX_YEAR, self.LAST_TAX_YEAR + 1)]
+
+    def _tax_year_start(self, tax_year):
+        if self.start_of_year[0] != 1:
+            return datetime(tax_year - 1,
+                            self.start_of_year[0],
+                            self.start_of_year[1],
+                            tzinfo=Config.TZ_LOCAL)
+        return datetime(tax_year,
+                        self.start_of_year[0],
+                        self.start_of_year[1],
+                        tzinfo=Config.TZ_LOCAL)
+
+    def _tax_year_end(self, tax_year):
+        if self.start_of_year[0] == 1:
+            return datetime(tax_year + 1,
+                            self.start_of_year[0],
+                            self.start_of_year[1],
+                            tzinfo=Config.TZ_LOCAL) - timedelta(microseconds=1)
+        return datetime(tax_year,
+                        self.start_of_year[0],
+                        self.start_of_year[1],
+                        tzinfo=Config.TZ_LOCAL) - timedelta(microseconds=1)
+
+    def get_start(self, tax_year):
+        if self.FIRST_TAX_YEAR < tax_year <= self.LAST_TAX_YEAR:
+            # Start is the microsecond after the end of the previous tax year
+            return self.ends[tax_year - self.FIRST_TAX_YEAR - 1] + timedelta(microseconds=1)
+        return self._tax_year_start(tax_year)
+
+    def get_end(self, tax_year):
+        if self.FIRST_TAX_YEAR <= tax_year <= self.LAST_TAX_YEAR:
+            return self.ends[tax_year - self.FIRST_TAX_YEAR]
+        return self._tax_year_end(tax_year)
+
+    def which_tax_year(self, timestamp):
+        pos = bisect_left(self.ends, timestamp)
+
+        if 0 < pos < len(self.ends):
+            return self.FIRST_TAX_YEAR + pos
+
+        # Outside of the table
+        if timestamp > self._tax_year_end(timestamp.year):
+            return timestamp.year + 1
+        return timestamp.year
+
+    def which_tax_years(self, timestamps):
+        # Bulk lookup, the previous tax year is tried first as timestamps are usually in order
+        tax_years = []
+        pos = 0
+
+        for timestamp in timestamps:
+            if not (0 < pos < len(self.ends) and
+                    self.ends[pos - 1] < timestamp <= self.ends[pos]):
+                pos = bisect_left(self.ends, timestamp)
+
+            if 0 < pos < len(self.ends):
+                tax_years.append(self.FIRST_TAX_YEAR + pos)
+            else:
+                tax_years.append(self.which_tax_year(timestamp))
+
+        return tax_years
+
 config = Config()
@@ -9,6 +9,7 @@ from colorama import Fore, Back
 import xlrd
 
 from ..config import config
+from ..xlsx_reader import open_workbook
 from .dataparser import DataParser
 from .datarow import DataRow
 from .exceptions import DataFormatUnrecognised
@@ -46,6 +47,8 @@ class DataFile(object):
         return self
 
     def parse(self, **kwargs):
+        DataParser.reset_timestamp_parsers()
+
         if self.parser.row_handler:
             for data_row in self.data_rows:
                 if config.debug:
@@ -61,7 +64,7 @@ class DataFile(object):
 
     @classmethod
     def read_excel(cls, filename):
-        with xlrd.open_workbook(filename) as workbook:
+        with open_workbook(filename) as workbook:
             if config.debug:
                 sys.stderr.write("%sconv: EXCEL\n" % Fore.CYAN)
 
@@ -11,6 +11,7 @@ import dateutil.tz
 
 from ..config import config
 from ..price.pricedata import PriceData
+from ..timestamp_parser import TimestampParser
 
 TERM_WIDTH = 69
 
@@ -28,6 +29,7 @@ class DataParser(object):
 
     price_data = PriceData(config.data_source_fiat)
     parsers = []
+    timestamp_parsers = {}
 
     def __init__(self, p_type, name, header, delimiter=',',
                  worksheet_name=None, row_handler=None, all_handler=None, chain_asset=None, wallet_name=None):
@@ -71,9 +73,13 @@ class DataParser(object):
     def parse_timestamp(cls, timestamp_str, tzinfos=None, tz=None, dayfirst=False, fuzzy=False):
         if isinstance(timestamp_str, int) or isinstance(timestamp_str, float):
             timestamp = datetime.utcfromtimestamp(timestamp_str)
-        else:
+        elif tzinfos or fuzzy:
             timestamp = dateutil.parser.parse(timestamp_str,
                                               tzinfos=tzinfos, dayfirst=dayfirst, fuzzy=fuzzy)
+        else:
+            if dayfirst not in cls.timestamp_parsers:
+                cls.timestamp_parsers[dayfirst] = TimestampParser(dayfirst)
+            timestamp = cls.timestamp_parsers[dayfirst].parse(timestamp_str)
 
         if tz:
             timestamp = timestamp.replace(tzinfo=dateutil.tz.gettz(tz))
@@ -86,6 +92,11 @@ class DataParser(object):
 
         return timestamp
 
+    @classmethod
+    def reset_timestamp_parsers(cls):
+        # Each file learns its own timestamp format
+        cls.timestamp_parsers = {}
+
     @classmethod
     def convert_currency(cls, value, from_currency, timestamp):
         if from_currency not in config.fiat_list:
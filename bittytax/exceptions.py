@@ -10,6 +10,10 @@ class TransactionParserError(Exception):
         self.col_name = col_name
         self.value = value
 
+    def __reduce__(self):
+        # Pickled with its arguments, so it can be returned from a worker process
+        return (self.__class__, (self.col_num, self.col_name, self.value))
+
 class UnexpectedTransactionTypeError(TransactionParserError):
     def __str__(self):
         return "Invalid Transaction Type: \'%s\', use {%s}" % (
@@ -35,3 +39,13 @@ class MissingDataError(TransactionParserError):
 class ImportFailureError(Exception):
     def __str__(self):
         return "Import failure"
+
+class BatchFilenameError(Exception):
+    def __init__(self, filename, duplicate_filename):
+        super(BatchFilenameError, self).__init__()
+        self.filename = filename
+        self.duplicate_filename = duplicate_filename
+
+    def __str__(self):
+        return "Batch files \'%s\' and \'%s\' would have the same report name" % (
+            self.filename, self.duplicate_filename)
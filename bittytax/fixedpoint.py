@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+from decimal import Decimal
+
+# Number of decimal places held by a scaled integer
+QUANTITY_PLACES = 18
+VALUE_PLACES = 12
+
+def to_fixed(value, places):
+    # Any digits beyond the scale are rounded (half even), as with Decimal quantize
+    return int(value.scaleb(places).to_integral_value())
+
+def from_fixed(value, places):
+    return Decimal(value).scaleb(-places)
+
+def div_round(numerator, denominator):
+    quotient, remainder = divmod(numerator, denominator)
+
+    # Round half even, remainder has the same sign as the denominator
+    if denominator < 0:
+        remainder, denominator = -remainder, -denominator
+
+    if remainder * 2 > denominator or (remainder * 2 == denominator and quotient % 2):
+        quotient += 1
+
+    return quotient
@@ -7,6 +7,7 @@ from colorama import Fore, Back
 from tqdm import tqdm
 
 from .config import config
+from .fixedpoint import QUANTITY_PLACES, VALUE_PLACES, to_fixed, from_fixed, div_round
 
 class Holdings(object):
     def __init__(self, asset):
@@ -27,19 +28,7 @@ class Holdings(object):
             self.deposits += 1
 
         if config.debug:
-            print("%ssection104:   %s=%s (+%s) cost=%s %s (+%s %s) fees=%s %s (+%s %s)" % (
-                Fore.YELLOW,
-                self.asset,
-                '{:0,f}'.format(self.quantity.normalize()),
-                '{:0,f}'.format(quantity.normalize()),
-                config.sym() + '{:0,.2f}'.format(self.cost),
-                config.ccy,
-                config.sym() + '{:0,.2f}'.format(cost),
-                config.ccy,
-                config.sym() + '{:0,.2f}'.format(self.fees),
-                config.ccy,
-                config.sym() + '{:0,.2f}'.format(fees),
-                config.ccy))
+            self._log_tokens('+', quantity, cost, fees)
 
     def subtract_tokens(self, quantity, cost, fees, is_withdrawal):
         self.quantity -= quantity
@@ -50,19 +39,34 @@ class Holdings(object):
             self.withdrawals += 1
 
         if config.debug:
-            print("%ssection104:   %s=%s (-%s) cost=%s %s (-%s %s) fees=%s %s (-%s %s)" % (
-                Fore.YELLOW,
-                self.asset,
-                '{:0,f}'.format(self.quantity.normalize()),
-                '{:0,f}'.format(quantity.normalize()),
-                config.sym() + '{:0,.2f}'.format(self.cost),
-                config.ccy,
-                config.sym() + '{:0,.2f}'.format(cost),
-                config.ccy,
-                config.sym() + '{:0,.2f}'.format(self.fees),
-                config.ccy,
-                config.sym() + '{:0,.2f}'.format(fees),
-                config.ccy))
+            self._log_tokens('-', quantity, cost, fees)
+
+    def apportion(self, quantity):
+        # Cost and fees of a part disposal
+        if self.quantity:
+            return (self.cost * (quantity / self.quantity),
+                    self.fees * (quantity / self.quantity))
+
+        # Should never happen, only if incorrect transaction records
+        return Decimal(0), Decimal(0)
+
+    def _log_tokens(self, sign, quantity, cost, fees):
+        print("%ssection104:   %s=%s (%s%s) cost=%s %s (%s%s %s) fees=%s %s (%s%s %s)" % (
+            Fore.YELLOW,
+            self.asset,
+            '{:0,f}'.format(self.quantity.normalize()),
+            sign,
+            '{:0,f}'.format(quantity.normalize()),
+            config.sym() + '{:0,.2f}'.format(self.cost),
+            config.ccy,
+            sign,
+            config.sym() + '{:0,.2f}'.format(cost),
+            config.ccy,
+            config.sym() + '{:0,.2f}'.format(self.fees),
+            config.ccy,
+            sign,
+            config.sym() + '{:0,.2f}'.format(fees),
+            config.ccy))
 
     def check_transfer_mismatch(self):
         if self.withdrawals > 0 and self.withdrawals != self.deposits:
@@ -70,3 +74,67 @@ class Holdings(object):
                        "(%s:%s) for %s, cost basis will be wrong" % ( Back.RED+Fore.BLACK,
                            Back.RESET+Fore.RED, self.withdrawals, self.deposits, self.asset))
             self.mismatches += 1
+
+class FixedPointHoldings(Holdings):
+    # Quantity, cost and fees are held as scaled integers, they are only converted to Decimal
+    #  when read, i.e. for the integrity check and reports
+    def __init__(self, asset):
+        self.fixed_quantity = self.fixed_cost = self.fixed_fees = 0
+        super(FixedPointHoldings, self).__init__(asset)
+
+    @property
+    def quantity(self):
+        return from_fixed(self.fixed_quantity, QUANTITY_PLACES)
+
+    @quantity.setter
+    def quantity(self, value):
+        self.fixed_quantity = to_fixed(value, QUANTITY_PLACES)
+
+    @property
+    def cost(self):
+        return from_fixed(self.fixed_cost, VALUE_PLACES)
+
+    @cost.setter
+    def cost(self, value):
+        self.fixed_cost = to_fixed(value, VALUE_PLACES)
+
+    @property
+    def fees(self):
+        return from_fixed(self.fixed_fees, VALUE_PLACES)
+
+    @fees.setter
+    def fees(self, value):
+        self.fixed_fees = to_fixed(value, VALUE_PLACES)
+
+    def add_tokens(self, quantity, cost, fees, is_deposit):
+        self.fixed_quantity += to_fixed(quantity, QUANTITY_PLACES)
+        self.fixed_cost += to_fixed(cost, VALUE_PLACES)
+        self.fixed_fees += to_fixed(fees, VALUE_PLACES)
+
+        if is_deposit:
+            self.deposits += 1
+
+        if config.debug:
+            self._log_tokens('+', quantity, cost, fees)
+
+    def subtract_tokens(self, quantity, cost, fees, is_withdrawal):
+        self.fixed_quantity -= to_fixed(quantity, QUANTITY_PLACES)
+        self.fixed_cost -= to_fixed(cost, VALUE_PLACES)
+        self.fixed_fees -= to_fixed(fees, VALUE_PLACES)
+
+        if is_withdrawal:
+            self.withdrawals += 1
+
+        if config.debug:
+            self._log_tokens('-', quantity, cost, fees)
+
+    def apportion(self, quantity):
+        if self.fixed_quantity:
+            quantity = to_fixed(quantity, QUANTITY_PLACES)
+            return (from_fixed(div_round(self.fixed_cost * quantity, self.fixed_quantity),
+                               VALUE_PLACES),
+                    from_fixed(div_round(self.fixed_fees * quantity, self.fixed_quantity),
+                               VALUE_PLACES))
+
+        # Should never happen, only if incorrect transaction records
+        return Decimal(0), Decimal(0)
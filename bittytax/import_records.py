@@ -1,30 +1,73 @@
 # -*- coding: utf-8 -*-
 # (c) Nano Nano Ltd 2019
 
+import io
+import os
 import sys
 import csv
+import heapq
+import multiprocessing
+import pickle
+import tempfile
 from decimal import Decimal, InvalidOperation
 
 from colorama import Fore, Back
-from tqdm import tqdm, trange
-import dateutil.parser
+from tqdm import tqdm
 import xlrd
 
 from .config import config
+from .tracing import tracer
+from .timestamp_parser import TimestampParser
+from .xlsx_reader import open_workbook
 from .transactions import Buy, Sell
 from .record import TransactionRecord as TR
+from .session import Session
 from .exceptions import TransactionParserError, UnexpectedTransactionTypeError, \
                         TimestampParserError, DataValueError, MissingDataError, \
                         UnexpectedDataError
 
 class ImportRecords(object):
-    def __init__(self):
+    # Size of the byte ranges a CSV file is split into, when it's imported in parallel
+    CSV_CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, stream=False, session=None):
+        self.session = session or Session()
         self.t_rows = []
         self.success_cnt = 0
         self.failure_cnt = 0
 
+        # When streaming, only failed rows are kept, the records are sorted using temporary files
+        self.record_sort = RecordSort() if stream else None
+
+        # Rows are also added to the parse cache as they are imported
+        self.parse_cache = None
+
+    def import_cache(self, filename, parse_cache):
+        if not parse_cache.exists():
+            return False
+
+        print("%sCached file: %s%s" % (Fore.WHITE, Fore.YELLOW, filename))
+        try:
+            for row, row_num, worksheet_name, t_record in parse_cache.load():
+                t_row = TransactionRow(row, row_num, worksheet_name)
+                t_row.t_record = t_record
+                self.add_row(t_row)
+        except:
+            print("%sWARNING%s Parse cache could not be loaded: %s" % (
+                Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, parse_cache.filename))
+
+            # Start again, the file will be imported instead
+            self.t_rows = []
+            self.success_cnt = self.failure_cnt = 0
+            if self.record_sort is not None:
+                self.record_sort = RecordSort()
+            return False
+
+        return True
+
     def import_excel(self, filename):
-        workbook = xlrd.open_workbook(filename)
+        # Rows are only read as they are needed, and aren't padded to the width of the worksheet
+        workbook = open_workbook(filename, ragged_rows=True)
         print("%sExcel file: %s%s" % (Fore.WHITE, Fore.YELLOW, filename))
 
         for worksheet in workbook.sheets():
@@ -34,21 +77,26 @@ class ImportRecords(object):
             if config.debug:
                 print("%simporting '%s' rows" % (Fore.CYAN, worksheet.name))
 
-            for row_num in trange(0, worksheet.nrows,
-                                  unit=' row',
-                                  desc="%simporting '%s' rows%s" % (
-                                      Fore.CYAN, worksheet.name, Fore.GREEN),
-                                  disable=bool(config.debug or not sys.stdout.isatty())):
+            timestamp_parser = TimestampParser()
+
+            for row_num, cells in enumerate(tqdm(worksheet.get_rows(),
+                                                 total=worksheet.nrows,
+                                                 unit=' row',
+                                                 desc="%simporting '%s' rows%s" % (
+                                                     Fore.CYAN, worksheet.name, Fore.GREEN),
+                                                 disable=bool(config.debug or
+                                                              not sys.stdout.isatty()))):
                 if row_num == 0:
                     # skip headers
                     continue
 
-                row = [self.convert_cell(worksheet.cell(row_num, cell_num), workbook)
-                       for cell_num in range(0, worksheet.ncols)]
+                row = [self.convert_cell(cell, workbook)
+                       for cell in cells[:len(TransactionRow.HEADER)]]
+                row.extend([''] * (len(TransactionRow.HEADER) - len(row)))
 
-                t_row = TransactionRow(row[:len(TransactionRow.HEADER)], row_num+1, worksheet.name)
+                t_row = TransactionRow(row, row_num+1, worksheet.name)
                 try:
-                    t_row.parse()
+                    t_row.parse(timestamp_parser)
                 except TransactionParserError as e:
                     t_row.failure = e
 
@@ -59,8 +107,7 @@ class ImportRecords(object):
                     tqdm.write("%sERROR%s %s" % (
                         Back.RED+Fore.BLACK, Back.RESET+Fore.RED, t_row.failure))
 
-                self.t_rows.append(t_row)
-                self.update_cnts(t_row)
+                self.add_row(t_row)
 
         workbook.release_resources()
         del workbook
@@ -84,17 +131,25 @@ class ImportRecords(object):
 
         return value
 
-    def import_csv(self, import_file):
+    def import_csv(self, import_file, jobs=1):
         print("%sCSV file: %s%s" % (Fore.WHITE, Fore.YELLOW, import_file.name))
         if config.debug:
             print("%simporting rows" % Fore.CYAN)
 
+        if jobs > 1 and not config.debug and not tracer.enabled and \
+                os.path.isfile(import_file.name):
+            chunks = split_csv(import_file.name, self.CSV_CHUNK_SIZE)
+            if len(chunks) > 1:
+                self.import_csv_parallel(import_file.name, chunks, jobs)
+                return
+
         if sys.version_info[0] < 3:
             # Special handling required for utf-8 encoded csv files
             reader = csv.reader(self.utf_8_encoder(import_file))
         else:
             reader = csv.reader(import_file)
 
+        timestamp_parser = TimestampParser()
         for row in tqdm(reader,
                         unit=' row',
                         desc="%simporting%s" % (Fore.CYAN, Fore.GREEN),
@@ -105,7 +160,7 @@ class ImportRecords(object):
 
             t_row = TransactionRow(row[:len(TransactionRow.HEADER)], reader.line_num)
             try:
-                t_row.parse()
+                t_row.parse(timestamp_parser)
             except TransactionParserError as e:
                 t_row.failure = e
 
@@ -116,33 +171,221 @@ class ImportRecords(object):
                 tqdm.write("%sERROR%s %s" % (
                     Back.RED+Fore.BLACK, Back.RESET+Fore.RED, t_row.failure))
 
-            self.t_rows.append(t_row)
-            self.update_cnts(t_row)
+            self.add_row(t_row)
+
+    def import_csv_parallel(self, filename, chunks, jobs):
+        pool = multiprocessing.Pool(min(jobs, len(chunks)), _init_worker, (config.get_state(),))
+        line_offset = 0
+
+        try:
+            results = pool.imap(_import_csv_chunk, [(filename, start, end)
+                                                    for start, end in chunks])
+
+            with tqdm(unit=' row',
+                      desc="%simporting%s" % (Fore.CYAN, Fore.GREEN),
+                      disable=bool(config.debug or not sys.stdout.isatty())) as progress:
+                # Chunks are returned in order, the line numbers follow on from the last chunk
+                for t_rows, line_cnt in results:
+                    for t_row in t_rows:
+                        t_row.row_num += line_offset
+
+                        if t_row.failure:
+                            tqdm.write("%simport: %s" % (Fore.YELLOW, t_row))
+                            tqdm.write("%sERROR%s %s" % (
+                                Back.RED+Fore.BLACK, Back.RESET+Fore.RED, t_row.failure))
+
+                        self.add_row(t_row)
+
+                    line_offset += line_cnt
+                    progress.update(len(t_rows))
+        finally:
+            pool.close()
+            pool.join()
 
     @staticmethod
     def utf_8_encoder(unicode_csv_data):
         for line in unicode_csv_data:
             yield line.encode('utf-8')
 
+    def add_row(self, t_row):
+        self.update_cnts(t_row)
+
+        if self.parse_cache is not None:
+            self.parse_cache.add(t_row)
+
+        if self.record_sort is None or t_row.failure:
+            self.t_rows.append(t_row)
+        elif t_row.t_record:
+            if not tracer.records:
+                # The raw row is only needed for the trace
+                t_row.row = None
+            self.record_sort.add(t_row)
+
     def update_cnts(self, t_row):
         if t_row.failure is not None:
             self.failure_cnt += 1
         elif t_row.t_record is not None:
             self.success_cnt += 1
 
+    def reparse(self, session):
+        # Parsing depends upon the config, so the rows can be parsed again for another session
+        self.session = session
+        timestamp_parser = TimestampParser()
+        for t_row in self.t_rows:
+            if t_row.failure is None:
+                t_row.t_record = None
+                t_row.parse(timestamp_parser)
+
     def get_records(self):
+        if self.record_sort is not None:
+            return self.stream_records()
+
         transaction_records = [t_row.t_record for t_row in self.t_rows if t_row.t_record]
 
         transaction_records.sort()
         for t_record in transaction_records:
-            t_record.set_tid()
+            t_record.set_tid(self.session)
 
         if config.debug:
             for t_row in self.t_rows:
                 print("%simport: %s" % (Fore.YELLOW, t_row))
 
+        if tracer.records:
+            for t_row in self.t_rows:
+                tracer.event('records', 'row', worksheet=t_row.worksheet_name,
+                             row_num=t_row.row_num, row=t_row.row,
+                             tid=t_row.t_record.tid if t_row.t_record else None)
+
         return transaction_records
 
+    def stream_records(self):
+        for t_row in self.record_sort:
+            t_row.t_record.set_tid(self.session)
+
+            if tracer.records:
+                tracer.event('records', 'row', worksheet=t_row.worksheet_name,
+                             row_num=t_row.row_num, row=t_row.row, tid=t_row.t_record.tid)
+
+            yield t_row.t_record
+
+def split_csv(filename, chunk_size):
+    # Byte ranges of at least the chunk size, each ending at a newline which isn't within a quoted
+    #  field. Quotes within a field are doubled, so a newline is only quoted if the number of
+    #  quotes before it is odd.
+    chunks = []
+    start = block_start = quotes = 0
+
+    with open(filename, 'rb') as csv_file:
+        for block in iter(lambda: csv_file.read(chunk_size), b''):
+            pos = max(start + chunk_size - block_start, 0)
+            while pos < len(block):
+                newline = block.find(b'\n', pos)
+                if newline == -1:
+                    break
+
+                if (quotes + block.count(b'"', 0, newline)) % 2:
+                    pos = newline + 1
+                else:
+                    chunks.append((start, block_start + newline + 1))
+                    start = block_start + newline + 1
+                    pos = max(start + chunk_size - block_start, newline + 1)
+
+            quotes += block.count(b'"')
+            block_start += len(block)
+
+    if block_start > start:
+        chunks.append((start, block_start))
+
+    return chunks
+
+def _init_worker(config_state):
+    # Worker processes might not inherit the config, i.e. if they are spawned
+    config.__dict__.update(config_state)
+
+def _import_csv_chunk(args):
+    filename, start, end = args
+
+    with open(filename, 'rb') as csv_file:
+        csv_file.seek(start)
+        data = csv_file.read(end - start)
+
+    lines = io.StringIO(data.decode('utf-8'), newline='')
+    if sys.version_info[0] < 3:
+        reader = csv.reader(ImportRecords.utf_8_encoder(lines))
+    else:
+        reader = csv.reader(lines)
+
+    # Line numbers are relative to the start of the chunk
+    t_rows = []
+    timestamp_parser = TimestampParser()
+    for row in reader:
+        if start == 0 and reader.line_num == 1:
+            # skip headers
+            continue
+
+        t_row = TransactionRow(row[:len(TransactionRow.HEADER)], reader.line_num)
+        try:
+            t_row.parse(timestamp_parser)
+        except TransactionParserError as e:
+            t_row.failure = e
+
+        t_rows.append(t_row)
+
+    return t_rows, reader.line_num
+
+class RecordSort(object):
+    # Sorts rows by timestamp (stable, the same as list.sort) in chunks. Once there is more than
+    #  one chunk, each is written sorted to a temporary file, and these are merged when read.
+    CHUNK_SIZE = 100000
+    PICKLE_SIZE = 1000
+
+    def __init__(self):
+        self.chunk = []
+        self.runs = []
+        self.cnt = 0
+
+    def add(self, t_row):
+        # The count keeps rows with the same timestamp in order, so rows are never compared
+        self.chunk.append((t_row.t_record.timestamp, self.cnt, t_row))
+        self.cnt += 1
+
+        if len(self.chunk) >= self.CHUNK_SIZE:
+            self._write_run()
+
+    def _write_run(self):
+        self.chunk.sort()
+        run = tempfile.TemporaryFile()
+
+        # Pickled in parts, so the timezones are shared within each part
+        for i in range(0, len(self.chunk), self.PICKLE_SIZE):
+            pickle.dump(self.chunk[i:i + self.PICKLE_SIZE], run, pickle.HIGHEST_PROTOCOL)
+
+        run.seek(0)
+        self.runs.append(run)
+        self.chunk = []
+
+    @staticmethod
+    def _read_run(run):
+        try:
+            while True:
+                for row in pickle.load(run):
+                    yield row
+        except EOFError:
+            run.close()
+
+    def __iter__(self):
+        if self.runs:
+            if self.chunk:
+                self._write_run()
+            rows = heapq.merge(*[self._read_run(run) for run in self.runs])
+            self.runs = []
+        else:
+            self.chunk.sort()
+            rows, self.chunk = self.chunk, []
+
+        for _, _, t_row in rows:
+            yield t_row
+
 class TransactionRow(object):
     HEADER = ['Type',
               'Buy Quantity', 'Buy Asset', 'Buy Value',
@@ -150,6 +393,9 @@ class TransactionRow(object):
               'Fee Quantity', 'Fee Asset', 'Fee Value',
               'Wallet', 'Timestamp', 'Note']
 
+    # Position of each field in the row
+    HEADER_POS = dict(zip(HEADER, range(len(HEADER))))
+
     OPT = 'Optional'
     MAN = 'Mandatory'
 
@@ -172,59 +418,44 @@ class TransactionRow(object):
 
     TRANSFER_TYPES = (TR.TYPE_DEPOSIT, TR.TYPE_WITHDRAWAL)
 
+    __slots__ = ('row', 'row_num', 'worksheet_name', 't_record', 'failure')
+
     def __init__(self, row, row_num, worksheet_name=None):
         self.row = row
-        self.row_dict = dict(zip(self.HEADER, row))
         self.row_num = row_num
         self.worksheet_name = worksheet_name
         self.t_record = None
         self.failure = None
 
-    def parse(self):
-        if all(not self.row[i] for i in range(len(self.row) - 1)):
+    def parse(self, timestamp_parser):
+        if not any(self.row[:-1]):
             # Skip empty rows
             return
 
         buy = sell = fee = None
-        t_type = self.row_dict['Type']
-
-        if t_type not in self.TYPE_VALIDATION:
-            raise UnexpectedTransactionTypeError(self.HEADER.index('Type'), 'Type', t_type)
-
-        for pos, required in enumerate(self.TYPE_VALIDATION[t_type]):
-            if pos == self.HEADER.index('Buy Quantity'):
-                buy_quantity = self.validate_quantity('Buy Quantity', required)
-            elif pos == self.HEADER.index('Buy Asset'):
-                buy_asset = self.validate_asset('Buy Asset', required)
-            elif pos == self.HEADER.index('Buy Value'):
-                buy_value = self.validate_value('Buy Value', required)
-            elif pos == self.HEADER.index('Sell Quantity'):
-                sell_quantity = self.validate_quantity('Sell Quantity', required)
-            elif pos == self.HEADER.index('Sell Asset'):
-                sell_asset = self.validate_asset('Sell Asset', required)
-            elif pos == self.HEADER.index('Sell Value'):
-                sell_value = self.validate_value('Sell Value', required)
-            elif pos == self.HEADER.index('Fee Quantity'):
-                fee_quantity = self.validate_quantity('Fee Quantity', required)
-            elif pos == self.HEADER.index('Fee Asset'):
-                fee_asset = self.validate_asset('Fee Asset', required)
-            elif pos == self.HEADER.index('Fee Value'):
-                fee_value = self.validate_value('Fee Value', required)
+        t_type = self.row[self.HEADER_POS['Type']]
+
+        if t_type not in self.VALIDATORS:
+            raise UnexpectedTransactionTypeError(self.HEADER_POS['Type'], 'Type', t_type)
+
+        (buy_quantity, buy_asset, buy_value,
+         sell_quantity, sell_asset, sell_value,
+         fee_quantity, fee_asset, fee_value) = self.VALIDATORS[t_type](self.row)
 
         if buy_value and buy_asset == config.ccy and buy_value != buy_quantity:
-            raise DataValueError(self.HEADER.index('Buy Value'), 'Buy Value', buy_value)
+            raise DataValueError(self.HEADER_POS['Buy Value'], 'Buy Value', buy_value)
 
         if sell_value and sell_asset == config.ccy and sell_value != sell_quantity:
-            raise DataValueError(self.HEADER.index('Sell Value'), 'Sell Value', sell_value)
+            raise DataValueError(self.HEADER_POS['Sell Value'], 'Sell Value', sell_value)
 
         if fee_value and fee_asset == config.ccy and fee_value != fee_quantity:
-            raise DataValueError(self.HEADER.index('Fee Value'), 'Fee Value', fee_value)
+            raise DataValueError(self.HEADER_POS['Fee Value'], 'Fee Value', fee_value)
 
         if fee_quantity is not None and not fee_asset:
-            raise MissingDataError(self.HEADER.index('Fee Asset'), 'Fee Asset')
+            raise MissingDataError(self.HEADER_POS['Fee Asset'], 'Fee Asset')
 
         if fee_quantity is None and fee_asset:
-            raise MissingDataError(self.HEADER.index('Fee Quantity'), 'Fee Quantity')
+            raise MissingDataError(self.HEADER_POS['Fee Quantity'], 'Fee Quantity')
 
         if buy_asset:
             buy = Buy(t_type, buy_quantity, buy_asset, buy_value)
@@ -254,19 +485,19 @@ class TransactionRow(object):
                         fee.disposal = False
 
         if len(self.row) == len(self.HEADER):
-            note = self.row_dict['Note']
+            note = self.row[self.HEADER_POS['Note']]
         else:
             note = ''
 
-        self.t_record = TR(t_type, buy, sell, fee, self.row_dict['Wallet'],
-                           self.parse_timestamp(), note)
+        self.t_record = TR(t_type, buy, sell, fee, self.row[self.HEADER_POS['Wallet']],
+                           self.parse_timestamp(timestamp_parser), note)
 
-    def parse_timestamp(self):
+    def parse_timestamp(self, timestamp_parser):
+        field = self.row[self.HEADER_POS['Timestamp']]
         try:
-            timestamp = dateutil.parser.parse(self.row_dict['Timestamp'])
+            timestamp = timestamp_parser.parse(field)
         except ValueError:
-            raise TimestampParserError(self.HEADER.index('Timestamp'), 'Timestamp',
-                                       self.row_dict['Timestamp'])
+            raise TimestampParserError(self.HEADER_POS['Timestamp'], 'Timestamp', field)
 
         if timestamp.tzinfo is None:
             # Default to UTC if no timezone is specified
@@ -274,60 +505,86 @@ class TransactionRow(object):
 
         return timestamp
 
-    def validate_quantity(self, quantity_hdr, required):
-        if self.row_dict[quantity_hdr]:
-            if required:
-                try:
-                    quantity = Decimal(self.strip_non_digits(self.row_dict[quantity_hdr]))
-                except InvalidOperation:
-                    raise DataValueError(self.HEADER.index(quantity_hdr), quantity_hdr,
-                                         self.row_dict[quantity_hdr])
-
-                if quantity < 0:
-                    raise DataValueError(self.HEADER.index(quantity_hdr), quantity_hdr,
-                                         quantity)
-                return quantity
-
-            raise UnexpectedDataError(self.HEADER.index(quantity_hdr), quantity_hdr,
-                                      self.row_dict[quantity_hdr])
-        if required == self.MAN:
-            raise MissingDataError(self.HEADER.index(quantity_hdr), quantity_hdr)
-
-        return None
-
-    def validate_asset(self, asset_hdr, required):
-        if self.row_dict[asset_hdr]:
-            if required:
-                return self.row_dict[asset_hdr]
-
-            raise UnexpectedDataError(self.HEADER.index(asset_hdr), asset_hdr,
-                                      self.row_dict[asset_hdr])
-        if required == self.MAN:
-            raise MissingDataError(self.HEADER.index(asset_hdr), asset_hdr)
-
-        return None
-
-    def validate_value(self, value_hdr, required):
-        if self.row_dict[value_hdr]:
-            if required:
-                try:
-                    value = Decimal(self.strip_non_digits(self.row_dict[value_hdr]))
-                except InvalidOperation:
-                    raise DataValueError(self.HEADER.index(value_hdr), value_hdr,
-                                         self.row_dict[value_hdr])
+    @classmethod
+    def compile_validator(cls, validation):
+        # Each column has a validator with its position, header and requirement fixed, so a row
+        #  is validated without any lookups. Columns are still validated in order, so the same
+        #  error is raised first.
+        validators = []
+        for pos, required in enumerate(validation):
+            if cls.HEADER[pos] == 'Type':
+                continue
+
+            if cls.HEADER[pos].endswith('Asset'):
+                validators.append(cls.asset_validator(pos, cls.HEADER[pos], required))
+            else:
+                validators.append(cls.decimal_validator(pos, cls.HEADER[pos], required))
+
+        (buy_quantity, buy_asset, buy_value,
+         sell_quantity, sell_asset, sell_value,
+         fee_quantity, fee_asset, fee_value) = validators
+
+        def validate(row):
+            return (buy_quantity(row), buy_asset(row), buy_value(row),
+                    sell_quantity(row), sell_asset(row), sell_value(row),
+                    fee_quantity(row), fee_asset(row), fee_value(row))
+
+        return validate
+
+    @classmethod
+    def decimal_validator(cls, pos, hdr, required):
+        # Quantities and values are both decimals, which can't be negative
+        if not required:
+            return cls.unexpected_validator(pos, hdr)
+
+        mandatory = required == cls.MAN
+        strip_non_digits = cls.strip_non_digits
+
+        def validate_decimal(row):
+            field = row[pos]
+            if not field:
+                if mandatory:
+                    raise MissingDataError(pos, hdr)
+                return None
 
-                if value < 0:
-                    raise DataValueError(self.HEADER.index(value_hdr), value_hdr, value)
+            try:
+                value = Decimal(strip_non_digits(field))
+            except InvalidOperation:
+                raise DataValueError(pos, hdr, field)
+
+            if value < 0:
+                raise DataValueError(pos, hdr, value)
+
+            return value
+
+        return validate_decimal
+
+    @classmethod
+    def asset_validator(cls, pos, hdr, required):
+        if not required:
+            return cls.unexpected_validator(pos, hdr)
 
-                return value
+        mandatory = required == cls.MAN
 
-            raise UnexpectedDataError(self.HEADER.index(value_hdr), value_hdr,
-                                      self.row_dict[value_hdr])
+        def validate_asset(row):
+            field = row[pos]
+            if not field:
+                if mandatory:
+                    raise MissingDataError(pos, hdr)
+                return None
 
-        if required == self.MAN:
-            raise MissingDataError(self.HEADER.index(value_hdr), value_hdr)
+            return field
 
-        return None
+        return validate_asset
+
+    @staticmethod
+    def unexpected_validator(pos, hdr):
+        def validate_unexpected(row):
+            if row[pos]:
+                raise UnexpectedDataError(pos, hdr, row[pos])
+            return None
+
+        return validate_unexpected
 
     @staticmethod
     def strip_non_digits(string):
@@ -362,3 +619,7 @@ class TransactionRow(object):
             self.row_num,
             row_str,
             tid_str)
+
+# Validators are compiled once for each transaction type
+TransactionRow.VALIDATORS = {t_type: TransactionRow.compile_validator(validation)
+                             for t_type, validation in TransactionRow.TYPE_VALIDATION.items()}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import tempfile
+
+from colorama import Fore, Back
+
+from .version import __version__
+from .config import config
+
+class ParseCache(object):
+    CACHE_DIR = os.path.join(config.CACHE_DIR, 'records')
+    FILE_EXTENSION = 'pickle'
+    PICKLE_SIZE = 1000
+
+    # Least recently used files are removed first
+    MAX_AGE = 30 * 24 * 60 * 60
+    MAX_SIZE = 512 * 1024 * 1024
+
+    # Config which changes how the rows are parsed
+    PARSE_CONFIG = ('ccy', 'lost_buyback', 'transfers_include', 'transfer_fee_disposal')
+
+    def __init__(self, filename):
+        sha = hashlib.sha256()
+        sha.update(json.dumps([__version__,
+                               sys.version_info[0],
+                               [getattr(config, key) for key in self.PARSE_CONFIG]],
+                              default=str).encode('utf-8'))
+
+        with open(filename, 'rb') as import_file:
+            for block in iter(lambda: import_file.read(1024 * 1024), b''):
+                sha.update(block)
+
+        self.digest = sha.hexdigest()
+        self.filename = os.path.join(self.CACHE_DIR, '%s.%s' % (self.digest, self.FILE_EXTENSION))
+        self.cache_file = None
+        self.rows = []
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def load(self):
+        # Rows are loaded in parts, so they can be streamed
+        with open(self.filename, 'rb') as cache_file:
+            if pickle.load(cache_file) != self.digest:
+                raise ValueError(self.filename)
+
+            os.utime(self.filename, None)
+            try:
+                while True:
+                    for row in pickle.load(cache_file):
+                        yield row
+            except EOFError:
+                pass
+
+        if config.debug:
+            print("%sparse cache: loaded \"%s\"" % (Fore.GREEN, self.filename))
+
+    def add(self, t_row):
+        if self.cache_file is None:
+            if not os.path.exists(self.CACHE_DIR):
+                os.makedirs(self.CACHE_DIR)
+
+            # Written to a temporary file first, so an incomplete file is never loaded
+            fd, self.temp_filename = tempfile.mkstemp(dir=self.CACHE_DIR)
+            self.cache_file = os.fdopen(fd, 'wb')
+            pickle.dump(self.digest, self.cache_file, pickle.HIGHEST_PROTOCOL)
+
+        self.rows.append((t_row.row, t_row.row_num, t_row.worksheet_name, t_row.t_record))
+        if len(self.rows) >= self.PICKLE_SIZE:
+            self._write_rows()
+
+    def _write_rows(self):
+        pickle.dump(self.rows, self.cache_file, pickle.HIGHEST_PROTOCOL)
+        self.rows = []
+
+    def save(self):
+        if self.cache_file is None:
+            return
+
+        if self.rows:
+            self._write_rows()
+        self.cache_file.close()
+
+        try:
+            os.rename(self.temp_filename, self.filename)
+        except OSError:
+            # Already saved by another process
+            os.remove(self.temp_filename)
+
+        if config.debug:
+            print("%sparse cache: saved \"%s\"" % (Fore.GREEN, self.filename))
+
+        self.evict()
+
+    def discard(self):
+        if self.cache_file is not None:
+            self.cache_file.close()
+            os.remove(self.temp_filename)
+            self.cache_file = None
+            self.rows = []
+
+    @classmethod
+    def evict(cls):
+        cache_files = []
+        for name in os.listdir(cls.CACHE_DIR):
+            if name.endswith('.' + cls.FILE_EXTENSION):
+                stat = os.stat(os.path.join(cls.CACHE_DIR, name))
+                cache_files.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in cache_files)
+        for mtime, size, name in sorted(cache_files):
+            if mtime > time.time() - cls.MAX_AGE and total_size <= cls.MAX_SIZE:
+                break
+
+            try:
+                os.remove(os.path.join(cls.CACHE_DIR, name))
+            except OSError:
+                print("%sWARNING%s Parse cache file could not be removed: %s" % (
+                    Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW, name))
+            total_size -= size
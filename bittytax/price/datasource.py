@@ -30,6 +30,9 @@ class DataSourceBase(object):
         self.ids = {}
         self.prices = self.load_prices()
 
+        # Prices added since the cache was loaded, so they can be shared between processes
+        self.new_prices = {}
+
         for pair in sorted(self.prices):
             if config.debug:
                 print("%sprice: %s (%s) data cache loaded" % (Fore.YELLOW, self.name(), pair))
@@ -71,6 +74,11 @@ class DataSourceBase(object):
 
         self.prices[pair].update(prices)
 
+        if pair not in self.new_prices:
+            self.new_prices[pair] = {}
+
+        self.new_prices[pair].update(prices)
+
     def load_prices(self):
         filename = os.path.join(config.CACHE_DIR, self.name() + '.json')
         if not os.path.exists(filename):
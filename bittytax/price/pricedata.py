@@ -30,6 +30,22 @@ class PriceData(object):
             return config.data_source_fiat
         return config.data_source_crypto
 
+    def get_new_prices(self):
+        new_prices = {}
+        for name, data_source in self.data_sources.items():
+            new_prices[name] = data_source.new_prices
+            data_source.new_prices = {}
+
+        return new_prices
+
+    def update_prices(self, new_prices):
+        for name in new_prices:
+            for pair in new_prices[name]:
+                if pair not in self.data_sources[name].prices:
+                    self.data_sources[name].prices[pair] = {}
+
+                self.data_sources[name].prices[pair].update(new_prices[name][pair])
+
     def get_latest_ds(self, data_source, asset, quote):
         if data_source.upper() in self.data_sources:
             if asset in self.data_sources[data_source.upper()].assets:
@@ -65,6 +81,26 @@ class PriceData(object):
             return None, None, None
         raise UnexpectedDataSourceError(data_source, DataSourceBase)
 
+    def prefetch_historical(self, asset, quote, timestamps):
+        # Timestamps should be in date order, then each request to a data source fetches as many
+        #  of the following days as it can. Days without a price fall through to the next data
+        #  source, the same as for get_historical. Returns the timestamps which have a price.
+        found = []
+        for data_source in self.data_source_priority(asset):
+            missing = []
+            for timestamp in timestamps:
+                price, _, _ = self.get_historical_ds(data_source, asset, quote, timestamp)
+                if price is None:
+                    missing.append(timestamp)
+                else:
+                    found.append(timestamp)
+
+            timestamps = missing
+            if not timestamps:
+                break
+
+        return found
+
     def get_latest(self, asset, quote):
         name = None
         for data_source in self.data_source_priority(asset):
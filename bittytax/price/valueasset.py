@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # (c) Nano Nano Ltd 2019
 
+import sys
 from decimal import Decimal
 from datetime import datetime
 
@@ -9,17 +10,23 @@ from tqdm import tqdm
 
 from ..version import __version__
 from ..config import config
+from ..tracing import tracer
 from .pricedata import PriceData
 
 class ValueAsset(object):
-    def __init__(self, price_tool=False):
+    def __init__(self, price_tool=False, price_data=None):
         self.price_tool = price_tool
         self.price_report = {}
-        data_sources_required = set(config.data_source_fiat +
-                                    config.data_source_crypto) | \
-                                {x.split(':')[0]
-                                 for v in config.data_source_select.values() for x in v}
-        self.price_data = PriceData(data_sources_required, price_tool)
+
+        if price_data:
+            # Already loaded, i.e. shared by a batch
+            self.price_data = price_data
+        else:
+            data_sources_required = set(config.data_source_fiat +
+                                        config.data_source_crypto) | \
+                                    {x.split(':')[0]
+                                     for v in config.data_source_select.values() for x in v}
+            self.price_data = PriceData(data_sources_required, price_tool)
 
     def get_value(self, asset, timestamp, quantity):
         if asset == config.ccy:
@@ -44,13 +51,59 @@ class ValueAsset(object):
                     config.sym() + '{:0,.2f}'.format(value),
                     config.ccy,
                     Style.NORMAL))
+            if tracer.price:
+                tracer.event('price', 'value', asset=asset, date=timestamp.date(),
+                             price=asset_price_ccy, quantity=quantity, value=value)
             return value, False
 
         tqdm.write("%sWARNING%s Price for %s on %s is not available, using price of %s" % (
                    Back.YELLOW+Fore.BLACK, Back.RESET+Fore.YELLOW,
                    asset, timestamp.strftime('%Y-%m-%d'), config.sym() + '{:0,.2f}'.format(0)))
+        if tracer.price:
+            tracer.event('price', 'missing', asset=asset, date=timestamp.date(),
+                         quantity=quantity)
         return Decimal(0), False
 
+    def prefetch(self, price_requests):
+        # Group the (asset, timestamp) requests by pair and day, the same as they are looked up
+        #  by get_historical_price. Only past days have a historic price.
+        btc_pairs = {}
+        ccy_pairs = {}
+        for asset, timestamp in price_requests:
+            if asset == config.ccy or timestamp.date() >= datetime.now().date():
+                continue
+
+            if asset == 'BTC' or asset in config.fiat_list:
+                self._add_prefetch(ccy_pairs, asset, timestamp)
+            else:
+                self._add_prefetch(btc_pairs, asset, timestamp)
+
+        if config.debug:
+            print("%sprefetch prices" % Fore.CYAN)
+
+        def pairs():
+            # Prices in BTC first, as the BTC price is then only needed for the days found
+            for asset in sorted(btc_pairs):
+                yield asset, 'BTC', btc_pairs[asset]
+            for asset in sorted(ccy_pairs):
+                yield asset, config.ccy, ccy_pairs[asset]
+
+        for asset, quote, dates in tqdm(pairs(),
+                                        unit='p',
+                                        desc="%sprefetch prices%s" % (Fore.CYAN, Fore.GREEN),
+                                        disable=bool(config.debug or not sys.stdout.isatty())):
+            found = self.price_data.prefetch_historical(asset, quote,
+                                                        [dates[d] for d in sorted(dates)])
+            if quote == 'BTC':
+                for timestamp in found:
+                    self._add_prefetch(ccy_pairs, 'BTC', timestamp)
+
+    @staticmethod
+    def _add_prefetch(pairs, asset, timestamp):
+        if asset not in pairs:
+            pairs[asset] = {}
+        pairs[asset][timestamp.strftime('%Y-%m-%d')] = timestamp
+
     def get_current_value(self, asset, quantity):
         asset_price_ccy, name, data_source = self.get_latest_price(asset)
         if asset_price_ccy is not None:
@@ -117,10 +170,7 @@ class ValueAsset(object):
 
     def price_report_cache(self, asset, timestamp, name, data_source, url,
                            price_ccy, price_btc=None):
-        if timestamp > config.get_tax_year_end(timestamp.year):
-            tax_year = timestamp.year + 1
-        else:
-            tax_year = timestamp.year
+        tax_year = config.calendar.which_tax_year(timestamp)
 
         if tax_year not in self.price_report:
             self.price_report[tax_year] = {}
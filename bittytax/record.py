@@ -38,7 +38,7 @@ class TransactionRecord(object):
                  TYPE_LOST,
                  TYPE_TRADE)
 
-    cnt = 0
+    __slots__ = ('tid', 't_type', 'buy', 'sell', 'fee', 'wallet', 'timestamp', 'note')
 
     def __init__(self, t_type, buy, sell, fee, wallet, timestamp, note):
         self.tid = None
@@ -50,26 +50,24 @@ class TransactionRecord(object):
         self.timestamp = timestamp
         self.note = note
 
+        # Wallet and note are read from the record, the local timestamp is shared
+        local_timestamp = self.timestamp.astimezone(config.TZ_LOCAL)
+
         if self.buy:
             self.buy.t_record = self
-            self.buy.timestamp = self.timestamp.astimezone(config.TZ_LOCAL)
-            self.buy.wallet = self.wallet
-            self.buy.note = self.note
+            self.buy.timestamp = local_timestamp
         if self.sell:
             self.sell.t_record = self
-            self.sell.timestamp = self.timestamp.astimezone(config.TZ_LOCAL)
-            self.sell.wallet = self.wallet
-            self.sell.note = self.note
+            self.sell.timestamp = local_timestamp
         if self.fee:
             self.fee.t_record = self
-            self.fee.timestamp = self.timestamp.astimezone(config.TZ_LOCAL)
-            self.fee.wallet = self.wallet
-            self.fee.note = self.note
+            self.fee.timestamp = local_timestamp
 
-    def set_tid(self):
+    def set_tid(self, session=None):
+        # A record is given its TID by its session, the transactions split from it are then
+        #  numbered within it
         if self.tid is None:
-            TransactionRecord.cnt += 1
-            self.tid = [TransactionRecord.cnt, 0]
+            self.tid = [session.next_tid(), 0]
         else:
             self.tid[1] += 1
 
@@ -141,12 +141,14 @@ class ReportLog(object):
             print("\n%sTax Year - %s (%s to %s)%s" % (
                 Fore.CYAN+Style.BRIGHT,
                 config.format_tax_year(args.taxyear),
-                self.format_date2(config.get_tax_year_start(args.taxyear)),
-                self.format_date2(config.get_tax_year_end(args.taxyear)),
+                self.format_date2(config.calendar.get_start(args.taxyear)),
+                self.format_date2(config.calendar.get_end(args.taxyear)),
                 Style.NORMAL))
             self.capital_gains(args.taxyear, args.tax_rules, args.summary)
             if not args.summary:
                 self.income(args.taxyear)
+                if args.wallet_balances:
+                    self.wallet_balances(args.taxyear)
                 print("\n%sAppendix%s" % (Fore.CYAN+Style.BRIGHT, Style.NORMAL))
                 self.price_data(args.taxyear)
         else:
@@ -157,12 +159,14 @@ class ReportLog(object):
                 print("\n%sTax Year - %s (%s to %s)%s" % (
                     Fore.CYAN+Style.BRIGHT,
                     config.format_tax_year(tax_year),
-                    self.format_date2(config.get_tax_year_start(tax_year)),
-                    self.format_date2(config.get_tax_year_end(tax_year)),
+                    self.format_date2(config.calendar.get_start(tax_year)),
+                    self.format_date2(config.calendar.get_end(tax_year)),
                     Style.NORMAL))
                 self.capital_gains(tax_year, args.tax_rules, args.summary)
                 if not args.summary:
                     self.income(tax_year)
+                    if args.wallet_balances:
+                        self.wallet_balances(tax_year)
 
             if not args.summary:
                 print("\n%sAppendix%s" % (Fore.CYAN+Style.BRIGHT, Style.NORMAL))
@@ -414,6 +418,26 @@ class ReportLog(object):
             self.format_value(income.totals['fees']),
             Style.NORMAL))
 
+    def wallet_balances(self, tax_year):
+        # Read from the audit's balance timelines, as at the end of the tax year
+        wallets = self.audit_report.balances_at(config.calendar.get_end(tax_year))
+
+        print("\n%sWallet Balances - %s" % (Fore.CYAN, self.format_date2(
+            config.calendar.get_end(tax_year))))
+        for wallet in sorted(wallets, key=str.lower):
+            print("\n%s%-30s %s %25s" % (
+                Fore.YELLOW,
+                'Wallet',
+                'Asset'.ljust(self.MAX_SYMBOL_LEN),
+                'Balance'))
+
+            for asset in sorted(wallets[wallet]):
+                print("%s%-30s %s %25s" % (
+                    Fore.WHITE,
+                    wallet,
+                    asset.ljust(self.MAX_SYMBOL_LEN),
+                    self.format_quantity(wallets[wallet][asset])))
+
     def price_data(self, tax_year):
         print("%sPrice Data - %s\n" % (Fore.CYAN, config.format_tax_year(tax_year)))
         print("%s%s %-16s %-10s  %13s %25s" % (
@@ -536,6 +560,74 @@ class ReportLog(object):
         return note[:ReportLog.MAX_NOTE_LEN - 3] + '...' if len(note) > ReportLog.MAX_NOTE_LEN \
                                                          else note
 
+class ReportScenarios(object):
+    COLUMN_WIDTH = 16
+
+    def __init__(self, scenarios, tax_reports, tax_year=None):
+        self.scenarios = scenarios
+        self.tax_reports = tax_reports
+
+        print("%sscenario report output:" % Fore.WHITE)
+        print("\n%sScenarios%s" % (Fore.CYAN+Style.BRIGHT, Style.NORMAL))
+        for i, scenario in enumerate(scenarios):
+            print("%s[%d] %s" % (Fore.WHITE, i + 1, scenario))
+
+        if tax_year:
+            tax_years = [tax_year]
+        else:
+            tax_years = sorted(set(ty for tax_report in tax_reports for ty in tax_report))
+
+        for ty in tax_years:
+            print("\n%sTax Year - %s%s\n" % (Fore.CYAN+Style.BRIGHT,
+                                             config.format_tax_year(ty),
+                                             Style.NORMAL))
+            self.comparison(ty)
+
+    def comparison(self, tax_year):
+        header = "%-40s" % '' + ''.join(' ' + ('[%d]' % (i + 1)).rjust(self.COLUMN_WIDTH)
+                                        for i in range(len(self.scenarios)))
+        print("%s%s" % (Fore.YELLOW, header))
+
+        self.row(tax_year, "Number of disposals:",
+                 lambda cg, inc: '%d' % cg.summary['disposals'])
+        self.row(tax_year, "Disposal proceeds:",
+                 lambda cg, inc: self.format_value(cg.totals['proceeds']))
+        self.row(tax_year, "Allowable costs:",
+                 lambda cg, inc: self.format_value(cg.totals['cost'] + cg.totals['fees']))
+        self.row(tax_year, "Gain/Loss:",
+                 lambda cg, inc: self.format_value(cg.totals['gain']))
+        self.row(tax_year, "Taxable Gain:",
+                 lambda cg, inc: self.format_value(cg.estimate['taxable_gain']))
+        self.row(tax_year, "Tax (Basic/Small profits rate):",
+                 lambda cg, inc: self.format_estimate(cg.estimate, ('cgt_basic', 'ct_small')))
+        self.row(tax_year, "Tax (Higher/Main rate):",
+                 lambda cg, inc: self.format_estimate(cg.estimate, ('cgt_higher', 'ct_main')))
+        self.row(tax_year, "Income:",
+                 lambda cg, inc: self.format_value(inc.totals['amount']))
+
+    def row(self, tax_year, label, column):
+        columns = []
+        for tax_report in self.tax_reports:
+            if tax_year in tax_report:
+                columns.append(column(tax_report[tax_year]['CapitalGains'],
+                                      tax_report[tax_year]['Income']))
+            else:
+                columns.append('n/a')
+
+        print("%s%-40s%s" % (Fore.WHITE, label,
+                             ''.join(' ' + c.rjust(self.COLUMN_WIDTH) for c in columns)))
+
+    @staticmethod
+    def format_estimate(estimate, keys):
+        for key in keys:
+            if key in estimate:
+                return ReportLog.format_value(estimate[key])
+        return 'n/a'
+
+    @staticmethod
+    def format_value(value):
+        return ReportLog.format_value(value)
+
 class ProgressSpinner:
     def __init__(self):
         self.spinner = itertools.cycle(['-', '\\', '|', '/'])
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import sys
+import argparse
+import multiprocessing
+
+from colorama import Fore
+from tqdm import tqdm
+import yaml
+
+from .config import config
+from .tracing import tracer
+from .session import Session
+from .single_pass import SinglePass
+from .tax import TaxCalculator, CalculateCapitalGains as CCG, CapturedOutput
+
+class Scenario(object):
+    # Config options which only change how the transactions are taxed
+    OPTIONS = ('trade_asset_type',
+               'trade_allowable_cost_type',
+               'transfers_include',
+               'transfer_fee_disposal',
+               'transfer_fee_allowable_cost',
+               'fiat_income',
+               'lost_buyback',
+               'fixed_point')
+
+    # Config options which change how the records are parsed or valued, only a scenario which
+    #  overrides one of these needs the records to be parsed and valued again
+    RECORD_OPTIONS = ('trade_asset_type',
+                      'trade_allowable_cost_type',
+                      'transfers_include',
+                      'transfer_fee_disposal',
+                      'transfer_fee_allowable_cost',
+                      'lost_buyback')
+
+    def __init__(self, tax_rules, overrides=None):
+        self.overrides = dict(overrides or {})
+        self.tax_rules = self.overrides.pop('tax_rules', tax_rules)
+
+    def new_session(self, value_asset=None):
+        return Session(self.tax_rules, self.overrides, value_asset)
+
+    def __str__(self):
+        return ', '.join([self.tax_rules] + ['%s=%s' % (k, self.overrides[k])
+                                             for k in sorted(self.overrides)])
+
+def validate_scenario(value):
+    overrides = {}
+
+    for option in value.split(','):
+        if '=' not in option:
+            raise argparse.ArgumentTypeError("scenario option \"%s\" must be key=value" % option)
+
+        key, option_value = [s.strip() for s in option.split('=', 1)]
+        if key == 'tax_rules':
+            option_value = option_value.upper()
+            if option_value not in [config.TAX_RULES_UK_INDIVIDUAL] + \
+                                   config.TAX_RULES_UK_COMPANY:
+                raise argparse.ArgumentTypeError("tax rules \"%s\" are not supported" %
+                                                 option_value)
+        elif key in Scenario.OPTIONS:
+            option_value = yaml.safe_load(option_value)
+            if not isinstance(option_value, type(config.DEFAULT_CONFIG[key])):
+                raise argparse.ArgumentTypeError("scenario option \"%s\" must be %s" % (
+                    key, type(config.DEFAULT_CONFIG[key]).__name__))
+        else:
+            raise argparse.ArgumentTypeError("scenario option \"%s\" is not supported, "
+                                             "must be one of (%s)" % (
+                                                 key, ', '.join(('tax_rules',) +
+                                                                Scenario.OPTIONS)))
+        overrides[key] = option_value
+
+    return overrides
+
+class ScenarioRunner(object):
+    def __init__(self, import_records, value_asset, scenarios):
+        self.import_records = import_records
+        self.value_asset = value_asset
+        self.scenarios = scenarios
+        self.tax_reports = []
+        self.holdings = []
+
+    def process(self, skip_integrity_check, jobs=1):
+        # The records are audited, split and valued in a single pass, as for the accounting tool.
+        #  A pass is shared by every scenario with the same record options, the tax calculation
+        #  only works on copies of the transactions it pools or matches.
+        single_passes = {}
+        parsed_options = self.get_record_options()
+        work = []
+        audits = []
+        for scenario in self.scenarios:
+            print("%sscenario: %s" % (Fore.CYAN, scenario))
+            session = scenario.new_session(self.value_asset)
+            with session:
+                record_options = self.get_record_options()
+                if record_options not in single_passes:
+                    if record_options != parsed_options:
+                        self.import_records.reparse(session)
+                        parsed_options = record_options
+
+                    single_passes[record_options] = SinglePass(self.import_records.get_records(),
+                                                               session)
+
+                single_pass = single_passes[record_options]
+                work.append((single_pass.transactions, session, skip_integrity_check,
+                             single_pass.get_income_events()))
+                audits.append(single_pass.audit)
+
+        if jobs > 1 and not config.debug and not tracer.enabled:
+            pool = multiprocessing.Pool(min(jobs, len(work)), _init_worker, (config.get_state(),))
+            try:
+                results = pool.imap(_process_scenario, work)
+                for tax_report, holdings, output in tqdm(results,
+                                                         total=len(work),
+                                                         unit='s',
+                                                         desc="%sprocess scenarios%s" % (
+                                                             Fore.CYAN, Fore.GREEN),
+                                                         disable=bool(config.debug or
+                                                                      not sys.stdout.isatty())):
+                    if output:
+                        tqdm.write(output, end='')
+                    self.tax_reports.append(tax_report)
+                    self.holdings.append(holdings)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for args in work:
+                tax_report, holdings, _ = _process_scenario(args, capture=False)
+                self.tax_reports.append(tax_report)
+                self.holdings.append(holdings)
+
+        if skip_integrity_check:
+            return True
+
+        # Checked the same as for the accounting tool, every scenario must pass
+        int_passed = True
+        for scenario, (_, session, _, _), audit, holdings in zip(self.scenarios, work, audits,
+                                                                 self.holdings):
+            print("%sscenario: %s" % (Fore.CYAN, scenario))
+            with session:
+                if not audit.integrity_check(holdings):
+                    int_passed = False
+
+        return int_passed
+
+    @staticmethod
+    def get_record_options():
+        return tuple(getattr(config, option) for option in Scenario.RECORD_OPTIONS)
+
+def _init_worker(config_state):
+    # Worker processes might not inherit the config, i.e. if they are spawned
+    config.__dict__.update(config_state)
+
+def _process_scenario(args, capture=True):
+    transactions, session, skip_integrity_check, income_events = args
+
+    # Capture any warnings so they can be output in order, this also hides the progress bars
+    stdout = sys.stdout
+    if capture:
+        sys.stdout = CapturedOutput()
+    try:
+        with session:
+            tax = TaxCalculator(transactions, session)
+            tax.process_disposals(skip_integrity_check)
+            tax.process_income(income_events)
+
+            for year in sorted(tax.tax_events):
+                if year in CCG.CG_DATA_INDIVIDUAL:
+                    tax.calculate_capital_gains(year)
+                    tax.calculate_income(year)
+
+        return tax.tax_report, tax.holdings, sys.stdout.getvalue() if capture else ''
+    finally:
+        sys.stdout = stdout
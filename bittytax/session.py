@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+from .config import config, Config, TaxYearCalendar
+from .price.valueasset import ValueAsset
+
+class Session(object):
+    # The state which belongs to one calculation: the TIDs it has allocated, its tax rules and
+    #  config overrides, and its caches. Calculations with their own sessions can run side by side
+    #  in one process, i.e. in threads, without mixing.
+    def __init__(self, tax_rules=None, overrides=None, value_asset=None):
+        self.tax_rules = tax_rules or config.TAX_RULES_UK_INDIVIDUAL
+        self.overrides = dict(overrides or {})
+        self.tid_cnt = 0
+        self._value_asset = value_asset
+        self._previous = []
+
+        if self.tax_rules in config.TAX_RULES_UK_COMPANY:
+            self.calendar = TaxYearCalendar(config.TAX_RULES_UK_COMPANY.index(self.tax_rules) + 1,
+                                            1)
+        else:
+            self.calendar = TaxYearCalendar(4, 6)
+
+    def next_tid(self):
+        self.tid_cnt += 1
+        return self.tid_cnt
+
+    @property
+    def value_asset(self):
+        # Created when first needed, as the data sources are loaded
+        if self._value_asset is None:
+            self._value_asset = ValueAsset()
+        return self._value_asset
+
+    def __enter__(self):
+        # The config overrides and tax year apply to this thread, until the session is left
+        self._previous.append(Config.local.session)
+        Config.local.session = self
+        if self.overrides:
+            with Config.overriding_lock:
+                Config.overriding += 1
+        return self
+
+    def __exit__(self, *args):
+        Config.local.session = self._previous.pop()
+        if self.overrides:
+            with Config.overriding_lock:
+                Config.overriding -= 1
+
+    def __getstate__(self):
+        # Copied to worker processes without its caches, which are rebuilt if needed
+        state = dict(self.__dict__)
+        state['_value_asset'] = None
+        state['_previous'] = []
+        return state
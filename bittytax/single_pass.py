@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import sys
+
+from colorama import Fore
+from tqdm import tqdm
+
+from .config import config
+from .audit import AuditRecords
+from .transactions import TransactionHistory
+from .tax import TaxCalculator, TaxEventIncome
+
+class SinglePass(object):
+    # Audits, splits and collects the income from the transaction records in one pass over them,
+    #  so each record is visited once, while it is still in the cache. The results are the same as
+    #  from the separate passes.
+    def __init__(self, transaction_records, session, split_after=None):
+        self.audit = AuditRecords()
+        self.transaction_history = TransactionHistory(None, session)
+        self.income_transactions = []
+
+        if split_after is not None:
+            # Resuming from a checkpoint, every record is audited but only those after it are split
+            self.transaction_history.value_asset.prefetch(
+                self.transaction_history.get_price_requests(
+                    [tr for tr in transaction_records if tr.timestamp > split_after]))
+            records = transaction_records
+        else:
+            records = self.transaction_history.prefetch_values(transaction_records)
+
+        if config.debug:
+            print("%saudit and split transaction records" % Fore.CYAN)
+
+        for tr in tqdm(records,
+                       total=len(transaction_records) if isinstance(transaction_records, list)
+                       else None,
+                       unit='tr',
+                       desc="%sprocess transaction records%s" % (Fore.CYAN, Fore.GREEN),
+                       disable=bool(config.debug or not sys.stdout.isatty())):
+            self.audit.audit_record(tr)
+
+            if split_after is None or tr.timestamp > split_after:
+                self.split_record(tr)
+
+        self.audit.audit_complete()
+
+        if config.debug:
+            print("%ssplit: total transactions=%d" % (
+                Fore.CYAN, len(self.transaction_history.transactions)))
+
+    def split_record(self, tr):
+        transactions = self.transaction_history.transactions
+        start = len(transactions)
+        self.transaction_history.split_record(tr)
+
+        for t in transactions[start:]:
+            if t.t_type in TaxCalculator.INCOME_TYPES:
+                self.income_transactions.append(t)
+
+    def get_income_events(self):
+        # Which income is taxed, and in which tax year, depends upon the config, so the same pass
+        #  can be shared by scenarios
+        income_transactions = [t for t in self.income_transactions if TaxCalculator.is_income(t)]
+        tax_years = config.calendar.which_tax_years(t.timestamp for t in income_transactions)
+        return [(TaxEventIncome(t), tax_year)
+                for t, tax_year in zip(income_transactions, tax_years)]
+
+    @property
+    def transactions(self):
+        return self.transaction_history.transactions
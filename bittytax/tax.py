@@ -2,7 +2,10 @@
 # (c) Nano Nano Ltd 2019
 
 import sys
+import io
 import copy
+import multiprocessing
+from bisect import bisect_left, bisect_right
 from decimal import Decimal
 from datetime import datetime, timedelta
 
@@ -10,8 +13,11 @@ from colorama import Fore
 from tqdm import tqdm
 
 from .config import config
+from .tracing import tracer
 from .transactions import Buy, Sell
-from .holdings import Holdings
+from .holdings import Holdings, FixedPointHoldings
+from .checkpoint import Checkpoint
+from .columns import TransactionColumns
 
 PRECISION = Decimal('0.00')
 
@@ -32,79 +38,231 @@ class TaxCalculator(object):
     # These transactions are except from the "same day" & "bnb" rule
     NO_MATCH_TYPES = (Sell.TYPE_GIFT_SPOUSE, Sell.TYPE_CHARITY_SENT, Sell.TYPE_LOST)
 
-    def __init__(self, transactions, tax_rules):
+    # Order in which disposals are created, each stage is applied to all assets in turn
+    DISPOSAL_STAGE = {DISPOSAL_SAME_DAY: 0,
+                      DISPOSAL_TEN_DAY: 1,
+                      DISPOSAL_BED_AND_BREAKFAST: 1,
+                      DISPOSAL_SECTION_104: 2,
+                      DISPOSAL_NO_GAIN_NO_LOSS: 2}
+
+    def __init__(self, transactions, session, checkpoints=None, resume_from=None,
+                 fixed_point=None):
         self.transactions = transactions
-        self.tax_rules = tax_rules
-        self.buys_ordered = []
-        self.sells_ordered = []
+        self.session = session
+        self.tax_rules = session.tax_rules
+        self.fixed_point = config.fixed_point if fixed_point is None else fixed_point
+        self.checkpoints = checkpoints or []
+        self.resume_from = resume_from
+        self.buys_ordered = OrderBook()
+        self.sells_ordered = OrderBook()
         self.other_transactions = []
+        self.columns = None
 
         self.tax_events = {}
         self.holdings = {}
 
+        # Totalised as the tax events are added
+        self.capital_gains = {}
+        self.income = {}
+
+        if resume_from:
+            for tax_year in sorted(resume_from.tax_events):
+                for tax_event in resume_from.tax_events[tax_year]:
+                    if isinstance(tax_event, TaxEventCapitalGains):
+                        self._add_disposal(tax_event, tax_year)
+                    else:
+                        self._add_income(tax_event, tax_year)
+
+            self.holdings = resume_from.get_holdings()
+
         self.tax_report = {}
         self.holdings_report = {}
 
-    def pool_same_day(self):
-        transactions = copy.deepcopy(self.transactions)
-        buy_transactions = {}
-        sell_transactions = {}
+    def process_disposals(self, skip_integrity_check):
+        self.pool_same_day()
+        self.match_sell(self.DISPOSAL_SAME_DAY)
+
+        if self.tax_rules == config.TAX_RULES_UK_INDIVIDUAL:
+            self.match_buyback(self.DISPOSAL_BED_AND_BREAKFAST)
+        elif self.tax_rules in config.TAX_RULES_UK_COMPANY:
+            self.match_sell(self.DISPOSAL_TEN_DAY)
+
+        self.process_section104(skip_integrity_check)
+
+    def process_disposals_parallel(self, skip_integrity_check, jobs):
+        # Each asset is independent, so can be processed separately
+        asset_transactions = {}
+        for t in self.transactions:
+            if t.is_crypto():
+                if t.asset not in asset_transactions:
+                    asset_transactions[t.asset] = []
+                asset_transactions[t.asset].append(t)
+
+        # Resumed holdings without any new transactions are still needed for the checkpoints
+        if self.resume_from:
+            asset_transactions.update({asset: [] for asset in self.resume_from.holdings
+                                       if asset not in asset_transactions})
+
+        assets = sorted(asset_transactions)
+        disposals = {}
+        pool = multiprocessing.Pool(jobs, _init_worker, (config.get_state(),))
+
+        try:
+            results = pool.imap(_process_asset_disposals,
+                                [(asset_transactions[asset], self.session, skip_integrity_check,
+                                  [Checkpoint(cp.tax_year, cp.digest) for cp in self.checkpoints],
+                                  self.resume_from.for_asset(asset) if self.resume_from else None)
+                                 for asset in assets])
+
+            for tax_events, holdings, checkpoints, output in tqdm(results,
+                                                                  total=len(assets),
+                                                                  unit='a',
+                                                                  desc="%sprocess assets%s" % (
+                                                                      Fore.CYAN, Fore.GREEN),
+                                                                  disable=bool(
+                                                                      config.debug or
+                                                                      not sys.stdout.isatty())):
+                if output:
+                    tqdm.write(output, end='')
+
+                self.holdings.update(holdings)
+
+                for checkpoint, asset_checkpoint in zip(self.checkpoints, checkpoints):
+                    checkpoint.merge(asset_checkpoint)
+
+                for tax_year in tax_events:
+                    if tax_year not in disposals:
+                        disposals[tax_year] = []
+                    disposals[tax_year].extend(tax_events[tax_year])
+        finally:
+            pool.close()
+            pool.join()
+
+        # Restore the order of a serial run, stable sort keeps assets in order within each stage
+        for tax_year in sorted(disposals):
+            disposals[tax_year].sort(key=lambda te: self.DISPOSAL_STAGE[te.disposal_type])
+            for tax_event in disposals[tax_year]:
+                self._add_disposal(tax_event, tax_year)
 
+    def pool_same_day(self):
         if config.debug:
             print("%spool same day transactions" % Fore.CYAN)
 
-        for t in tqdm(transactions,
+        if config.columnar:
+            buy_transactions, sell_transactions = self._pool_same_day_columns()
+        else:
+            buy_transactions, sell_transactions = self._pool_same_day_objects()
+
+        self.buys_ordered = OrderBook(sorted(buy_transactions))
+        self.sells_ordered = OrderBook(sorted(sell_transactions))
+
+        if config.debug:
+            for t in sorted(self.all_transactions()):
+                if len(t.pooled) > 1:
+                    print("%spool: %s" % (Fore.GREEN, t.__str__(pooled_bold=True)))
+                    for tp in t.pooled:
+                        print("%spool:   (%s)" % (Fore.BLUE, tp))
+
+        if tracer.pool:
+            for t in sorted(self.all_transactions()):
+                if len(t.pooled) > 1:
+                    tracer.event('pool', 'pooled', tid=t.tid, type=t.t_type, asset=t.asset,
+                                 timestamp=t.timestamp, quantity=t.quantity,
+                                 pooled=[tp.tid for tp in t.pooled])
+
+        if config.debug:
+            print("%spool: total transactions=%d" % (Fore.CYAN, len(self.all_transactions())))
+
+    def _pool_same_day_objects(self):
+        buy_transactions = {}
+        sell_transactions = {}
+
+        # Only transactions which are modified (by pooling, matching or section 104) are copied,
+        #  the original transactions are left untouched for the income calculation
+        for t in tqdm(self.transactions,
                       unit='t',
                       desc="%spool same day%s" % (Fore.CYAN, Fore.GREEN),
                       disable=bool(config.debug or not sys.stdout.isatty())):
             if isinstance(t, Buy) and t.is_crypto() and t.acquisition and \
                     t.t_type not in self.NO_MATCH_TYPES:
                 if (t.asset, t.timestamp.date()) not in buy_transactions:
-                    buy_transactions[(t.asset, t.timestamp.date())] = t
+                    buy_transactions[(t.asset, t.timestamp.date())] = copy.copy(t)
                 else:
                     buy_transactions[(t.asset, t.timestamp.date())] += t
             elif isinstance(t, Sell) and t.is_crypto() and t.disposal and \
                     t.t_type not in self.NO_MATCH_TYPES:
                 if (t.asset, t.timestamp.date()) not in sell_transactions:
-                    sell_transactions[(t.asset, t.timestamp.date())] = t
+                    sell_transactions[(t.asset, t.timestamp.date())] = copy.copy(t)
                 else:
                     sell_transactions[(t.asset, t.timestamp.date())] += t
+            elif t.t_type in self.NO_GAIN_NO_LOSS_TYPES:
+                # Proceeds are changed by section 104
+                self.other_transactions.append(copy.copy(t))
             else:
                 self.other_transactions.append(t)
 
-        self.buys_ordered = sorted(buy_transactions.values())
-        self.sells_ordered = sorted(sell_transactions.values())
+        return buy_transactions.values(), sell_transactions.values()
 
-        if config.debug:
-            for t in sorted(self.all_transactions()):
-                if len(t.pooled) > 1:
-                    print("%spool: %s" % (Fore.GREEN, t.__str__(pooled_bold=True)))
-                    for tp in t.pooled:
-                        print("%spool:   (%s)" % (Fore.BLUE, tp))
+    def _pool_same_day_columns(self):
+        columns = self.get_columns()
+        buy_flags = columns.FLAG_BUY | columns.FLAG_CRYPTO | columns.FLAG_TAXABLE
+        buys = columns.select(buy_flags, exclude_types=self.NO_MATCH_TYPES)
+        sells = columns.select(columns.FLAG_CRYPTO | columns.FLAG_TAXABLE, buy_flags,
+                               exclude_types=self.NO_MATCH_TYPES)
 
-        if config.debug:
-            print("%spool: total transactions=%d" % (Fore.CYAN, len(self.all_transactions())))
+        # Everything not pooled is kept in transaction order, the same as for the objects
+        pooled = set(buys).union(sells)
+        for i, t in enumerate(self.transactions):
+            if i in pooled:
+                continue
 
-    def match_buyback(self, rule):
-        sell_index = buy_index = 0
+            if t.t_type in self.NO_GAIN_NO_LOSS_TYPES:
+                self.other_transactions.append(copy.copy(t))
+            else:
+                self.other_transactions.append(t)
+
+        return self._pool_groups(columns.group_by_day(buys)), \
+               self._pool_groups(columns.group_by_day(sells))
+
+    def _pool_groups(self, groups):
+        pooled = []
+        for group in tqdm(groups,
+                          unit='t',
+                          desc="%spool same day%s" % (Fore.CYAN, Fore.GREEN),
+                          disable=bool(config.debug or not sys.stdout.isatty())):
+            t = copy.copy(self.transactions[group[0]])
+            for i in group[1:]:
+                t += self.transactions[i]
+            pooled.append(t)
+
+        return pooled
 
+    def match_buyback(self, rule):
         if not self.buys_ordered:
             return
 
         if config.debug:
             print("%smatch %s transactions" % (Fore.CYAN, rule.lower()))
 
+        if self.resume_from:
+            self._resume_matches(rule)
+
         pbar = tqdm(total=len(self.sells_ordered),
                     unit='t',
                     desc="%smatch %s transactions%s" % (Fore.CYAN, rule.lower(), Fore.GREEN),
                     disable=bool(config.debug or not sys.stdout.isatty()))
 
-        while sell_index < len(self.sells_ordered):
-            s = self.sells_ordered[sell_index]
-            b = self.buys_ordered[buy_index]
+        for s_node in self.sells_ordered.nodes():
+            s = s_node.t
+            b_node = None
+
+            if not s.matched:
+                b_node = self.buys_ordered.find_unmatched(s.asset,
+                                                          *self._buy_window(s.timestamp, rule))
+
+            if b_node:
+                b = b_node.t
 
-            if (not s.matched and not b.matched and s.asset == b.asset and
-                    self._rule_match(b.timestamp, s.timestamp, rule)):
                 if config.debug:
                     if b.quantity > s.quantity:
                         print("%smatch: %s" % (Fore.GREEN, s.__str__(quantity_bold=True)))
@@ -118,36 +276,35 @@ class TaxCalculator(object):
 
                 if b.quantity > s.quantity:
                     b_remainder = b.split_buy(s.quantity)
-                    self.buys_ordered.insert(buy_index + 1, b_remainder)
+                    self.buys_ordered.insert_after(b_node, b_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, b.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, b_remainder))
+                    if tracer.match:
+                        self._trace_split(b, b_remainder)
                 elif s.quantity > b.quantity:
                     s_remainder = s.split_sell(b.quantity)
-                    self.sells_ordered.insert(sell_index + 1, s_remainder)
+                    self.sells_ordered.insert_after(s_node, s_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, s.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, s_remainder))
+                    if tracer.match:
+                        self._trace_split(s, s_remainder)
                     pbar.total += 1
 
                 s.matched = b.matched = True
                 tax_event = TaxEventCapitalGains(rule, b, s, b.cost,
                                                  (b.fee_value or Decimal(0)) +
                                                  (s.fee_value or Decimal(0)))
-                self.tax_events[self.which_tax_year(tax_event.date)].append(tax_event)
+                self._add_disposal(tax_event)
                 if config.debug:
                     print("%smatch:   %s" % (Fore.CYAN, tax_event))
+                if tracer.match:
+                    self._trace_disposal('match', tax_event, b, s)
 
-                # Find next sell
-                sell_index += 1
-                pbar.update(1)
-                buy_index = 0
-            else:
-                buy_index += 1
-                if buy_index >= len(self.buys_ordered):
-                    sell_index += 1
-                    pbar.update(1)
-                    buy_index = 0
+                self._checkpoint_match(rule, s, b)
+
+            pbar.update(1)
 
         pbar.close()
 
@@ -155,25 +312,31 @@ class TaxCalculator(object):
             print("%smatch: total transactions=%d" % (Fore.CYAN, len(self.all_transactions())))
 
     def match_sell(self, rule):
-        buy_index = sell_index = 0
-
         if not self.sells_ordered:
             return
 
         if config.debug:
             print("%smatch %s transactions" % (Fore.CYAN, rule.lower()))
 
+        if self.resume_from:
+            self._resume_matches(rule)
+
         pbar = tqdm(total=len(self.buys_ordered),
                     unit='t',
                     desc="%smatch %s transactions%s" % (Fore.CYAN, rule.lower(), Fore.GREEN),
                     disable=bool(config.debug or not sys.stdout.isatty()))
 
-        while buy_index < len(self.buys_ordered):
-            b = self.buys_ordered[buy_index]
-            s = self.sells_ordered[sell_index]
+        for b_node in self.buys_ordered.nodes():
+            b = b_node.t
+            s_node = None
+
+            if not b.matched:
+                s_node = self.sells_ordered.find_unmatched(b.asset,
+                                                           *self._sell_window(b.timestamp, rule))
+
+            if s_node:
+                s = s_node.t
 
-            if (not b.matched and not s.matched and b.asset == s.asset and
-                    self._rule_match(b.timestamp, s.timestamp, rule)):
                 if config.debug:
                     if b.quantity > s.quantity:
                         print("%smatch: %s" % (Fore.GREEN, b))
@@ -187,55 +350,114 @@ class TaxCalculator(object):
 
                 if b.quantity > s.quantity:
                     b_remainder = b.split_buy(s.quantity)
-                    self.buys_ordered.insert(buy_index + 1, b_remainder)
+                    self.buys_ordered.insert_after(b_node, b_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, b.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, b_remainder))
+                    if tracer.match:
+                        self._trace_split(b, b_remainder)
                     pbar.total += 1
                 elif s.quantity > b.quantity:
                     s_remainder = s.split_sell(b.quantity)
-                    self.sells_ordered.insert(sell_index + 1, s_remainder)
+                    self.sells_ordered.insert_after(s_node, s_remainder)
                     if config.debug:
                         print("%smatch:   split: %s" % (Fore.YELLOW, s.__str__(quantity_bold=True)))
                         print("%smatch:   split: %s" % (Fore.YELLOW, s_remainder))
+                    if tracer.match:
+                        self._trace_split(s, s_remainder)
 
                 b.matched = s.matched = True
                 tax_event = TaxEventCapitalGains(rule, b, s, b.cost,
                                                  (b.fee_value or Decimal(0)) +
                                                  (s.fee_value or Decimal(0)))
-                self.tax_events[self.which_tax_year(tax_event.date)].append(tax_event)
+                self._add_disposal(tax_event)
                 if config.debug:
                     print("%smatch:   %s" % (Fore.CYAN, tax_event))
+                if tracer.match:
+                    self._trace_disposal('match', tax_event, b, s)
 
-                # Find next buy
-                buy_index += 1
-                pbar.update(1)
-                sell_index = 0
-            else:
-                sell_index += 1
-                if sell_index >= len(self.sells_ordered):
-                    buy_index += 1
-                    pbar.update(1)
-                    sell_index = 0
+                self._checkpoint_match(rule, b, s)
+
+            pbar.update(1)
 
         pbar.close()
 
         if config.debug:
             print("%smatch: total transactions=%d" % (Fore.CYAN, len(self.all_transactions())))
 
-    def _rule_match(self, b_timestamp, s_timestamp, rule):
+    @staticmethod
+    def _trace_split(t, remainder):
+        tracer.event('match', 'split', tid=t.tid, asset=t.asset, quantity=t.quantity,
+                     remainder_tid=remainder.tid, remainder_quantity=remainder.quantity)
+
+    @staticmethod
+    def _trace_disposal(category, tax_event, b, s):
+        tracer.event(category, 'disposal', disposal_type=tax_event.disposal_type,
+                     asset=tax_event.asset, date=tax_event.date, quantity=tax_event.quantity,
+                     buy_tid=b.tid if b else None, sell_tid=s.tid, cost=tax_event.cost,
+                     fees=tax_event.fees, proceeds=tax_event.proceeds, gain=tax_event.gain)
+
+    def _checkpoint_match(self, rule, earlier, later):
+        # Record any match which crosses a checkpoint, the later transaction is after it
+        for checkpoint in self.checkpoints:
+            if earlier.timestamp <= checkpoint.end < later.timestamp:
+                checkpoint.matches.append((rule, earlier, later.timestamp.date()))
+
+    def _resume_matches(self, rule):
+        # Match the transactions after the checkpoint again, as they were before it
+        for match_rule, earlier, date in self.resume_from.matches:
+            if match_rule != rule:
+                continue
+
+            if isinstance(earlier, Sell):
+                b_node = self.buys_ordered.find_unmatched(earlier.asset, date, date)
+                b, s = b_node.t, earlier
+                if b.quantity > s.quantity:
+                    self.buys_ordered.insert_after(b_node, b.split_buy(s.quantity))
+            else:
+                s_node = self.sells_ordered.find_unmatched(earlier.asset, date, date)
+                b, s = earlier, s_node.t
+                if s.quantity > b.quantity:
+                    self.sells_ordered.insert_after(s_node, s.split_sell(b.quantity))
+
+            b.matched = s.matched = True
+            if config.debug:
+                print("%smatch: resumed: %s" % (Fore.GREEN, b if b is not earlier else s))
+
+            if s is not earlier:
+                # Disposal is after the checkpoint, so it's not already included
+                tax_event = TaxEventCapitalGains(rule, b, s, b.cost,
+                                                 (b.fee_value or Decimal(0)) +
+                                                 (s.fee_value or Decimal(0)))
+                self._add_disposal(tax_event)
+                if config.debug:
+                    print("%smatch:   %s" % (Fore.CYAN, tax_event))
+
+    def _sell_window(self, b_timestamp, rule):
+        if rule == self.DISPOSAL_SAME_DAY:
+            return b_timestamp.date(), b_timestamp.date()
+        if rule == self.DISPOSAL_TEN_DAY:
+            # 10 days between buy and sell
+            return b_timestamp.date() + timedelta(days=1), b_timestamp.date() + timedelta(days=10)
+        if rule == self.DISPOSAL_BED_AND_BREAKFAST:
+            # 30 days between sell and buy-back
+            return b_timestamp.date() - timedelta(days=30), b_timestamp.date() - timedelta(days=1)
+        if not rule:
+            return datetime.min.date(), datetime.max.date()
+
+        raise Exception
+
+    def _buy_window(self, s_timestamp, rule):
         if rule == self.DISPOSAL_SAME_DAY:
-            return b_timestamp.date() == s_timestamp.date()
+            return s_timestamp.date(), s_timestamp.date()
         if rule == self.DISPOSAL_TEN_DAY:
             # 10 days between buy and sell
-            return (b_timestamp.date() < s_timestamp.date() and
-                    s_timestamp.date() <= b_timestamp.date() + timedelta(days=10))
+            return s_timestamp.date() - timedelta(days=10), s_timestamp.date() - timedelta(days=1)
         if rule == self.DISPOSAL_BED_AND_BREAKFAST:
             # 30 days between sell and buy-back
-            return (s_timestamp.date() < b_timestamp.date() and
-                    b_timestamp.date() <= s_timestamp.date() + timedelta(days=30))
+            return s_timestamp.date() + timedelta(days=1), s_timestamp.date() + timedelta(days=30)
         if not rule:
-            return True
+            return datetime.min.date(), datetime.max.date()
 
         raise Exception
 
@@ -243,26 +465,47 @@ class TaxCalculator(object):
         if config.debug:
             print("%sprocess section 104" % Fore.CYAN)
 
+        asset = None
+        checkpoints = []
+
         for t in tqdm(sorted(self.all_transactions()),
                       unit='t',
                       desc="%sprocess section 104%s" % (Fore.CYAN, Fore.GREEN),
                       disable=bool(config.debug or not sys.stdout.isatty())):
+            # Transactions are sorted by asset, then timestamp
+            if t.asset != asset:
+                self._checkpoint_holdings(asset, checkpoints)
+                asset = t.asset
+                checkpoints = list(self.checkpoints)
+
+            while checkpoints and t.timestamp > checkpoints[0].end:
+                self._checkpoint_holdings(asset, [checkpoints.pop(0)])
+
             if t.is_crypto() and t.asset not in self.holdings:
-                self.holdings[t.asset] = Holdings(t.asset)
+                if self.fixed_point:
+                    self.holdings[t.asset] = FixedPointHoldings(t.asset)
+                else:
+                    self.holdings[t.asset] = Holdings(t.asset)
 
             if t.matched:
                 if config.debug:
                     print("%ssection104: //%s <- matched" % (Fore.BLUE, t))
+                if tracer.s104:
+                    tracer.event('s104', 'skip', tid=t.tid, asset=t.asset, reason='matched')
                 continue
 
             if not config.transfers_include and t.t_type in self.TRANSFER_TYPES:
                 if config.debug:
                     print("%ssection104: //%s <- transfer" % (Fore.BLUE, t))
+                if tracer.s104:
+                    tracer.event('s104', 'skip', tid=t.tid, asset=t.asset, reason='transfer')
                 continue
 
             if not t.is_crypto():
                 if config.debug:
                     print("%ssection104: //%s <- fiat" % (Fore.BLUE, t))
+                if tracer.s104:
+                    tracer.event('s104', 'skip', tid=t.tid, asset=t.asset, reason='fiat')
                 continue
 
             if config.debug:
@@ -273,6 +516,25 @@ class TaxCalculator(object):
             elif isinstance(t, Sell):
                 self._subtract_tokens(t, skip_integrity_check)
 
+        self._checkpoint_holdings(asset, checkpoints)
+
+        # Resumed holdings which have no new transactions
+        for checkpoint in self.checkpoints:
+            for h in self.holdings:
+                if h not in checkpoint.holdings:
+                    checkpoint.holdings[h] = copy.copy(self.holdings[h])
+
+    def _checkpoint_holdings(self, asset, checkpoints):
+        if asset is None or asset in config.fiat_list:
+            return
+
+        for checkpoint in checkpoints:
+            if asset in self.holdings:
+                checkpoint.holdings[asset] = copy.copy(self.holdings[asset])
+            else:
+                # No transactions before the checkpoint, marked so it's not carried over
+                checkpoint.holdings[asset] = None
+
     def _add_tokens(self, t):
         if not t.acquisition:
             cost = fees = Decimal(0)
@@ -282,22 +544,19 @@ class TaxCalculator(object):
 
         self.holdings[t.asset].add_tokens(t.quantity, cost, fees,
                                           t.t_type == Buy.TYPE_DEPOSIT)
+        if tracer.s104:
+            self._trace_holdings('add', t, cost, fees)
 
     def _subtract_tokens(self, t, skip_integrity_check):
         if not t.disposal:
             cost = fees = Decimal(0)
         else:
-            if self.holdings[t.asset].quantity:
-                cost = self.holdings[t.asset].cost * (t.quantity /
-                                                      self.holdings[t.asset].quantity)
-                fees = self.holdings[t.asset].fees * (t.quantity /
-                                                      self.holdings[t.asset].quantity)
-            else:
-                # Should never happen, only if incorrect transaction records
-                cost = fees = Decimal(0)
+            cost, fees = self.holdings[t.asset].apportion(t.quantity)
 
         self.holdings[t.asset].subtract_tokens(t.quantity, cost, fees,
                                                t.t_type == Sell.TYPE_WITHDRAWAL)
+        if tracer.s104:
+            self._trace_holdings('subtract', t, cost, fees)
 
         if t.disposal:
             if t.t_type in self.NO_GAIN_NO_LOSS_TYPES:
@@ -311,39 +570,62 @@ class TaxCalculator(object):
                 tax_event = TaxEventCapitalGains(self.DISPOSAL_SECTION_104,
                                                  None, t, cost, fees + (t.fee_value or Decimal(0)))
 
-            self.tax_events[self.which_tax_year(tax_event.date)].append(tax_event)
+            self._add_disposal(tax_event)
             if config.debug:
                 print("%ssection104:   %s" % (Fore.CYAN, tax_event))
+            if tracer.s104:
+                self._trace_disposal('s104', tax_event, None, t)
 
             if config.transfers_include and not skip_integrity_check:
                 self.holdings[t.asset].check_transfer_mismatch()
 
-    def process_income(self):
+    def _trace_holdings(self, event, t, cost, fees):
+        holdings = self.holdings[t.asset]
+        tracer.event('s104', event, tid=t.tid, type=t.t_type, asset=t.asset,
+                     timestamp=t.timestamp, quantity=t.quantity, cost=cost, fees=fees,
+                     pool_quantity=holdings.quantity, pool_cost=holdings.cost,
+                     pool_fees=holdings.fees)
+
+    def process_income(self, income_events=None):
+        # The income events (with their tax years) might already have been collected, i.e. by a
+        #  single pass over the transaction records
         if config.debug:
             print("%sprocess income" % Fore.CYAN)
 
-        for t in tqdm(self.transactions,
-                      unit='t',
-                      desc="%sprocess income%s" % (Fore.CYAN, Fore.GREEN),
-                      disable=bool(config.debug or not sys.stdout.isatty())):
-            if t.t_type in self.INCOME_TYPES and (t.is_crypto() or config.fiat_income):
-                tax_event = TaxEventIncome(t)
-                self.tax_events[self.which_tax_year(tax_event.date)].append(tax_event)
+        if income_events is None:
+            income_transactions = [t for t in self.transactions if self.is_income(t)]
+            tax_years = config.calendar.which_tax_years(t.timestamp for t in income_transactions)
+            income_events = [(TaxEventIncome(t), tax_year)
+                             for t, tax_year in zip(income_transactions, tax_years)]
+
+        for tax_event, tax_year in tqdm(income_events,
+                                        unit='t',
+                                        desc="%sprocess income%s" % (Fore.CYAN, Fore.GREEN),
+                                        disable=bool(config.debug or not sys.stdout.isatty())):
+            self._add_income(tax_event, tax_year)
+
+    @classmethod
+    def is_income(cls, t):
+        return t.t_type in cls.INCOME_TYPES and (t.is_crypto() or config.fiat_income)
+
+    def get_columns(self):
+        if self.columns is None:
+            self.columns = TransactionColumns(self.transactions)
+        return self.columns
 
     def all_transactions(self):
         if not config.transfers_include:
             # Ordered so transfers appear before the fee spend in the log
-            return self.other_transactions + self.buys_ordered + self.sells_ordered
-        return self.buys_ordered + self.sells_ordered + self.other_transactions
+            return self.other_transactions + list(self.buys_ordered) + list(self.sells_ordered)
+        return list(self.buys_ordered) + list(self.sells_ordered) + self.other_transactions
 
     def calculate_capital_gains(self, tax_year):
         self.tax_report[tax_year] = {}
-        self.tax_report[tax_year]['CapitalGains'] = CalculateCapitalGains(tax_year, self.tax_rules)
 
-        if tax_year in self.tax_events:
-            for te in sorted(self.tax_events[tax_year]):
-                if isinstance(te, TaxEventCapitalGains):
-                    self.tax_report[tax_year]['CapitalGains'].tax_summary(te)
+        if tax_year in self.capital_gains:
+            self.tax_report[tax_year]['CapitalGains'] = self.capital_gains[tax_year]
+        else:
+            self.tax_report[tax_year]['CapitalGains'] = CalculateCapitalGains()
 
         if self.tax_rules in config.TAX_RULES_UK_COMPANY:
             self.tax_report[tax_year]['CapitalGains'].tax_estimate_ct(tax_year)
@@ -351,14 +633,10 @@ class TaxCalculator(object):
             self.tax_report[tax_year]['CapitalGains'].tax_estimate_cgt(tax_year)
 
     def calculate_income(self, tax_year):
-        self.tax_report[tax_year]['Income'] = CalculateIncome()
-
-        if tax_year in self.tax_events:
-            for te in sorted(self.tax_events[tax_year]):
-                if isinstance(te, TaxEventIncome):
-                    self.tax_report[tax_year]['Income'].totalise(te)
-
-        self.tax_report[tax_year]['Income'].totals_by_type()
+        if tax_year in self.income:
+            self.tax_report[tax_year]['Income'] = self.income[tax_year]
+        else:
+            self.tax_report[tax_year]['Income'] = CalculateIncome()
 
     def calculate_holdings(self, value_asset):
         holdings = {}
@@ -396,18 +674,123 @@ class TaxCalculator(object):
         self.holdings_report['holdings'] = holdings
         self.holdings_report['totals'] = totals
 
+    def _add_disposal(self, tax_event, tax_year=None):
+        if tax_year is None:
+            tax_year = self.which_tax_year(tax_event.date)
+        elif tax_year not in self.tax_events:
+            self.tax_events[tax_year] = []
+
+        self.tax_events[tax_year].append(tax_event)
+
+        if tax_year not in self.capital_gains:
+            self.capital_gains[tax_year] = CalculateCapitalGains()
+        self.capital_gains[tax_year].tax_summary(tax_event)
+
+    def _add_income(self, tax_event, tax_year=None):
+        if tax_year is None:
+            tax_year = self.which_tax_year(tax_event.date)
+        elif tax_year not in self.tax_events:
+            self.tax_events[tax_year] = []
+
+        self.tax_events[tax_year].append(tax_event)
+
+        if tax_year not in self.income:
+            self.income[tax_year] = CalculateIncome()
+        self.income[tax_year].totalise(tax_event)
+
     def which_tax_year(self, timestamp):
-        if timestamp > config.get_tax_year_end(timestamp.year):
-            tax_year = timestamp.year + 1
-        else:
-            tax_year = timestamp.year
+        tax_year = config.calendar.which_tax_year(timestamp)
 
         if tax_year not in self.tax_events:
             self.tax_events[tax_year] = []
 
         return tax_year
 
+class CapturedOutput(io.StringIO):
+    # Python 2 prints native strings, which are decoded as io.StringIO only accepts unicode
+    def write(self, s):
+        if isinstance(s, bytes):
+            s = s.decode('utf-8')
+        return super(CapturedOutput, self).write(s)
+
+def _init_worker(config_state):
+    # Worker processes might not inherit the config, i.e. if they are spawned
+    config.__dict__.update(config_state)
+
+def _process_asset_disposals(args):
+    transactions, session, skip_integrity_check, checkpoints, resume_from = args
+
+    # Capture any warnings so they can be output in order, this also hides the progress bars
+    stdout = sys.stdout
+    sys.stdout = CapturedOutput()
+    try:
+        with session:
+            tax = TaxCalculator(transactions, session, checkpoints, resume_from)
+            tax.process_disposals(skip_integrity_check)
+        return tax.tax_events, tax.holdings, tax.checkpoints, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+class OrderBook(object):
+    # Transactions are held by asset in timestamp order, a remainder from a split is linked in
+    #  directly after the transaction it was split from
+    def __init__(self, transactions=None):
+        self.heads = {}
+        self.dates = {}
+        self.length = 0
+
+        for t in transactions or []:
+            if t.asset not in self.heads:
+                self.heads[t.asset] = []
+                self.dates[t.asset] = []
+
+            self.heads[t.asset].append(OrderBookNode(t))
+            self.dates[t.asset].append(t.timestamp.date())
+            self.length += 1
+
+    def nodes(self):
+        for asset in sorted(self.heads):
+            for node in self.heads[asset]:
+                while node:
+                    yield node
+                    # Read next after yielding, so a remainder inserted meanwhile is included
+                    node = node.next
+
+    def find_unmatched(self, asset, first_date, last_date):
+        # Earliest unmatched transaction dated within the window (inclusive)
+        if asset not in self.heads:
+            return None
+
+        pos = bisect_left(self.dates[asset], first_date)
+        while pos < len(self.dates[asset]) and self.dates[asset][pos] <= last_date:
+            node = self.heads[asset][pos]
+            while node:
+                if not node.t.matched:
+                    return node
+                node = node.next
+            pos += 1
+
+        return None
+
+    def insert_after(self, node, t):
+        node.next = OrderBookNode(t, node.next)
+        self.length += 1
+        return node.next
+
+    def __iter__(self):
+        return (node.t for node in self.nodes())
+
+    def __len__(self):
+        return self.length
+
+class OrderBookNode(object):
+    def __init__(self, t, next_node=None):
+        self.t = t
+        self.next = next_node
+
 class TaxEvent(object):
+    __slots__ = ('date', 'asset')
+
     def __init__(self, date, asset):
         self.date = date
         self.asset = asset
@@ -422,6 +805,9 @@ class TaxEvent(object):
         return self.date < other.date
 
 class TaxEventCapitalGains(TaxEvent):
+    __slots__ = ('disposal_type', 'quantity', 'cost', 'fees', 'proceeds', 'gain',
+                 'acquisition_date')
+
     def __init__(self, disposal_type, b, s, cost, fees):
         super(TaxEventCapitalGains, self).__init__(s.timestamp, s.asset)
         self.disposal_type = disposal_type
@@ -448,6 +834,8 @@ class TaxEventCapitalGains(TaxEvent):
             config.sym() + '{:0,.2f}'.format(self.fees))
 
 class TaxEventIncome(TaxEvent):
+    __slots__ = ('type', 'quantity', 'amount', 'note', 'fees')
+
     def __init__(self, b):
         super(TaxEventIncome, self).__init__(b.timestamp, b.asset)
         self.type = b.t_type
@@ -493,7 +881,7 @@ class CalculateCapitalGains(object):
                        2021: {'small_rate': None, 'main_rate': 19},
                        2022: {'small_rate': None, 'main_rate': 19}}
 
-    def __init__(self, tax_year, tax_rules):
+    def __init__(self):
         self.totals = {'cost': Decimal(0),
                        'fees': Decimal(0),
                        'proceeds': Decimal(0),
@@ -501,32 +889,30 @@ class CalculateCapitalGains(object):
         self.summary = {'disposals': Decimal(0),
                         'total_gain': Decimal(0),
                         'total_loss': Decimal(0)}
-
-        if tax_rules in config.TAX_RULES_UK_COMPANY:
-            self.estimate = {'proceeds_warning': False,
-                             'ct_small_rates': [],
-                             'ct_main_rates': [],
-                             'taxable_gain': Decimal(0),
-                             'ct_small': Decimal(0),
-                             'ct_main': Decimal(0)}
-        else:
-            self.estimate = {'allowance': Decimal(self.CG_DATA_INDIVIDUAL[tax_year]['allowance']),
-                             'cgt_basic_rate': self.CG_DATA_INDIVIDUAL[tax_year]['basic_rate'],
-                             'cgt_higher_rate': self.CG_DATA_INDIVIDUAL[tax_year]['higher_rate'],
-                             'allowance_used': Decimal(0),
-                             'taxable_gain': Decimal(0),
-                             'cgt_basic': Decimal(0),
-                             'cgt_higher': Decimal(0),
-                             'proceeds_warning': False}
+        self.estimate = {}
         self.assets = {}
+        self.asset_dates = {}
+
+    def get_ct_periods(self, start_date, end_date):
+        # Split into periods of the same rates, these change on 1st April
+        periods = []
+        date = start_date.date()
+
+        while date <= end_date.date():
+            if date < date.replace(month=4, day=1):
+                # Use rate from previous year
+                rate_year = date.year - 1
+            else:
+                rate_year = date.year
+
+            period_end = min(datetime(rate_year + 1, 4, 1).date() - timedelta(days=1),
+                             end_date.date())
+            periods.append(((period_end - date).days + 1,
+                            self.CG_DATA_COMPANY[rate_year]['small_rate'],
+                            self.CG_DATA_COMPANY[rate_year]['main_rate']))
+            date = period_end + timedelta(days=1)
 
-    def get_ct_rate(self, date):
-        if date < datetime(date.year, 4, 1, tzinfo=config.TZ_LOCAL):
-            # Use rate from previous year
-            return self.CG_DATA_COMPANY[date.year-1]['small_rate'], \
-                   self.CG_DATA_COMPANY[date.year-1]['main_rate']
-        return self.CG_DATA_COMPANY[date.year]['small_rate'], \
-               self.CG_DATA_COMPANY[date.year]['main_rate']
+        return periods
 
     def tax_summary(self, te):
         self.summary['disposals'] += 1
@@ -541,10 +927,20 @@ class CalculateCapitalGains(object):
 
         if te.asset not in self.assets:
             self.assets[te.asset] = []
+            self.asset_dates[te.asset] = []
 
-        self.assets[te.asset].append(te)
+        insort_event(self.assets[te.asset], self.asset_dates[te.asset], te)
 
     def tax_estimate_cgt(self, tax_year):
+        self.estimate = {'allowance': Decimal(self.CG_DATA_INDIVIDUAL[tax_year]['allowance']),
+                         'cgt_basic_rate': self.CG_DATA_INDIVIDUAL[tax_year]['basic_rate'],
+                         'cgt_higher_rate': self.CG_DATA_INDIVIDUAL[tax_year]['higher_rate'],
+                         'allowance_used': Decimal(0),
+                         'taxable_gain': Decimal(0),
+                         'cgt_basic': Decimal(0),
+                         'cgt_higher': Decimal(0),
+                         'proceeds_warning': False}
+
         if self.totals['gain'] > self.estimate['allowance']:
             self.estimate['allowance_used'] = self.estimate['allowance']
             self.estimate['taxable_gain'] = self.totals['gain'] - self.estimate['allowance']
@@ -559,16 +955,21 @@ class CalculateCapitalGains(object):
             self.estimate['proceeds_warning'] = True
 
     def tax_estimate_ct(self, tax_year):
+        self.estimate = {'proceeds_warning': False,
+                         'ct_small_rates': [],
+                         'ct_main_rates': [],
+                         'taxable_gain': Decimal(0),
+                         'ct_small': Decimal(0),
+                         'ct_main': Decimal(0)}
+
         if self.totals['gain'] > 0:
             self.estimate['taxable_gain'] = self.totals['gain']
 
-        start_date = config.get_tax_year_start(tax_year)
-        end_date = config.get_tax_year_end(tax_year)
+        start_date = config.calendar.get_start(tax_year)
+        end_date = config.calendar.get_end(tax_year)
         day_count = (end_date - start_date).days + 1
 
-        for date in (start_date + timedelta(n) for n in range(day_count)):
-            small_rate, main_rate = self.get_ct_rate(date)
-
+        for days, small_rate, main_rate in self.get_ct_periods(start_date, end_date):
             if small_rate not in self.estimate['ct_small_rates']:
                 self.estimate['ct_small_rates'].append(small_rate)
 
@@ -576,16 +977,16 @@ class CalculateCapitalGains(object):
                 self.estimate['ct_main_rates'].append(main_rate)
 
             if self.estimate['taxable_gain'] > 0:
+                # The gain is apportioned by the number of days in each period
+                period_gain = self.estimate['taxable_gain'] * days / day_count
+
                 if small_rate is None:
                     # Use main rate if there isn't a small rate
-                    self.estimate['ct_small'] += self.estimate['taxable_gain'] / day_count * \
-                                                 main_rate / 100
+                    self.estimate['ct_small'] += period_gain * main_rate / 100
                 else:
-                    self.estimate['ct_small'] += self.estimate['taxable_gain'] / day_count * \
-                                                 small_rate / 100
+                    self.estimate['ct_small'] += period_gain * small_rate / 100
 
-                self.estimate['ct_main'] += self.estimate['taxable_gain'] / day_count * \
-                                            main_rate / 100
+                self.estimate['ct_main'] += period_gain * main_rate / 100
 
         if self.estimate['ct_small_rates'] == [None]:
             # No small rate so remove estimate
@@ -597,7 +998,9 @@ class CalculateIncome(object):
         self.totals = {'amount': Decimal(0),
                        'fees': Decimal(0)}
         self.assets = {}
+        self.asset_dates = {}
         self.types = {}
+        self.type_dates = {}
         self.type_totals = {}
 
     def totalise(self, te):
@@ -606,21 +1009,27 @@ class CalculateIncome(object):
 
         if te.asset not in self.assets:
             self.assets[te.asset] = []
+            self.asset_dates[te.asset] = []
 
-        self.assets[te.asset].append(te)
+        insort_event(self.assets[te.asset], self.asset_dates[te.asset], te)
 
         if te.type not in self.types:
             self.types[te.type] = []
-
-        self.types[te.type].append(te)
-
-    def totals_by_type(self):
-        for income_type in self.types:
-            for te in self.types[income_type]:
-                if income_type not in self.type_totals:
-                    self.type_totals[income_type] = {}
-                    self.type_totals[income_type]['amount'] = te.amount
-                    self.type_totals[income_type]['fees'] = te.fees
-                else:
-                    self.type_totals[income_type]['amount'] += te.amount
-                    self.type_totals[income_type]['fees'] += te.fees
+            self.type_dates[te.type] = []
+            self.type_totals[te.type] = {'amount': te.amount,
+                                         'fees': te.fees}
+        else:
+            self.type_totals[te.type]['amount'] += te.amount
+            self.type_totals[te.type]['fees'] += te.fees
+
+        insort_event(self.types[te.type], self.type_dates[te.type], te)
+
+def insort_event(tax_events, dates, te):
+    # Keep in date order, tax events with the same date stay in the order they were added
+    if not dates or te.date >= dates[-1]:
+        tax_events.append(te)
+        dates.append(te.date)
+    else:
+        pos = bisect_right(dates, te.date)
+        tax_events.insert(pos, te)
+        dates.insert(pos, te.date)
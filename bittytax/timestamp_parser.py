@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import re
+from datetime import datetime
+
+import dateutil.parser
+import dateutil.tz
+
+ISO_8601 = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?'
+                      r'(Z|[+-]\d{2}:?\d{2})?$')
+
+# Depending upon the local timezone, dateutil might give tzlocal() for a zero offset
+TZ_ZULU = dateutil.parser.parse('2000-01-01T00:00:00Z').tzinfo
+
+def parse_iso_8601(timestamp_str):
+    match = ISO_8601.match(timestamp_str)
+    if not match:
+        return None
+
+    (year, month, day, hour, minute, second,
+     fraction, offset) = match.groups()
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+
+    if offset is None:
+        tzinfo = None
+    elif offset == 'Z':
+        tzinfo = TZ_ZULU
+    else:
+        # Same timezone as dateutil would give
+        seconds = (int(offset[1:3]) * 60 + int(offset[-2:])) * 60
+        if offset[0] == '-':
+            seconds = -seconds
+        tzinfo = dateutil.tz.tzoffset(None, seconds) if seconds else TZ_ZULU
+
+    try:
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                        microsecond, tzinfo)
+    except ValueError:
+        return None
+
+def strptime_parser(fmt):
+    def parse_strptime(timestamp_str):
+        try:
+            return datetime.strptime(timestamp_str, fmt)
+        except ValueError:
+            return None
+    return parse_strptime
+
+class TimestampParser(object):
+    # Parses timestamps with dateutil, until a strict format is learnt from the first rows. A
+    #  format is only learnt if it has always given the same result as dateutil, anything it
+    #  doesn't match still goes to dateutil. A parser should be used for one file.
+    LEARN_ROWS = 10
+    MEMO_SIZE = 100000
+
+    FAST_PARSERS = (parse_iso_8601,
+                    strptime_parser('%Y-%m-%d'),
+                    strptime_parser('%Y/%m/%d %H:%M:%S'),
+                    strptime_parser('%Y/%m/%d %H:%M'),
+                    strptime_parser('%Y-%m-%d %H:%M'),
+                    strptime_parser('%Y-%m-%dT%H:%M'))
+
+    def __init__(self, dayfirst=False):
+        self.dayfirst = dayfirst
+        self.memo = {}
+        self.fast_parser = None
+        self.candidates = {}
+        self.learnt = 0
+        self.misses = 0
+
+        # With dayfirst, dateutil reads 2020-01-02 as the 1st of February
+        if not dayfirst:
+            self.candidates = {parser: 0 for parser in self.FAST_PARSERS}
+
+    def parse(self, timestamp_str):
+        if timestamp_str in self.memo:
+            return self.memo[timestamp_str]
+
+        timestamp = self.fast_parser(timestamp_str) if self.fast_parser else None
+        if timestamp is None:
+            timestamp = dateutil.parser.parse(timestamp_str, dayfirst=self.dayfirst)
+            self._learn(timestamp_str, timestamp)
+        else:
+            self.misses = 0
+
+        if len(self.memo) >= self.MEMO_SIZE:
+            self.memo.clear()
+        self.memo[timestamp_str] = timestamp
+        return timestamp
+
+    def _learn(self, timestamp_str, timestamp):
+        if self.fast_parser:
+            # Too many misses in a row, the format has changed so learn it again
+            self.misses += 1
+            if self.misses < self.LEARN_ROWS:
+                return
+
+            self.fast_parser = None
+            self.candidates = {parser: 0 for parser in self.FAST_PARSERS}
+            self.learnt = self.misses = 0
+
+        if not self.candidates:
+            return
+
+        for parser in list(self.candidates):
+            fast_timestamp = parser(timestamp_str)
+            if fast_timestamp is None:
+                continue
+
+            if self._same(fast_timestamp, timestamp):
+                self.candidates[parser] += 1
+            else:
+                del self.candidates[parser]
+
+        self.learnt += 1
+        if self.learnt >= self.LEARN_ROWS:
+            parser = max(self.FAST_PARSERS, key=lambda p: self.candidates.get(p, 0))
+            if self.candidates.get(parser):
+                self.fast_parser = parser
+            else:
+                # None of the formats match, dateutil is always used
+                self.candidates = {}
+
+    @staticmethod
+    def _same(timestamp, other):
+        # Timezones compare equal by offset, but they must be the same kind
+        return repr(timestamp) == repr(other)
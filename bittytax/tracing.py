@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import io
+import gzip
+import json
+import atexit
+
+class Tracer(object):
+    CATEGORIES = ('records', 'audit', 'price', 'pool', 'match', 's104')
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_file = None
+
+        # Each category is a plain attribute, so checking it costs next to nothing when disabled
+        for category in self.CATEGORIES:
+            setattr(self, category, False)
+
+    def open(self, filename, categories=None):
+        if filename.endswith('.gz'):
+            self.trace_file = io.TextIOWrapper(gzip.open(filename, 'wb'), encoding='utf-8')
+        else:
+            self.trace_file = io.open(filename, 'w', encoding='utf-8')
+
+        for category in categories or self.CATEGORIES:
+            setattr(self, category, True)
+
+        self.enabled = True
+        atexit.register(self.close)
+
+    def close(self):
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
+
+        for category in self.CATEGORIES:
+            setattr(self, category, False)
+
+        self.enabled = False
+
+    def event(self, category, event, **fields):
+        # Values are only formatted here, callers should check the category first
+        fields['cat'] = category
+        fields['ev'] = event
+        self.trace_file.write(u'%s\n' % json.dumps(fields,
+                                                   default=self.json_default,
+                                                   separators=(',', ':'),
+                                                   sort_keys=True))
+
+    @staticmethod
+    def json_default(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+tracer = Tracer()
@@ -11,91 +11,126 @@ from .config import config
 from .record import TransactionRecord
 
 class TransactionHistory(object):
-    def __init__(self, transaction_records, value_asset):
-        self.value_asset = value_asset
+    PREFETCH_BATCH_SIZE = 10000
+
+    def __init__(self, transaction_records, session):
+        self.session = session
+        self.value_asset = session.value_asset
         self.transactions = []
 
+        if transaction_records is None:
+            # Records are split one at a time, i.e. by a single pass over them
+            return
+
         if config.debug:
             print("%ssplit transaction records" % Fore.CYAN)
 
-        for tr in tqdm(transaction_records,
+        for tr in tqdm(self.prefetch_values(transaction_records),
+                       total=len(transaction_records) if isinstance(transaction_records, list)
+                       else None,
                        unit='tr',
                        desc="%ssplit transaction records%s" % (Fore.CYAN, Fore.GREEN),
                        disable=bool(config.debug or not sys.stdout.isatty())):
-            if config.debug:
-                print("%ssplit: TR %s" % (Fore.MAGENTA, tr))
+            self.split_record(tr)
 
-            self.get_all_values(tr)
+        if config.debug:
+            print("%ssplit: total transactions=%d" % (Fore.CYAN, len(self.transactions)))
 
-            # Attribute the fee value (allowable cost) to the buy, the sell or both
-            if tr.fee and tr.fee.disposal and tr.fee.proceeds:
-                if tr.buy and tr.buy.acquisition and tr.sell and tr.sell.disposal:
-                    if tr.buy.asset in config.fiat_list:
-                        tr.sell.fee_value = tr.fee.proceeds
-                        tr.sell.fee_fixed = tr.fee.proceeds_fixed
-                    elif tr.sell.asset in config.fiat_list:
-                        tr.buy.fee_value = tr.fee.proceeds
-                        tr.buy.fee_fixed = tr.fee.proceeds_fixed
-                    else:
-                        # Crypto-to-crypto trades
-                        if config.trade_allowable_cost_type == config.TRADE_ALLOWABLE_COST_BUY:
-                            tr.buy.fee_value = tr.fee.proceeds
-                            tr.buy.fee_fixed = tr.fee.proceeds_fixed
-                        elif config.trade_allowable_cost_type == config.TRADE_ALLOWABLE_COST_SELL:
-                            tr.sell.fee_value = tr.fee.proceeds
-                            tr.sell.fee_fixed = tr.fee.proceeds_fixed
-                        else:
-                            # Split fee between both
-                            tr.buy.fee_value = tr.fee.proceeds / 2
-                            tr.buy.fee_fixed = tr.fee.proceeds_fixed
-                            tr.sell.fee_value = tr.fee.proceeds - tr.buy.fee_value
-                            tr.sell.fee_fixed = tr.fee.proceeds_fixed
-                elif tr.buy and tr.buy.acquisition:
-                    tr.buy.fee_value = tr.fee.proceeds
-                    tr.buy.fee_fixed = tr.fee.proceeds_fixed
-                elif tr.sell and tr.sell.disposal:
+    def split_record(self, tr):
+        if config.debug:
+            print("%ssplit: TR %s" % (Fore.MAGENTA, tr))
+
+        self.get_all_values(tr)
+
+        # Attribute the fee value (allowable cost) to the buy, the sell or both
+        if tr.fee and tr.fee.disposal and tr.fee.proceeds:
+            if tr.buy and tr.buy.acquisition and tr.sell and tr.sell.disposal:
+                if tr.buy.asset in config.fiat_list:
                     tr.sell.fee_value = tr.fee.proceeds
                     tr.sell.fee_fixed = tr.fee.proceeds_fixed
+                elif tr.sell.asset in config.fiat_list:
+                    tr.buy.fee_value = tr.fee.proceeds
+                    tr.buy.fee_fixed = tr.fee.proceeds_fixed
                 else:
-                    # Special case for transfer fees
-                    if config.transfer_fee_allowable_cost:
-                        tr.fee.fee_value = tr.fee.proceeds
-                        tr.fee.fee_fixed = tr.fee.proceeds_fixed
-
-            if tr.t_type != TransactionRecord.TYPE_LOST:
-                if tr.buy and (tr.buy.quantity or tr.buy.fee_value):
-                    tr.buy.set_tid()
-                    self.transactions.append(tr.buy)
-                    if config.debug:
-                        print("%ssplit:   %s" % (Fore.GREEN, tr.buy))
-
-                if tr.sell and (tr.sell.quantity or tr.sell.fee_value):
-                    tr.sell.set_tid()
-                    self.transactions.append(tr.sell)
-                    if config.debug:
-                        print("%ssplit:   %s" % (Fore.GREEN, tr.sell))
+                    # Crypto-to-crypto trades
+                    if config.trade_allowable_cost_type == config.TRADE_ALLOWABLE_COST_BUY:
+                        tr.buy.fee_value = tr.fee.proceeds
+                        tr.buy.fee_fixed = tr.fee.proceeds_fixed
+                    elif config.trade_allowable_cost_type == config.TRADE_ALLOWABLE_COST_SELL:
+                        tr.sell.fee_value = tr.fee.proceeds
+                        tr.sell.fee_fixed = tr.fee.proceeds_fixed
+                    else:
+                        # Split fee between both
+                        tr.buy.fee_value = tr.fee.proceeds / 2
+                        tr.buy.fee_fixed = tr.fee.proceeds_fixed
+                        tr.sell.fee_value = tr.fee.proceeds - tr.buy.fee_value
+                        tr.sell.fee_fixed = tr.fee.proceeds_fixed
+            elif tr.buy and tr.buy.acquisition:
+                tr.buy.fee_value = tr.fee.proceeds
+                tr.buy.fee_fixed = tr.fee.proceeds_fixed
+            elif tr.sell and tr.sell.disposal:
+                tr.sell.fee_value = tr.fee.proceeds
+                tr.sell.fee_fixed = tr.fee.proceeds_fixed
             else:
-                # Special case for LOST sell must be before buy-back
-                if tr.sell and (tr.sell.quantity or tr.sell.fee_value):
-                    tr.sell.set_tid()
-                    self.transactions.append(tr.sell)
-                    if config.debug:
-                        print("%ssplit:   %s" % (Fore.GREEN, tr.sell))
-
-                if tr.buy and (tr.buy.quantity or tr.buy.fee_value):
-                    tr.buy.set_tid()
-                    self.transactions.append(tr.buy)
-                    if config.debug:
-                        print("%ssplit:   %s" % (Fore.GREEN, tr.buy))
-
-            if tr.fee and tr.fee.quantity:
-                tr.fee.set_tid()
-                self.transactions.append(tr.fee)
+                # Special case for transfer fees
+                if config.transfer_fee_allowable_cost:
+                    tr.fee.fee_value = tr.fee.proceeds
+                    tr.fee.fee_fixed = tr.fee.proceeds_fixed
+
+        if tr.t_type != TransactionRecord.TYPE_LOST:
+            if tr.buy and (tr.buy.quantity or tr.buy.fee_value):
+                tr.buy.set_tid(self.session)
+                self.transactions.append(tr.buy)
                 if config.debug:
-                    print("%ssplit:   %s" % (Fore.GREEN, tr.fee))
+                    print("%ssplit:   %s" % (Fore.GREEN, tr.buy))
 
-        if config.debug:
-            print("%ssplit: total transactions=%d" % (Fore.CYAN, len(self.transactions)))
+            if tr.sell and (tr.sell.quantity or tr.sell.fee_value):
+                tr.sell.set_tid(self.session)
+                self.transactions.append(tr.sell)
+                if config.debug:
+                    print("%ssplit:   %s" % (Fore.GREEN, tr.sell))
+        else:
+            # Special case for LOST sell must be before buy-back
+            if tr.sell and (tr.sell.quantity or tr.sell.fee_value):
+                tr.sell.set_tid(self.session)
+                self.transactions.append(tr.sell)
+                if config.debug:
+                    print("%ssplit:   %s" % (Fore.GREEN, tr.sell))
+
+            if tr.buy and (tr.buy.quantity or tr.buy.fee_value):
+                tr.buy.set_tid(self.session)
+                self.transactions.append(tr.buy)
+                if config.debug:
+                    print("%ssplit:   %s" % (Fore.GREEN, tr.buy))
+
+        if tr.fee and tr.fee.quantity:
+            tr.fee.set_tid(self.session)
+            self.transactions.append(tr.fee)
+            if config.debug:
+                print("%ssplit:   %s" % (Fore.GREEN, tr.fee))
+
+    def prefetch_values(self, transaction_records):
+        # Fetch the prices needed up front, so valuing each record only hits the cache. A stream
+        #  of records is fetched in batches, so it isn't all held at once.
+        if isinstance(transaction_records, list):
+            self.value_asset.prefetch(self.get_price_requests(transaction_records))
+            for tr in transaction_records:
+                yield tr
+            return
+
+        batch = []
+        for tr in transaction_records:
+            batch.append(tr)
+            if len(batch) >= self.PREFETCH_BATCH_SIZE:
+                self.value_asset.prefetch(self.get_price_requests(batch))
+                for batch_tr in batch:
+                    yield batch_tr
+                batch = []
+
+        if batch:
+            self.value_asset.prefetch(self.get_price_requests(batch))
+            for batch_tr in batch:
+                yield batch_tr
 
     def get_all_values(self, tr):
         if tr.buy and tr.buy.acquisition and tr.buy.cost is None:
@@ -152,46 +187,79 @@ class TransactionHistory(object):
                                                                      tr.fee.timestamp,
                                                                      tr.fee.quantity)
     def which_asset_value(self, tr):
-        if config.trade_asset_type == config.TRADE_ASSET_TYPE_BUY:
+        if self.which_asset_is_buy(tr):
             if tr.buy.cost is None:
                 value, fixed = self.value_asset.get_value(tr.buy.asset,
                                                           tr.buy.timestamp,
                                                           tr.buy.quantity)
             else:
                 value, fixed = tr.buy.cost, tr.buy.cost_fixed
-        elif config.trade_asset_type == config.TRADE_ASSET_TYPE_SELL:
+        else:
             if tr.sell.proceeds is None:
                 value, fixed = self.value_asset.get_value(tr.sell.asset,
                                                           tr.sell.timestamp,
                                                           tr.sell.quantity)
             else:
                 value, fixed = tr.sell.proceeds, tr.sell.proceeds_fixed
-        else:
-            pos_sell_asset = pos_buy_asset = len(config.asset_priority) + 1
-
-            if tr.sell.asset in config.asset_priority:
-                pos_sell_asset = config.asset_priority.index(tr.sell.asset)
-            if tr.buy.asset in config.asset_priority:
-                pos_buy_asset = config.asset_priority.index(tr.buy.asset)
-
-            if pos_sell_asset <= pos_buy_asset:
-                if tr.sell.proceeds is None:
-                    value, fixed = self.value_asset.get_value(tr.sell.asset,
-                                                              tr.sell.timestamp,
-                                                              tr.sell.quantity)
-                else:
-                    value, fixed = tr.sell.proceeds, tr.sell.proceeds_fixed
-            else:
-                if tr.buy.cost is None:
-                    value, fixed = self.value_asset.get_value(tr.buy.asset,
-                                                              tr.buy.timestamp,
-                                                              tr.buy.quantity)
-                else:
-                    value, fixed = tr.buy.cost, tr.buy.cost_fixed
 
         return value, fixed
 
+    @staticmethod
+    def which_asset_is_buy(tr):
+        if config.trade_asset_type == config.TRADE_ASSET_TYPE_BUY:
+            return True
+        if config.trade_asset_type == config.TRADE_ASSET_TYPE_SELL:
+            return False
+
+        pos_sell_asset = pos_buy_asset = len(config.asset_priority) + 1
+
+        if tr.sell.asset in config.asset_priority:
+            pos_sell_asset = config.asset_priority.index(tr.sell.asset)
+        if tr.buy.asset in config.asset_priority:
+            pos_buy_asset = config.asset_priority.index(tr.buy.asset)
+
+        return bool(pos_sell_asset > pos_buy_asset)
+
+    def get_price_requests(self, transaction_records):
+        # The same decisions as get_all_values, but only to find which assets will be valued on
+        #  which days. A fee valued from the buy or sell price is assumed not to need a price,
+        #  if it does it is simply looked up as before.
+        price_requests = set()
+
+        def add(t):
+            if t.quantity:
+                price_requests.add((t.asset, t.timestamp))
+
+        for tr in transaction_records:
+            if tr.buy and tr.buy.acquisition and tr.buy.cost is None:
+                if not tr.sell or self.which_asset_is_buy(tr):
+                    add(tr.buy)
+                elif tr.sell.proceeds is None:
+                    add(tr.sell)
+
+            if tr.sell and tr.sell.disposal and tr.sell.proceeds is None and not tr.buy:
+                add(tr.sell)
+
+            if tr.fee and tr.fee.disposal and tr.fee.proceeds is None:
+                if tr.fee.asset in config.fiat_list:
+                    add(tr.fee)
+                elif tr.buy and tr.buy.asset == tr.fee.asset:
+                    if not (tr.buy.quantity and (tr.buy.cost or
+                                                 tr.buy.cost is None and tr.buy.acquisition)):
+                        add(tr.fee)
+                elif tr.sell and tr.sell.asset == tr.fee.asset:
+                    if not (tr.sell.quantity and (tr.sell.proceeds or
+                                                  tr.sell.proceeds is None and tr.sell.disposal)):
+                        add(tr.fee)
+                else:
+                    add(tr.fee)
+
+        return price_requests
+
 class TransactionBase(object):
+    __slots__ = ('tid', 't_record', 't_type', 'asset', 'quantity', 'fee_value', 'fee_fixed',
+                 '_wallet', 'timestamp', '_note', 'matched', 'pooled')
+
     def __init__(self, t_type, asset, quantity):
         self.tid = None
         self.t_record = None
@@ -200,14 +268,35 @@ class TransactionBase(object):
         self.quantity = quantity
         self.fee_value = None
         self.fee_fixed = True
-        self.wallet = None
+        self._wallet = None
         self.timestamp = None
-        self.note = None
+        self._note = None
         self.matched = False
-        self.pooled = []
+        self.pooled = ()
 
-    def set_tid(self):
-        self.tid = self.t_record.set_tid()
+    # Wallet and note are the transaction record's, unless changed by pooling
+    @property
+    def wallet(self):
+        if self._wallet is None and self.t_record:
+            return self.t_record.wallet
+        return self._wallet
+
+    @wallet.setter
+    def wallet(self, value):
+        self._wallet = value
+
+    @property
+    def note(self):
+        if self._note is None and self.t_record:
+            return self.t_record.note
+        return self._note
+
+    @note.setter
+    def note(self, value):
+        self._note = value
+
+    def set_tid(self, session=None):
+        self.tid = self.t_record.set_tid(session)
 
     def is_crypto(self):
         return bool(self.asset not in config.fiat_list)
@@ -268,18 +357,43 @@ class TransactionBase(object):
     def __lt__(self, other):
         return (self.asset, self.timestamp) < (other.asset, other.timestamp)
 
+    def __copy__(self):
+        # Attribute values are immutable, the pool ledger is shared with the copy
+        cls = self.__class__
+        result = cls.__new__(cls)
+        for k in cls.ALL_SLOTS:
+            setattr(result, k, getattr(self, k))
+        return result
+
     def __deepcopy__(self, memo):
         cls = self.__class__
         result = cls.__new__(cls)
         memo[id(self)] = result
-        for k, v in self.__dict__.items():
+        for k in cls.ALL_SLOTS:
             if k == 't_record':
                 # Keep reference to the transaction record
-                setattr(result, k, v)
+                setattr(result, k, getattr(self, k))
             else:
-                setattr(result, k, copy.deepcopy(v, memo))
+                setattr(result, k, copy.deepcopy(getattr(self, k), memo))
         return result
 
+class PoolLedger(object):
+    # Transactions which make up a pool, held by reference as they are never modified. The
+    #  ledger is shared between a split transaction and its remainder.
+    __slots__ = ('transactions',)
+
+    def __init__(self, t):
+        self.transactions = [t]
+
+    def add(self, t):
+        self.transactions.append(t)
+
+    def __iter__(self):
+        return iter(self.transactions)
+
+    def __len__(self):
+        return len(self.transactions)
+
 class Buy(TransactionBase):
     TYPE_DEPOSIT = TransactionRecord.TYPE_DEPOSIT
     TYPE_MINING = TransactionRecord.TYPE_MINING
@@ -294,6 +408,9 @@ class Buy(TransactionBase):
     ACQUISITION_TYPES = {TYPE_MINING, TYPE_STAKING, TYPE_INTEREST, TYPE_DIVIDEND,
                          TYPE_INCOME, TYPE_GIFT_RECEIVED, TYPE_AIRDROP, TYPE_TRADE}
 
+    __slots__ = ('acquisition', 'cost', 'cost_fixed')
+    ALL_SLOTS = TransactionBase.__slots__ + __slots__
+
     def __init__(self, t_type, buy_quantity, buy_asset, buy_value):
         super(Buy, self).__init__(t_type, buy_asset, buy_quantity)
         self.acquisition = bool(self.t_type in self.ACQUISITION_TYPES)
@@ -306,7 +423,7 @@ class Buy(TransactionBase):
 
     def __iadd__(self, other):
         if not self.pooled:
-            self.pooled.append(copy.deepcopy(self))
+            self.pooled = PoolLedger(copy.copy(self))
 
         # Pool buys
         if self.asset != other.asset:
@@ -335,11 +452,11 @@ class Buy(TransactionBase):
         if other.note != self.note:
             self.note = "<pooled>"
 
-        self.pooled.append(other)
+        self.pooled.add(other)
         return self
 
     def split_buy(self, sell_quantity):
-        remainder = copy.deepcopy(self)
+        remainder = copy.copy(self)
 
         self.cost = self.cost * (sell_quantity / self.quantity)
 
@@ -395,6 +512,9 @@ class Sell(TransactionBase):
     DISPOSAL_TYPES = {TYPE_SPEND, TYPE_GIFT_SENT, TYPE_GIFT_SPOUSE, TYPE_CHARITY_SENT,
                       TYPE_LOST, TYPE_TRADE}
 
+    __slots__ = ('disposal', 'proceeds', 'proceeds_fixed')
+    ALL_SLOTS = TransactionBase.__slots__ + __slots__
+
     def __init__(self, t_type, sell_quantity, sell_asset, sell_value):
         super(Sell, self).__init__(t_type, sell_asset, sell_quantity)
         self.disposal = bool(self.t_type in self.DISPOSAL_TYPES)
@@ -407,7 +527,7 @@ class Sell(TransactionBase):
 
     def __iadd__(self, other):
         if not self.pooled:
-            self.pooled.append(copy.deepcopy(self))
+            self.pooled = PoolLedger(copy.copy(self))
 
         # Pool sells
         if self.asset != other.asset:
@@ -436,11 +556,11 @@ class Sell(TransactionBase):
         if other.note != self.note:
             self.note = "<pooled>"
 
-        self.pooled.append(other)
+        self.pooled.add(other)
         return self
 
     def split_sell(self, buy_quantity):
-        remainder = copy.deepcopy(self)
+        remainder = copy.copy(self)
 
         self.proceeds = self.proceeds * (buy_quantity / self.quantity)
 
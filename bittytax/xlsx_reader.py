@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import re
+import zipfile
+import posixpath
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+import xlrd
+from xlrd.sheet import Cell
+from xlrd.biffh import error_text_from_code
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+ERROR_CODES = {text: code for code, text in error_text_from_code.items()}
+
+# Built-in number formats which are dates
+DATE_FORMATS = set(range(14, 23)) | set(range(45, 48))
+
+ESCAPED_CHAR = re.compile(r'_x([0-9A-Fa-f]{4})_')
+
+ROW_TAG = NS_MAIN + 'row'
+VALUE_TAG = NS_MAIN + 'v'
+IS_TAG = NS_MAIN + 'is'
+
+EMPTY_CELL = Cell(xlrd.XL_CELL_EMPTY, '')
+
+# Column letters of a cell reference, to column index
+COLUMN_INDEX = {}
+
+def open_workbook(filename, ragged_rows=False):
+    # An .xlsx workbook is read directly from its XML, a row at a time, anything else is
+    #  left to xlrd
+    if zipfile.is_zipfile(filename):
+        xlsx_file = zipfile.ZipFile(filename)
+        names = {name.replace('\\', '/').lower(): name for name in xlsx_file.namelist()}
+        if 'xl/workbook.xml' in names:
+            return XlsxWorkbook(xlsx_file, names, ragged_rows)
+        xlsx_file.close()
+
+    return xlrd.open_workbook(filename, ragged_rows=ragged_rows)
+
+def unescape(text):
+    return ESCAPED_CHAR.sub(lambda match: u'%c' % int(match.group(1), 16), text)
+
+def get_text(elem):
+    # Text is stripped unless its whitespace is preserved, the same as xlrd
+    text = elem.text
+    if text is None:
+        return ''
+    if elem.get(XML_SPACE) != 'preserve':
+        text = text.strip('\t\n \r')
+    return unescape(text)
+
+def get_string(elem):
+    # A string is either plain text, or runs of rich text (phonetic runs are ignored)
+    strings = []
+    for child in elem:
+        if child.tag == NS_MAIN + 't':
+            strings.append(get_text(child))
+        elif child.tag == NS_MAIN + 'r':
+            strings.extend(get_text(t) for t in child if t.tag == NS_MAIN + 't')
+    return ''.join(strings)
+
+def is_date_format(format_code):
+    # The same heuristics as xlrd, ignoring quoted text, escaped characters and [sections]
+    reduced = re.sub(r'"[^"]*"?|[\\_*].?|[$\-+/(): ]', '', format_code)
+    reduced = re.sub(r'\[[^]]*\]', '', reduced)
+    if reduced in ('0.00E+00', '##0.0E+0', 'General', 'GENERAL', 'general', '@'):
+        return False
+
+    date_cnt = sum(1 for c in reduced if c in 'ymdhsYMDHS')
+    num_cnt = sum(1 for c in reduced if c in '0#?')
+    return date_cnt > num_cnt
+
+def column_index(cell_ref):
+    column = cell_ref.rstrip('0123456789')
+    if column not in COLUMN_INDEX:
+        col = 0
+        for c in column:
+            if 'A' <= c <= 'Z':
+                col = col * 26 + ord(c) - ord('A') + 1
+        COLUMN_INDEX[column] = col - 1
+    return COLUMN_INDEX[column]
+
+class XlsxWorkbook(object):
+    def __init__(self, xlsx_file, names, ragged_rows=False):
+        self.xlsx_file = xlsx_file
+        self.names = names
+        self.ragged_rows = ragged_rows
+        self.datemode = 0
+        self.worksheets = []
+        self.date_styles = set()
+        self.shared_strings = []
+
+        self._read_workbook()
+        self._read_styles()
+        self._read_shared_strings()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release_resources()
+
+    def open(self, name):
+        return self.xlsx_file.open(self.names[name])
+
+    def sheets(self):
+        return self.worksheets
+
+    def release_resources(self):
+        self.xlsx_file.close()
+        self.shared_strings = []
+
+    def _read_workbook(self):
+        targets = {}
+        if 'xl/_rels/workbook.xml.rels' in self.names:
+            with self.open('xl/_rels/workbook.xml.rels') as rels_file:
+                for rel in ElementTree.parse(rels_file).getroot().iter(NS_PKG_REL +
+                                                                       'Relationship'):
+                    if rel.get('Type').split('/')[-1] != 'worksheet':
+                        # Chart sheets have no cells
+                        continue
+
+                    target = rel.get('Target').replace('\\', '/').lower()
+                    if target.startswith('/'):
+                        targets[rel.get('Id')] = target[1:]
+                    else:
+                        targets[rel.get('Id')] = posixpath.normpath(posixpath.join('xl', target))
+
+        with self.open('xl/workbook.xml') as workbook_file:
+            root = ElementTree.parse(workbook_file).getroot()
+
+        workbook_pr = root.find(NS_MAIN + 'workbookPr')
+        if workbook_pr is not None and workbook_pr.get('date1904') in ('1', 'true', 'on'):
+            self.datemode = 1
+
+        for sheet in root.iter(NS_MAIN + 'sheet'):
+            target = targets.get(sheet.get(NS_REL + 'id'))
+            if target in self.names:
+                self.worksheets.append(XlsxWorksheet(self, unescape(sheet.get('name')), target))
+
+    def _read_styles(self):
+        if 'xl/styles.xml' not in self.names:
+            return
+
+        with self.open('xl/styles.xml') as styles_file:
+            root = ElementTree.parse(styles_file).getroot()
+
+        date_formats = set(DATE_FORMATS)
+        for num_fmt in root.iter(NS_MAIN + 'numFmt'):
+            if is_date_format(num_fmt.get('formatCode', '')):
+                date_formats.add(int(num_fmt.get('numFmtId')))
+            else:
+                date_formats.discard(int(num_fmt.get('numFmtId')))
+
+        # Styles are kept as they appear in the cells, so they don't need converting
+        cell_xfs = root.find(NS_MAIN + 'cellXfs')
+        if cell_xfs is not None:
+            self.date_styles = set(str(style)
+                                   for style, xf in enumerate(cell_xfs.iter(NS_MAIN + 'xf'))
+                                   if int(xf.get('numFmtId', '0')) in date_formats)
+
+    def _read_shared_strings(self):
+        if 'xl/sharedstrings.xml' not in self.names:
+            return
+
+        with self.open('xl/sharedstrings.xml') as strings_file:
+            for _, elem in ElementTree.iterparse(strings_file):
+                if elem.tag == NS_MAIN + 'si':
+                    self.shared_strings.append(get_string(elem))
+                    elem.clear()
+
+class XlsxWorksheet(object):
+    def __init__(self, workbook, name, target):
+        self.workbook = workbook
+        self.name = name
+        self.target = target
+        self.nrows = self._read_dimension()
+
+    def _read_dimension(self):
+        # Only used for progress, the rows are counted as they are read
+        with self.workbook.open(self.target) as sheet_file:
+            for _, elem in ElementTree.iterparse(sheet_file, events=('start',)):
+                if elem.tag == NS_MAIN + 'dimension':
+                    ref = elem.get('ref', '').split(':')[-1].lstrip('$ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                    return int(ref) if ref.isdigit() else None
+                if elem.tag == NS_MAIN + 'sheetData':
+                    break
+        return None
+
+    def get_rows(self):
+        if self.workbook.ragged_rows:
+            return self.read_rows()
+
+        # Rows are padded to the widest row, which isn't known until they have all been read
+        rows = list(self.read_rows())
+        ncols = max([len(row) for row in rows] or [0])
+        for row in rows:
+            row.extend([EMPTY_CELL] * (ncols - len(row)))
+        return iter(rows)
+
+    def read_rows(self):
+        # Each row is cleared once it has been read, so the cells aren't held in memory. As with
+        #  xlrd, cells without a value are empty, and so are any rows which are missing before
+        #  the last row with a value.
+        row_num = 0
+        next_row_num = -1
+
+        with self.workbook.open(self.target) as sheet_file:
+            for _, elem in ElementTree.iterparse(sheet_file):
+                if elem.tag != ROW_TAG:
+                    continue
+
+                next_row_num = int(elem.get('r')) - 1 if elem.get('r') else next_row_num + 1
+                row = self._read_row(elem)
+                elem.clear()
+
+                if row:
+                    while row_num < next_row_num:
+                        yield []
+                        row_num += 1
+
+                    yield row
+                    row_num += 1
+
+    def _read_row(self, row_elem):
+        row = []
+        col = -1
+
+        for cell_elem in row_elem:
+            cell_ref = cell_elem.get('r')
+            col = column_index(cell_ref) if cell_ref else col + 1
+            cell = self._read_cell(cell_elem)
+            if cell is not None:
+                if col > len(row):
+                    row.extend([EMPTY_CELL] * (col - len(row)))
+                row.append(cell)
+
+        return row
+
+    def _read_cell(self, cell_elem):
+        cell_type = cell_elem.get('t', 'n')
+        if cell_type == 'inlineStr' and cell_elem.find(IS_TAG) is not None:
+            value = get_string(cell_elem.find(IS_TAG))
+        else:
+            value_elem = cell_elem.find(VALUE_TAG)
+            if value_elem is None:
+                value = None
+            elif cell_type == 'str':
+                value = get_text(value_elem)
+            else:
+                value = value_elem.text
+
+        if cell_type == 'n':
+            if not value:
+                return None
+            if cell_elem.get('s', '0') in self.workbook.date_styles:
+                return Cell(xlrd.XL_CELL_DATE, float(value))
+            return Cell(xlrd.XL_CELL_NUMBER, float(value))
+
+        if cell_type == 's':
+            if not value:
+                return None
+            return Cell(xlrd.XL_CELL_TEXT, self.workbook.shared_strings[int(value)])
+
+        if cell_type == 'str':
+            return Cell(xlrd.XL_CELL_TEXT, value or '')
+
+        if cell_type == 'b':
+            return Cell(xlrd.XL_CELL_BOOLEAN, 1 if value in ('1', 'true', 'on') else 0)
+
+        if cell_type == 'e':
+            return Cell(xlrd.XL_CELL_ERROR, ERROR_CODES.get(value or '#N/A', 0x2A))
+
+        # Inline strings, or any other type (i.e. ISO 8601 dates) are left as text
+        if not value:
+            return None
+        return Cell(xlrd.XL_CELL_TEXT, value)
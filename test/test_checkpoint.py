@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import io
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# pylint: disable=wrong-import-position
+from bittytax.config import config
+from bittytax.session import Session
+from bittytax.import_records import ImportRecords
+from bittytax.single_pass import SinglePass
+from bittytax.tax import TaxCalculator
+from bittytax.checkpoint import Checkpoints
+
+ASSETS = ['BTC', 'ETH', 'XRP']
+WALLETS = ['Binance', 'Kraken']
+HEADER = ['Type', 'Buy Quantity', 'Buy Asset', 'Buy Value', 'Sell Quantity', 'Sell Asset',
+          'Sell Value', 'Fee Quantity', 'Fee Asset', 'Fee Value', 'Wallet', 'Timestamp', 'Note']
+
+class FixedValueAsset(object):
+    # Prices are made up from the asset and date, so every run values the records the same
+    def __init__(self):
+        self.price_report = {}
+
+    def prefetch(self, _price_requests):
+        pass
+
+    @staticmethod
+    def get_value(asset, timestamp, quantity):
+        if asset == config.ccy:
+            return quantity, True
+        rng = random.Random(asset + timestamp.strftime('%Y-%m-%d'))
+        return quantity * Decimal(rng.randint(100, 50000)), False
+
+def generate_csv(num_rows, seed):
+    rng = random.Random(seed)
+    start = datetime(2016, 1, 1)
+    lines = [u','.join(HEADER)]
+
+    for i in range(num_rows):
+        timestamp = (start + timedelta(hours=i * 17 + rng.randint(0, 16))).isoformat() + 'Z'
+        asset = rng.choice(ASSETS)
+        quantity = str(Decimal(rng.randint(1, 10**6)) / 10**4)
+        value = str(Decimal(rng.randint(1, 10**6)) / 100)
+        kind = rng.random()
+
+        if kind < 0.45:
+            row = ['Trade', quantity, asset, value, value, 'GBP', '']
+        elif kind < 0.75:
+            row = ['Trade', value, 'GBP', '', quantity, asset, value]
+        elif kind < 0.85:
+            row = ['Staking', quantity, asset, '', '', '', '']
+        else:
+            row = ['Spend', '', '', '', quantity, asset, '']
+
+        lines.append(u','.join(row + ['', '', '', rng.choice(WALLETS), timestamp, '']))
+
+    return u'\n'.join(lines) + u'\n'
+
+class TestCheckpointResume(unittest.TestCase):
+    def setUp(self):
+        self.csv_data = generate_csv(1200, 1)
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.resume_dir = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = io.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.checkpoint_dir)
+        shutil.rmtree(self.resume_dir)
+
+    def calculate(self, checkpoint_dir=None):
+        # The same steps as the accounting tool, see do_tax
+        session = Session(value_asset=FixedValueAsset())
+        import_records = ImportRecords(session=session)
+        csv_file = io.StringIO(self.csv_data)
+        csv_file.name = 'checkpoint.csv'
+        import_records.import_csv(csv_file)
+        transaction_records = import_records.get_records()
+
+        checkpoints = resume_from = None
+        if checkpoint_dir:
+            Checkpoints.CHECKPOINT_DIR = checkpoint_dir
+            checkpoints = Checkpoints(transaction_records, session.tax_rules, False)
+            resume_from = checkpoints.load()
+            if resume_from:
+                session.value_asset.price_report.update(resume_from.price_report)
+
+        single_pass = SinglePass(transaction_records, session,
+                                 resume_from.end if resume_from else None)
+        tax = TaxCalculator(single_pass.transactions, session,
+                            checkpoints.new_checkpoints(resume_from) if checkpoints else None,
+                            resume_from)
+        tax.process_disposals(False)
+        tax.process_income(single_pass.get_income_events())
+
+        if checkpoints:
+            checkpoints.save(tax.checkpoints, tax.tax_events, session.value_asset.price_report)
+
+        return tax, resume_from
+
+    @staticmethod
+    def get_tax_events(tax):
+        return {tax_year: [(type(tax_event).__name__,) +
+                           tuple(getattr(tax_event, name, None)
+                                 for name in ('date', 'asset', 'disposal_type', 'type',
+                                              'quantity', 'cost', 'fees', 'proceeds', 'gain',
+                                              'amount', 'acquisition_date'))
+                           for tax_event in tax.tax_events[tax_year]]
+                for tax_year in tax.tax_events}
+
+    @staticmethod
+    def get_holdings(tax):
+        return {asset: (tax.holdings[asset].quantity, tax.holdings[asset].cost,
+                        tax.holdings[asset].fees)
+                for asset in tax.holdings}
+
+    def test_resume_matches_full_run(self):
+        full_tax, _ = self.calculate()
+        self.calculate(self.checkpoint_dir)
+
+        checkpoint_files = sorted(os.listdir(self.checkpoint_dir))
+        self.assertTrue(len(checkpoint_files) > 1)
+
+        # Resume from each checkpoint in turn, i.e. as if the run had been cut at it
+        for checkpoint_file in checkpoint_files:
+            for filename in os.listdir(self.resume_dir):
+                os.remove(os.path.join(self.resume_dir, filename))
+            shutil.copy(os.path.join(self.checkpoint_dir, checkpoint_file), self.resume_dir)
+
+            tax, resume_from = self.calculate(self.resume_dir)
+            self.assertIsNotNone(resume_from)
+            self.assertEqual(self.get_tax_events(tax), self.get_tax_events(full_tax))
+            self.assertEqual(self.get_holdings(tax), self.get_holdings(full_tax))
+
+    def test_corrupt_checkpoint_is_ignored(self):
+        self.calculate(self.checkpoint_dir)
+        for filename in os.listdir(self.checkpoint_dir):
+            with open(os.path.join(self.checkpoint_dir, filename), 'wb') as checkpoint_file:
+                checkpoint_file.write(b'not a checkpoint')
+
+        _, resume_from = self.calculate(self.checkpoint_dir)
+        self.assertIsNone(resume_from)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import os
+import sys
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# pylint: disable=wrong-import-position
+from bittytax.timestamp_parser import TimestampParser
+
+ISO_FORMATS = ['%Y-%m-%dT%H:%M:%S',
+               '%Y-%m-%d %H:%M:%S',
+               '%Y-%m-%dT%H:%M:%S.%f',
+               '%Y-%m-%dT%H:%M:%SZ',
+               '%Y-%m-%dT%H:%M:%S.%fZ',
+               '%Y-%m-%dT%H:%M:%S+00:00',
+               '%Y-%m-%dT%H:%M:%S+0000',
+               '%Y-%m-%dT%H:%M:%S-00:00',
+               '%Y-%m-%d %H:%M:%S+01:00',
+               '%Y-%m-%dT%H:%M:%S.%f-05:30',
+               '%Y-%m-%dT%H:%M:%S+1245']
+
+OTHER_FORMATS = ['%Y-%m-%d',
+                 '%Y/%m/%d %H:%M:%S',
+                 '%Y/%m/%d %H:%M',
+                 '%Y-%m-%d %H:%M',
+                 '%Y-%m-%dT%H:%M',
+                 '%d/%m/%Y %H:%M',
+                 '%m/%d/%Y %H:%M:%S',
+                 '%d %b %Y %H:%M:%S',
+                 '%b %d, %Y, %I:%M %p']
+
+def timestamps(fmt, num_rows, seed):
+    rng = random.Random(seed)
+    start = datetime(2013, 1, 1)
+    for _ in range(num_rows):
+        timestamp = start + timedelta(seconds=rng.randint(0, 10 * 365 * 24 * 60 * 60),
+                                      microseconds=rng.randint(0, 999999))
+        timestamp_str = timestamp.strftime(fmt)
+        if '.%f' in fmt and rng.random() < 0.5:
+            # Fractions of a second don't always have 6 digits
+            whole, rest = timestamp_str.split('.', 1)
+            digits = rng.randint(1, 6)
+            timestamp_str = whole + '.' + rest[:digits] + rest[6:]
+        yield timestamp_str
+
+class TestTimestampParser(unittest.TestCase):
+    def assertSameAsDateutil(self, timestamp_strs, dayfirst=False):
+        # The parser is used for one file, so the rows are parsed in order by the same parser
+        parser = TimestampParser(dayfirst)
+        for timestamp_str in timestamp_strs:
+            # Compared by repr, so the timezones must be the same kind as well as offset
+            self.assertEqual(repr(parser.parse(timestamp_str)),
+                             repr(dateutil.parser.parse(timestamp_str, dayfirst=dayfirst)),
+                             timestamp_str)
+        return parser
+
+    def test_iso_formats(self):
+        for seed, fmt in enumerate(ISO_FORMATS):
+            parser = self.assertSameAsDateutil(timestamps(fmt, 200, seed))
+            self.assertIsNotNone(parser.fast_parser, fmt)
+
+    def test_other_formats(self):
+        for seed, fmt in enumerate(OTHER_FORMATS):
+            self.assertSameAsDateutil(timestamps(fmt, 200, seed))
+
+    def test_dayfirst(self):
+        # Both orders of day and month, including where either could be the month
+        ambiguous = ['01/02/2020 10:00', '02/01/2020 10:00', '12/11/2019 23:59:59',
+                     '13/01/2020 00:00', '01/13/2020 00:00', '2020-01-02', '2020-01-02 10:00',
+                     '2020-01-02T10:00:00', '2020-01-02T10:00:00Z', '2020-02-01T10:00:00+01:00']
+
+        for dayfirst in (False, True):
+            self.assertSameAsDateutil(ambiguous * 5, dayfirst)
+
+        for seed, fmt in enumerate(ISO_FORMATS + OTHER_FORMATS):
+            parser = self.assertSameAsDateutil(timestamps(fmt, 50, seed), dayfirst=True)
+            self.assertIsNone(parser.fast_parser, fmt)
+
+    def test_format_changes(self):
+        # A file whose timestamp format changes partway, and back again
+        timestamp_strs = (list(timestamps('%Y-%m-%dT%H:%M:%SZ', 100, 1)) +
+                          list(timestamps('%Y/%m/%d %H:%M', 100, 2)) +
+                          list(timestamps('%d/%m/%Y %H:%M', 100, 3)) +
+                          list(timestamps('%Y-%m-%d %H:%M:%S.%f+01:00', 100, 4)) +
+                          list(timestamps('%m/%d/%Y %H:%M:%S', 100, 5)) +
+                          list(timestamps('%Y-%m-%dT%H:%M:%SZ', 100, 6)))
+
+        self.assertSameAsDateutil(timestamp_strs)
+
+        rng = random.Random(7)
+        rng.shuffle(timestamp_strs)
+        self.assertSameAsDateutil(timestamp_strs)
+
+    def test_format_is_learnt_again(self):
+        parser = TimestampParser()
+        for seed, fmt in enumerate(['%Y-%m-%dT%H:%M:%SZ', '%Y/%m/%d %H:%M', '%Y-%m-%d',
+                                    '%Y-%m-%dT%H:%M:%S.%f+01:00']):
+            for timestamp_str in timestamps(fmt, 100, seed):
+                self.assertEqual(repr(parser.parse(timestamp_str)),
+                                 repr(dateutil.parser.parse(timestamp_str)), timestamp_str)
+            self.assertIsNotNone(parser.fast_parser, fmt)
+            self.assertIsNotNone(parser.fast_parser(timestamp_str), fmt)
+
+    def test_invalid_timestamps(self):
+        parser = self.assertSameAsDateutil(timestamps('%Y-%m-%dT%H:%M:%SZ', 20, 1))
+        self.assertIsNotNone(parser.fast_parser)
+
+        for timestamp_str in ('2020-02-30T00:00:00Z', '2020-01-01T24:00:00Z', 'not a date', ''):
+            self.assertRaises(ValueError, dateutil.parser.parse, timestamp_str)
+            self.assertRaises(ValueError, parser.parse, timestamp_str)
+
+if __name__ == '__main__':
+    unittest.main()
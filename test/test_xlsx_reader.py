@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# (c) Nano Nano Ltd 2019
+
+import os
+import sys
+import glob
+import struct
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import xlrd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# pylint: disable=wrong-import-position
+from bittytax.xlsx_reader import open_workbook, XlsxWorkbook
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_FILES = sorted(glob.glob(os.path.join(TEST_DIR, 'HMRC-Examples', '*.xlsx')) +
+                       glob.glob(os.path.join(TEST_DIR, os.pardir, 'data', '*.xlsx')))
+
+XMLNS = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+XMLNS_R = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+XMLNS_PKG = 'xmlns="http://schemas.openxmlformats.org/package/2006/relationships"'
+REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+
+# Cell styles: 0 is general, 1 is a built-in date format and 2 is a custom date format
+STYLES = ('<styleSheet %s>'
+          '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd hh:mm:ss"/>'
+          '</numFmts>'
+          '<cellXfs count="3"><xf numFmtId="0"/><xf numFmtId="14"/><xf numFmtId="164"/>'
+          '</cellXfs>'
+          '</styleSheet>' % XMLNS)
+
+def build_xlsx(filename, sheets, shared_strings=None, date1904=False):
+    # A workbook written directly as XML, so the cells can be laid out exactly as wanted
+    with zipfile.ZipFile(filename, 'w') as xlsx_file:
+        xlsx_file.writestr(
+            '[Content_Types].xml',
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Default Extension="rels" '
+            'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '</Types>')
+        xlsx_file.writestr(
+            '_rels/.rels',
+            '<Relationships %s><Relationship Id="rId1" Type="%sofficeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>' % (XMLNS_PKG, REL_TYPE))
+        xlsx_file.writestr(
+            'xl/workbook.xml',
+            '<workbook %s %s>%s<sheets>%s</sheets></workbook>' % (
+                XMLNS, XMLNS_R,
+                '<workbookPr date1904="1"/>' if date1904 else '<workbookPr/>',
+                ''.join('<sheet name="%s" sheetId="%d" r:id="rId%d"/>' % (name, i, i)
+                        for i, (name, _) in enumerate(sheets, 1))))
+        xlsx_file.writestr(
+            'xl/_rels/workbook.xml.rels',
+            '<Relationships %s>%s</Relationships>' % (
+                XMLNS_PKG,
+                ''.join('<Relationship Id="rId%d" Type="%sworksheet" '
+                        'Target="worksheets/sheet%d.xml"/>' % (i, REL_TYPE, i)
+                        for i in range(1, len(sheets) + 1))))
+        xlsx_file.writestr('xl/styles.xml', STYLES)
+
+        if shared_strings is not None:
+            xlsx_file.writestr('xl/sharedStrings.xml',
+                               '<sst %s>%s</sst>' % (XMLNS, ''.join(shared_strings)))
+
+        for i, (_, rows) in enumerate(sheets, 1):
+            xlsx_file.writestr('xl/worksheets/sheet%d.xml' % i,
+                               '<worksheet %s><sheetData>%s</sheetData></worksheet>' % (
+                                   XMLNS, ''.join(rows)))
+
+def build_xls(filename, rows):
+    # A BIFF2 worksheet stream, which xlrd reads without the compound document around it
+    def record(opcode, data):
+        return struct.pack('<HH', opcode, len(data)) + data
+
+    data = record(0x0009, struct.pack('<HH', 0x0002, 0x0010))
+    data += record(0x0042, struct.pack('<H', 1252))
+    for row_num, row in enumerate(rows):
+        for col_num, value in enumerate(row):
+            if isinstance(value, float):
+                data += record(0x0003, struct.pack('<HH3sd', row_num, col_num, b'\0\0\0', value))
+            else:
+                value = value.encode('latin-1')
+                data += record(0x0004, struct.pack('<HH3sB', row_num, col_num, b'\0\0\0',
+                                                   len(value)) + value)
+    data += record(0x000A, b'')
+
+    with open(filename, 'wb') as xls_file:
+        xls_file.write(data)
+
+def cells(row):
+    return [(cell.ctype, cell.value) for cell in row]
+
+class TestXlsxReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertSameAsXlrd(self, filename):
+        # The sheets, rows and cells must be the same as xlrd's, with and without ragged rows
+        for ragged_rows in (False, True):
+            xlrd_workbook = xlrd.open_workbook(filename, ragged_rows=ragged_rows)
+            with open_workbook(filename, ragged_rows=ragged_rows) as workbook:
+                self.assertIsInstance(workbook, XlsxWorkbook)
+                self.assertEqual(workbook.datemode, xlrd_workbook.datemode)
+                self.assertEqual([sheet.name for sheet in workbook.sheets()],
+                                 [sheet.name for sheet in xlrd_workbook.sheets()])
+
+                for sheet, xlrd_sheet in zip(workbook.sheets(), xlrd_workbook.sheets()):
+                    self.assertEqual([cells(row) for row in sheet.get_rows()],
+                                     [cells(xlrd_sheet.row(i)) for i in range(xlrd_sheet.nrows)],
+                                     "%s: %s" % (os.path.basename(filename), sheet.name))
+            xlrd_workbook.release_resources()
+
+    def test_example_files(self):
+        self.assertTrue(EXAMPLE_FILES)
+        for filename in EXAMPLE_FILES:
+            self.assertSameAsXlrd(filename)
+
+    def test_shared_and_inline_strings(self):
+        filename = os.path.join(self.tmp_dir, 'strings.xlsx')
+        build_xlsx(filename, [('Strings', [
+            '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>'
+            '<c r="C1" t="s"><v>2</v></c><c r="D1" t="s"><v>3</v></c></row>',
+            '<row r="2"><c r="A2" t="inlineStr"><is><t>Inline</t></is></c>'
+            '<c r="B2" t="inlineStr"><is><r><t>Rich </t></r><r><t>inline</t></r></is></c>'
+            '<c r="C2" t="str"><v>Formula</v></c><c r="D2" t="s"><v>0</v></c></row>',
+        ])], shared_strings=[
+            '<si><t>Shared</t></si>',
+            '<si><r><t>Rich </t></r><r><rPr><b/></rPr><t>text</t></r>'
+            '<rPh sb="0" eb="1"><t>phonetic</t></rPh></si>',
+            '<si><t xml:space="preserve">  Preserved  </t></si>',
+            '<si><t>  Stripped  </t></si>',
+        ])
+        self.assertSameAsXlrd(filename)
+
+    def test_date_cells(self):
+        rows = [
+            '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" s="1"><v>43466</v></c>'
+            '<c r="C1" s="2"><v>43466.5208333333</v></c><c r="D1"><v>43466</v></c></row>',
+            '<row r="2"><c r="A2" t="s"><v>0</v></c><c r="B2" s="1"><v>1</v></c>'
+            '<c r="C2" s="2"><v>0.25</v></c><c r="D2" s="0"><v>1.5</v></c></row>',
+        ]
+        shared_strings = ['<si><t>Date</t></si>']
+
+        for date1904 in (False, True):
+            filename = os.path.join(self.tmp_dir, 'dates%d.xlsx' % date1904)
+            build_xlsx(filename, [('Dates', rows)], shared_strings, date1904)
+            self.assertSameAsXlrd(filename)
+
+            xlrd_workbook = xlrd.open_workbook(filename)
+            with open_workbook(filename) as workbook:
+                self.assertEqual(workbook.datemode, 1 if date1904 else 0)
+                row = next(workbook.sheets()[0].get_rows())
+                self.assertEqual(xlrd.xldate_as_datetime(row[2].value, workbook.datemode),
+                                 xlrd.xldate_as_datetime(xlrd_workbook.sheet_by_index(0).cell(0, 2)
+                                                         .value, xlrd_workbook.datemode))
+
+    def test_sparse_and_ragged_rows(self):
+        filename = os.path.join(self.tmp_dir, 'sparse.xlsx')
+        build_xlsx(filename, [('Sparse', [
+            '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1"/><c r="C1" t="s"><v>1</v></c></row>',
+            '<row r="2"><c r="B2"><v>2</v></c></row>',
+            '<row r="3"><c r="A3"/></row>',
+            '<row r="5"><c r="A5" t="b"><v>1</v></c><c r="B5" t="e"><v>#DIV/0!</v></c>'
+            '<c r="F5"><v>6</v></c></row>',
+            '<row><c t="s"><v>0</v></c><c><v>7</v></c></row>',
+            '<row r="9"><c r="A9"/></row>',
+        ]), ('Empty', [])], shared_strings=['<si><t>A</t></si>', '<si><t>C</t></si>'])
+        self.assertSameAsXlrd(filename)
+
+        with open_workbook(filename, ragged_rows=True) as workbook:
+            self.assertEqual([len(row) for row in workbook.sheets()[0].get_rows()],
+                             [3, 2, 0, 0, 6, 2])
+
+    def test_xls_is_read_by_xlrd(self):
+        filename = os.path.join(self.tmp_dir, 'records.xls')
+        build_xls(filename, [['Type', 'Quantity'], ['Deposit', 1.5]])
+
+        workbook = open_workbook(filename)
+        self.assertIsInstance(workbook, xlrd.Book)
+        sheet = workbook.sheets()[0]
+        self.assertEqual([cells(sheet.row(i)) for i in range(sheet.nrows)],
+                         [[(xlrd.XL_CELL_TEXT, 'Type'), (xlrd.XL_CELL_TEXT, 'Quantity')],
+                          [(xlrd.XL_CELL_TEXT, 'Deposit'), (xlrd.XL_CELL_NUMBER, 1.5)]])
+        workbook.release_resources()
+
+if __name__ == '__main__':
+    unittest.main()